@@ -5,15 +5,21 @@ import difflib
 import re
 from contextlib import suppress
 from functools import cache
+from html.parser import HTMLParser
 from typing import TYPE_CHECKING
 
 import mwparserfromhell
 import pywikibot
 from pywikibot.page import Revision
+from pywikibot.tools.itertools import itergroup
 from pywikibot_extensions.page import Page
 
+from copypatrol_backend import metrics
+
 
 if TYPE_CHECKING:
+    from collections.abc import Mapping
+
     from pywikibot.site import APISite
 
 
@@ -34,63 +40,203 @@ def _file_name_regex(site: APISite, /) -> re.Pattern[str]:
 
 
 def _clean_wikitext(text: str, /, *, site: APISite) -> str:
-    text = text.strip()
-    if not text:
-        return ""
+    with metrics.timed("clean_wikitext", site=site.hostname()):
+        text = text.strip()
+        if not text:
+            return ""
+
+        # remove bold/italic wikitext markup
+        text = re.sub(r"(?P<open>'{2,3})(.+?)(?P=open)", r"\2", text)
 
-    # remove bold/italic wikitext markup
-    text = re.sub(r"(?P<open>'{2,3})(.+?)(?P=open)", r"\2", text)
+        text = _category_regex(site).sub("", text)
 
-    text = _category_regex(site).sub("", text)
+        # remove quotes of less than 50 words
+        for quote in re.findall('".+?"', text):
+            if len(quote.split()) < 50:
+                text = text.replace(quote, "")
 
-    # remove quotes of less than 50 words
-    for quote in re.findall('".+?"', text):
-        if len(quote.split()) < 50:
-            text = text.replace(quote, "")
+        wikicode = mwparserfromhell.parse(text, skip_style_tags=True)
+        for link in wikicode.ifilter_external_links():
+            wikicode.replace(link, link.title or "")
+        text = wikicode.strip_code(keep_template_params=True)
 
-    wikicode = mwparserfromhell.parse(text, skip_style_tags=True)
-    for link in wikicode.ifilter_external_links():
-        wikicode.replace(link, link.title or "")
-    text = wikicode.strip_code(keep_template_params=True)
+        text = _file_name_regex(site).sub("", text)
+        text = re.sub(r" {2,}", " ", text)
+        text = "\n".join(line.strip() for line in text.splitlines())
+        text = re.sub(r"( ?\n){3,}", r"\n\n", text)
 
-    text = _file_name_regex(site).sub("", text)
-    text = re.sub(r" {2,}", " ", text)
-    text = "\n".join(line.strip() for line in text.splitlines())
-    text = re.sub(r"( ?\n){3,}", r"\n\n", text)
+        return text.strip()
 
-    return text.strip()
 
+def _added_revision_text(
+    old: str,
+    new: str,
+    /,
+    *,
+    site: APISite,
+    full_old: str | None = None,
+) -> str:
+    """Return the text inserted in new that is not already in old.
 
-def _added_revision_text(old: str, new: str, /, *, site: APISite) -> str:
+    When old is only part of the old revision, full_old is the whole
+    revision to look for the inserted text in.
+    """
     old = _clean_wikitext(old, site=site)
     new = _clean_wikitext(new, site=site)
-    sm = difflib.SequenceMatcher(None, old, new)
-    return "\n".join(
-        part.strip(" ")
-        for op, _, _, new_start, new_end in sm.get_opcodes()
-        if op in ("insert", "replace")
-        if new_end - new_start > 50
-        if (part := "".join(new[new_start:new_end])) not in old
-    ).strip()
+    known = old if full_old is None else _clean_wikitext(full_old, site=site)
+    with metrics.timed("diff", site=site.hostname()):
+        sm = difflib.SequenceMatcher(None, old, new)
+        return "\n".join(
+            part.strip(" ")
+            for op, _, _, new_start, new_end in sm.get_opcodes()
+            if op in ("insert", "replace")
+            if new_end - new_start > 50
+            if (part := "".join(new[new_start:new_end])) not in known
+        ).strip()
 
 
 def _load_revisions(
     site: APISite,
     revids: list[int],
     /,
+    *,
+    content: bool = True,
+) -> dict[int, Revision]:
+    params = {"rvslots": "main"} if content else {}
+    result = {}
+    for batch in itergroup(revids, 50):
+        with metrics.timed("load_revisions", site=site.hostname()):
+            data = site.simple_request(
+                action="query",
+                revids=batch,
+                prop="revisions",
+                rvprop=site._rvprops(content=content),
+                **params,
+            ).submit()
+        result.update(
+            {
+                rev["revid"]: Revision(**rev)
+                for page in data["query"]["pages"].values()
+                for rev in page["revisions"]
+            }
+        )
+    return result
+
+
+def revision_metadata(
+    site: APISite,
+    revids: list[int],
+    /,
 ) -> dict[int, Revision]:
-    data = site.simple_request(
-        action="query",
-        revids=revids,
-        prop="revisions",
-        rvprop=site._rvprops(content=True),
-        rvslots="*",
-    ).submit()
-    return {
-        rev["revid"]: Revision(**rev)
-        for page in data["query"]["pages"].values()
-        for rev in page["revisions"]
-    }
+    """Return the revisions without their content."""
+    return _load_revisions(site, revids, content=False)
+
+
+class _TableDiffParser(HTMLParser):
+    """Collect the lines on each side of a MediaWiki table diff."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.old: list[str] = []
+        self.new: list[str] = []
+        self._side: list[str] | None = None
+        self._context_cells = 0
+        self._hunk_started = False
+
+    def handle_starttag(
+        self,
+        tag: str,
+        attrs: list[tuple[str, str | None]],
+    ) -> None:
+        if tag == "tr":
+            self._context_cells = 0
+            self._hunk_started = False
+        if tag != "td":
+            return
+        classes = (dict(attrs).get("class") or "").split()
+        if "diff-lineno" in classes:
+            # keep separate hunks in separate paragraphs
+            if not self._hunk_started and (self.old or self.new):
+                self.old.append("")
+                self.new.append("")
+            self._hunk_started = True
+            self._side = None
+        elif "diff-deletedline" in classes:
+            self._start_line(self.old)
+        elif "diff-addedline" in classes:
+            self._start_line(self.new)
+        elif "diff-context" in classes:
+            if "diff-side-added" in classes or self._context_cells:
+                self._start_line(self.new)
+            else:
+                self._start_line(self.old)
+            self._context_cells += 1
+
+    def _start_line(self, side: list[str], /) -> None:
+        side.append("")
+        self._side = side
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "td":
+            self._side = None
+
+    def handle_data(self, data: str) -> None:
+        if self._side is not None:
+            self._side[-1] += data
+
+
+def _balanced(text: str, /) -> bool:
+    return all(
+        text.count(start) == text.count(end)
+        for start, end in (("{{", "}}"), ("[[", "]]"), ("{|", "|}"))
+    )
+
+
+def _compare_revisions(
+    site: APISite,
+    old: int,
+    new: int,
+    /,
+) -> tuple[str, str] | None:
+    """Return the changed regions of two revisions with their context.
+
+    None is returned if the diff is not available or a region has
+    unbalanced markup, which would not be cleaned correctly.
+    """
+    try:
+        with metrics.timed("compare_revisions", site=site.hostname()):
+            data = site.simple_request(
+                action="compare",
+                fromrev=old,
+                torev=new,
+                prop="diff",
+                formatversion="2",
+            ).submit()
+    except pywikibot.exceptions.APIError as e:
+        pywikibot.log(f"cannot compare revisions {old} and {new}: {e}")
+        return None
+    body = data["compare"].get("body")
+    if body is None:
+        return None
+    parser = _TableDiffParser()
+    parser.feed(body)
+    parser.close()
+    old_text = "\n".join(parser.old)
+    new_text = "\n".join(parser.new)
+    if not _balanced(old_text) or not _balanced(new_text):
+        pywikibot.log(f"unbalanced markup comparing {old} and {new}")
+        return None
+    return old_text, new_text
+
+
+def _is_revert(page: pywikibot.Page, rev: Revision, /) -> bool:
+    if "mw-rollback" in rev.tags or {"mw-undo", "twinkle"} & set(rev.tags):
+        pywikibot.log(f"revision {rev.revid} to {page!r} was a revert")
+        return True
+    if "mw-reverted" in rev.tags:
+        pywikibot.log(f"revision {rev.revid} to {page!r} was reverted")
+        return True
+    return False
 
 
 def check_diff(
@@ -98,8 +244,19 @@ def check_diff(
     old: int,
     new: int,
     /,
+    *,
+    compare: bool = False,
+    metadata: Mapping[int, Revision] | None = None,
 ) -> str | None:
-    """Compare changes between two revisions."""
+    """Compare changes between two revisions.
+
+    Content is only loaded if the new revision's metadata, taken from
+    metadata when it is there, does not settle the diff. With compare,
+    only the changed regions are fetched from the wiki, falling back to
+    the full revisions when that is not possible. The old revision is
+    still loaded when enough text was added to be checked, to leave out
+    text copied from elsewhere in the page.
+    """
 
     def _small_len(text: str) -> bool:
         if len(text) < 500:
@@ -107,27 +264,40 @@ def check_diff(
             return True
         return False
 
-    revs = _load_revisions(page.site, [r for r in (old, new) if r > 0])
-    new_rev = revs[new]
-    if _small_len(new_rev.text):
+    # settle what can be settled from the metadata before loading content
+    new_rev = (metadata or {}).get(new)
+    if new_rev is None:
+        new_rev = revision_metadata(page.site, [new])[new]
+    if new_rev.size < 500:
+        pywikibot.log(f"revision {new} to {page!r} too small to compare")
         return None
-    if old > 0:
-        old_rev = revs[old]
-        if "mw-rollback" in new_rev.tags or {"mw-undo", "twinkle"} & set(
-            new_rev.tags
-        ):
-            pywikibot.log(f"revision {new} to {page!r} was a revert")
-            return None
-        if "mw-reverted" in new_rev.tags:
-            pywikibot.log(f"revision {new} to {page!r} was reverted")
-            return None
-        added_text = _added_revision_text(
-            old_rev.text,
-            new_rev.text,
-            site=page.site,
-        )
+    if old > 0 and _is_revert(page, new_rev):
+        return None
+    regions = None
+    if compare and old > 0:
+        regions = _compare_revisions(page.site, old, new)
+    if regions is not None:
+        added_text = _added_revision_text(*regions, site=page.site)
+        if len(added_text) >= 500:
+            # the regions lack the unchanged parts of the page
+            added_text = _added_revision_text(
+                *regions,
+                site=page.site,
+                full_old=_load_revisions(page.site, [old])[old].text,
+            )
     else:
-        added_text = _clean_wikitext(new_rev.text, site=page.site)
+        revs = _load_revisions(page.site, [r for r in (old, new) if r > 0])
+        new_text = revs[new].text
+        if _small_len(new_text):
+            return None
+        if old > 0:
+            added_text = _added_revision_text(
+                revs[old].text,
+                new_text,
+                site=page.site,
+            )
+        else:
+            added_text = _clean_wikitext(new_text, site=page.site)
     if _small_len(added_text):
         return None
     # remove text that may have been copied from a page linked in the comment
@@ -3,21 +3,171 @@ from __future__ import annotations
 
 import argparse
 import datetime
+import gzip
+import itertools
+import json
+import math
 import re
-from typing import TYPE_CHECKING
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, suppress
+from typing import TYPE_CHECKING, Callable, NamedTuple, TypeVar
+from urllib.parse import urlsplit
 from uuid import UUID
 
 import pywikibot
 
-from copypatrol_backend import database
-from copypatrol_backend.check_diff import check_diff
-from copypatrol_backend.config import ignore_list_title, site_config
-from copypatrol_backend.stream_listener import revision_stream
-from copypatrol_backend.tca import TurnitinCoreAPI
+from copypatrol_backend.config import (
+    archive_after,
+    coalesce_window,
+    ignore_list_title,
+    max_attempts,
+    min_age,
+    reload_on_sighup,
+    reload_snapshot,
+    retry_delay,
+    site_config,
+    tca_config,
+)
 
 
 if TYPE_CHECKING:
+    from collections.abc import Generator, Iterable, Mapping, Sequence
+
+    from pywikibot.page import Revision
     from pywikibot.site import APISite
+    from sqlalchemy.orm import Session as _Session
+
+    from copypatrol_backend import database
+    from copypatrol_backend.tca import Source, TurnitinCoreAPI
+
+
+_T = TypeVar("_T")
+
+_LITERAL_DOMAIN_REGEX = re.compile(
+    r"(?:\\b)?((?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\\\.)+[a-z]{2,63})"
+    r"(?:\\b)?",
+    flags=re.I,
+)
+_BACKREF_REGEX = re.compile(r"\\[1-9]|\(\?P=")
+# diffs per TCA worker in each batch of a job with a deadline
+_BATCH_SIZE_PER_WORKER = 4
+_PERCENTILES = (50, 95, 99)
+# subcommands that only use the database, so do not log in
+_DATABASE_ACTIONS = frozenset({"archive", "db", "stats"})
+# subcommands that run until interrupted without --daemon
+_STREAM_ACTIONS = frozenset({"prune-changes", "store-changes"})
+
+
+class _IgnoreList(NamedTuple):
+    revid: int
+    domains: frozenset[str]
+    patterns: list[re.Pattern[str]]
+
+    @classmethod
+    def from_patterns(
+        cls,
+        revid: int,
+        patterns: list[re.Pattern[str]],
+        /,
+    ) -> _IgnoreList:
+        domains = frozenset(
+            match.group(1).replace("\\.", ".").lower()
+            for pattern in patterns
+            if (match := _LITERAL_DOMAIN_REGEX.fullmatch(pattern.pattern))
+        )
+        # backreferences would be renumbered in the combined regex
+        single = [p for p in patterns if _BACKREF_REGEX.search(p.pattern)]
+        combinable = [p for p in patterns if p not in single]
+        if combinable:
+            try:
+                combined = re.compile(
+                    "|".join(f"(?:{p.pattern})" for p in combinable),
+                    flags=re.I,
+                )
+            except re.error:
+                single = patterns
+            else:
+                single.insert(0, combined)
+        return cls(revid, domains, single)
+
+    def matches(self, url: str, /) -> bool:
+        """Return whether the URL is ignored."""
+        if self.domains:
+            with suppress(ValueError):
+                labels = (urlsplit(url).hostname or "").split(".")
+                if any(
+                    ".".join(labels[i:]) in self.domains
+                    for i in range(len(labels))
+                ):
+                    return True
+        return any(pattern.search(url) for pattern in self.patterns)
+
+
+_IGNORE_LISTS: dict[APISite, _IgnoreList] = {}
+
+
+def _batches(
+    session: _Session,
+    job: str,
+    diffs: Sequence[database.Diff],
+    /,
+    *,
+    deadline: float | None = None,
+) -> Generator[list[database.Diff], None, None]:
+    """Yield batches of diffs, resuming after the job's checkpoint.
+
+    Without a deadline, all diffs are yielded as one batch. Otherwise,
+    once the deadline (a time.monotonic() value) has passed, stop and
+    save the last diff yielded as the checkpoint.
+    """
+    from copypatrol_backend import database
+
+    start = database.checkpoint(session, job)
+    ordered = sorted(diffs, key=lambda d: (d.diff_id <= start, d.diff_id))
+    if deadline is None:
+        size = max(len(ordered), 1)
+    else:
+        size = _BATCH_SIZE_PER_WORKER * tca_config().max_workers
+    for i in range(0, len(ordered), size):
+        if i and deadline is not None and time.monotonic() >= deadline:
+            database.set_checkpoint(session, job, ordered[i - 1].diff_id)
+            pywikibot.log(f"{job}: stopping with {len(ordered) - i} left")
+            return
+        end = i + size
+        yield ordered[i:end]
+    database.set_checkpoint(session, job, 0)
+
+
+def _map_concurrently(
+    func: Callable[[UUID], _T],
+    sids: Iterable[UUID],
+    /,
+) -> dict[UUID, _T]:
+    """Call func for each submission using the TCA worker pool.
+
+    Submissions for which func raised are logged and left out.
+    """
+    result: dict[UUID, _T] = {}
+    with ThreadPoolExecutor(max_workers=tca_config().max_workers) as pool:
+        futures = {pool.submit(func, sid): sid for sid in sids}
+        for future in as_completed(futures):
+            try:
+                result[futures[future]] = future.result()
+            except Exception:  # pragma: no cover
+                pywikibot.exception()
+    return result
+
+
+def _reload_config() -> None:
+    """Use the configuration files if they changed or SIGHUP was received."""
+    try:
+        if reload_snapshot():
+            pywikibot.log("configuration reloaded")
+    except Exception:
+        # keep the current configuration until the files are fixed
+        pywikibot.exception()
 
 
 def _store_changes(
@@ -26,101 +176,533 @@ def _store_changes(
     *,
     since: datetime.datetime | None = None,
     total: int | None = None,
+    stream_url: str | None = None,
 ) -> None:
-    for event in revision_stream(site, since=since, total=total):
+    from copypatrol_backend import database, metrics
+    from copypatrol_backend.stream_listener import revision_stream
+
+    # EventStreams may redeliver events, e.g. after reconnecting
+    seen: OrderedDict[tuple[str, int], None] = OrderedDict()
+    events = revision_stream(site, since=since, total=total, url=stream_url)
+    for event in events:
+        _reload_config()
+        domain = event["meta"]["domain"]
+        key = (domain, event["rev_id"])
+        if key in seen:
+            metrics.increment(
+                "copypatrol_stream_events",
+                site=domain,
+                outcome="duplicate",
+            )
+            continue
+        seen[key] = None
+        if len(seen) > 10_000:
+            seen.popitem(last=False)
+        with metrics.timed("store", site=domain):
+            with database.Session.begin() as db_session:
+                database.add_revision(
+                    session=db_session,
+                    page=pywikibot.Page(
+                        pywikibot.Site(url=event["meta"]["uri"]),
+                        event["page_title"],
+                        event["page_namespace"],
+                    ),
+                    rev_id=event["rev_id"],
+                    rev_parent_id=event["rev_parent_id"],
+                    rev_timestamp=pywikibot.Timestamp.set_timestamp(
+                        event["rev_timestamp"]
+                    ),
+                    rev_user_text=event["performer"]["user_text"],
+                )
+        metrics.increment(
+            "copypatrol_stream_events",
+            site=domain,
+            outcome="stored",
+        )
+
+
+def _record_changes(
+    site: APISite,
+    path: str,
+    /,
+    *,
+    since: datetime.datetime | None = None,
+    total: int | None = None,
+) -> None:
+    """Append the unfiltered revision events to a gzipped JSON lines file."""
+    from copypatrol_backend.stream_listener import raw_revision_stream
+
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for event in raw_revision_stream(site, since=since, total=total):
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+
+def _revision_metadata(
+    diffs: Iterable[database.Diff],
+    /,
+) -> dict[APISite, dict[int, Revision]]:
+    """Load the metadata of the diffs' new revisions in batches per site."""
+    from copypatrol_backend.check_diff import revision_metadata
+
+    revids: defaultdict[APISite, list[int]] = defaultdict(list)
+    for diff in diffs:
+        revids[pywikibot.Site(diff.lang, diff.project)].append(diff.rev_id)
+    result: dict[APISite, dict[int, Revision]] = {}
+    for site, site_revids in revids.items():
+        try:
+            result[site] = revision_metadata(site, site_revids)
+        except Exception:  # pragma: no cover
+            # check_diff will load what it needs
+            pywikibot.exception()
+    return result
+
+
+def _prune_changes(
+    site: APISite,
+    /,
+    *,
+    since: datetime.datetime | None = None,
+    total: int | None = None,
+) -> None:
+    from copypatrol_backend import database
+    from copypatrol_backend.stream_listener import revert_stream
+
+    for event in revert_stream(site, since=since, total=total):
+        _reload_config()
+        event_site = pywikibot.Site(url=event["meta"]["uri"])
         with database.Session.begin() as db_session:
-            database.add_revision(
-                session=db_session,
-                page=pywikibot.Page(
-                    pywikibot.Site(url=event["meta"]["uri"]),
-                    event["page_title"],
-                    event["page_namespace"],
-                ),
-                rev_id=event["rev_id"],
-                rev_parent_id=event["rev_parent_id"],
-                rev_timestamp=event["rev_timestamp"],
-                rev_user_text=event["performer"]["user_text"],
+            if event["meta"]["stream"] == "mediawiki.page-delete":
+                pywikibot.log(f"page {event['page_title']} was deleted")
+                database.remove_page(
+                    db_session,
+                    pywikibot.Page(
+                        event_site,
+                        event["page_title"],
+                        event["page_namespace"],
+                    ),
+                    status=[
+                        database.Status.MERGED,
+                        database.Status.UNSUBMITTED,
+                        database.Status.CREATED,
+                    ],
+                )
+            else:
+                pywikibot.log(f"revision {event['rev_id']} was reverted")
+                database.restore_merged(
+                    db_session,
+                    event_site,
+                    event["rev_id"],
+                )
+                database.remove_revision(
+                    db_session,
+                    event_site,
+                    event["rev_id"],
+                    status=[
+                        database.Status.UNSUBMITTED,
+                        database.Status.CREATED,
+                    ],
+                )
+
+
+def _old_enough(
+    diffs: list[database.Diff],
+    age: int,
+    /,
+) -> list[database.Diff]:
+    """Return the diffs saved at least age seconds ago."""
+    if age <= 0:
+        return diffs
+    cutoff = pywikibot.Timestamp.utcnow() - datetime.timedelta(seconds=age)
+    return [diff for diff in diffs if diff.rev_timestamp <= cutoff]
+
+
+def _due(diffs: list[database.Diff], /) -> list[database.Diff]:
+    """Return the diffs not waiting for a retry."""
+    now = pywikibot.Timestamp.utcnow()
+    return [
+        diff
+        for diff in diffs
+        if diff.retry_timestamp is None or diff.retry_timestamp <= now
+    ]
+
+
+def _count_diff(diff: database.Diff, stage: str, outcome: str, /) -> None:
+    from copypatrol_backend import metrics
+
+    metrics.increment(
+        "copypatrol_diffs",
+        site=pywikibot.Site(diff.lang, diff.project).hostname(),
+        stage=stage,
+        outcome=outcome,
+    )
+
+
+def _queue_depth() -> dict[tuple[tuple[str, str], ...], float]:
+    from copypatrol_backend import database
+
+    with database.Session() as db_session:
+        counts = database.status_counts(db_session)
+    return {(("status", status.name),): n for status, n in counts.items()}
+
+
+def _record_failure(diff: database.Diff, /) -> None:
+    """Schedule a diff to be retried with exponential backoff.
+
+    The diff is given the FAILED status after max_attempts() attempts.
+    """
+    from copypatrol_backend import database
+
+    diff.attempts += 1
+    if diff.attempts >= max_attempts():
+        pywikibot.warning(
+            f"Giving up on revision {diff.rev_id} of "
+            f"{diff.lang}.{diff.project} after {diff.attempts} attempts"
+        )
+        diff.status = database.Status.FAILED.value
+        diff.retry_timestamp = None
+        _count_diff(diff, "check-changes", "failed")
+        return
+    _count_diff(diff, "check-changes", "retry")
+    delay = retry_delay() * 2 ** (diff.attempts - 1)
+    diff.retry_timestamp = pywikibot.Timestamp.utcnow() + datetime.timedelta(
+        seconds=delay
+    )
+
+
+def _coalesce_diffs(
+    diffs: Sequence[database.Diff],
+    window: int,
+    /,
+) -> list[database.Diff]:
+    """Merge successive unsubmitted edits to a page by the same user.
+
+    Each run of edits, each saved within window seconds of the previous
+    one, is checked as one diff from the parent of the first edit to the
+    last edit. The other rows are kept with the MERGED status.
+
+    Return the diffs still to be checked.
+    """
+    from copypatrol_backend import database
+
+    if window <= 0:
+        return list(diffs)
+    result = []
+    runs: dict[tuple[str, str, int, str, str], database.Diff] = {}
+    for diff in sorted(diffs, key=lambda d: (d.rev_timestamp, d.rev_id)):
+        key = (
+            diff.project,
+            diff.lang,
+            diff.page_namespace,
+            diff.page_title,
+            diff.rev_user_text,
+        )
+        if diff.submission_id is not None:
+            runs.pop(key, None)
+            result.append(diff)
+            continue
+        previous = runs.get(key)
+        if (
+            previous is not None
+            and diff.rev_parent_id == previous.rev_id
+            and (diff.rev_timestamp - previous.rev_timestamp).total_seconds()
+            <= window
+        ):
+            pywikibot.log(
+                f"merging revision {previous.rev_id} into {diff.rev_id}"
             )
+            diff.rev_parent_id = previous.rev_parent_id
+            previous.status = database.Status.MERGED.value
+            result.remove(previous)
+        runs[key] = diff
+        result.append(diff)
+    return result
 
 
-def _check_changes() -> None:
-    api = TurnitinCoreAPI()
+def _check_diff(
+    page: pywikibot.Page,
+    diff: database.Diff,
+    /,
+    *,
+    metadata: Mapping[int, Revision] | None,
+) -> str | None:
+    """Check a diff, timing it and profiling it when sampled."""
+    from copypatrol_backend import metrics, profiling
+    from copypatrol_backend.check_diff import check_diff
+
+    domain = page.site.hostname()
+    label = f"revision {diff.rev_id} of {domain}"
+    with metrics.timed("check_diff", site=domain), profiling.diff(label):
+        return check_diff(
+            page,
+            diff.rev_parent_id,
+            diff.rev_id,
+            compare=site_config(domain).compare_diffs,
+            metadata=metadata,
+        )
+
+
+def _check_changes(api: TurnitinCoreAPI, /) -> int:
+    """Check the stored changes that are due.
+
+    Return the number of changes checked.
+    """
+    from copypatrol_backend import database, metrics
+
     with database.Session.begin() as db_session:
-        for diff in database.diffs_by_status(
+        stored = database.diffs_by_status(
             db_session,
             [database.Status.UNSUBMITTED, database.Status.CREATED],
-        ):
+        )
+        diffs = _due(
+            _old_enough(_coalesce_diffs(stored, coalesce_window()), min_age())
+        )
+        texts = database.diff_texts(db_session, diffs)
+        metadata = _revision_metadata(
+            [diff for diff in diffs if diff.diff_id not in texts]
+        )
+        for diff in diffs:
             site = pywikibot.Site(diff.lang, diff.project)
+            domain = site.hostname()
             page = pywikibot.Page(site, diff.page_title, diff.page_namespace)
-            try:
-                text = check_diff(page, diff.rev_parent_id, diff.rev_id)
-            except Exception:  # pragma: no cover
-                pywikibot.exception()
-                continue
+            text = texts.get(diff.diff_id)
             if text is None:
-                database.remove_revision(db_session, site, diff.rev_id)
-                continue
+                try:
+                    text = _check_diff(page, diff, metadata=metadata.get(site))
+                except Exception:  # pragma: no cover
+                    pywikibot.exception()
+                    _record_failure(diff)
+                    continue
+                if text is None:
+                    rev = metadata.get(site, {}).get(diff.rev_id)
+                    if rev is None or "mw-reverted" in rev.tags:
+                        # the edits merged into it may still be in the page
+                        database.restore_merged(db_session, site, diff.rev_id)
+                    database.remove_revision(db_session, site, diff.rev_id)
+                    _count_diff(diff, "check-changes", "removed")
+                    continue
+                database.set_diff_text(db_session, diff, text)
             if diff.submission_id is None:
                 try:
-                    diff.submission_id = api.create_submission(
-                        site=site,
-                        title=f"Revision {diff.rev_id} of {page.title()}",
-                        timestamp=diff.rev_timestamp,
-                        owner=diff.rev_user_text,
-                    )
+                    with metrics.timed("create_submission", site=domain):
+                        diff.submission_id = api.create_submission(
+                            site=site,
+                            title=f"Revision {diff.rev_id} of {page.title()}",
+                            timestamp=diff.rev_timestamp,
+                            owner=diff.rev_user_text,
+                        )
                 except Exception:  # pragma: no cover
                     pywikibot.exception()
+                    _record_failure(diff)
                     continue
             assert isinstance(diff.submission_id, UUID)
             try:
-                api.upload_submission(diff.submission_id, text)
+                with metrics.timed("upload_submission", site=domain):
+                    api.upload_submission(diff.submission_id, text)
             except Exception:  # pragma: no cover
                 pywikibot.exception()
+                _record_failure(diff)
             else:
                 diff.status = database.Status.UPLOADED.value
+                _count_diff(diff, "check-changes", "uploaded")
+    return len(diffs)
+
+
+def _check_changes_daemon(
+    api: TurnitinCoreAPI,
+    /,
+    *,
+    interval: float,
+    max_interval: float,
+) -> None:
+    """Check stored changes until interrupted.
+
+    After a run that checks nothing, the wait before the next run doubles,
+    up to max_interval seconds. The wait ends early when new changes are
+    stored, and lasts at most until a stored change waiting for min_age()
+    or a retry is due.
+    """
+    from copypatrol_backend import database
+
+    delay = interval
+    while True:
+        _reload_config()
+        with database.Session() as db_session:
+            last_diff_id = database.last_diff_id(db_session)
+        try:
+            checked = _check_changes(api)
+            due_in = _seconds_until_due()
+        except Exception:
+            pywikibot.exception()
+            checked, due_in = 0, None
+        if checked:
+            delay = interval
+        timeout = delay
+        if due_in is not None:
+            timeout = min(delay, max(due_in, interval))
+        _wait_for_changes(last_diff_id, timeout, interval)
+        if not checked:
+            delay = min(delay * 2, max_interval)
+
+
+def _seconds_until_due() -> float | None:
+    """Return the seconds until the next stored change is due, if any."""
+    from copypatrol_backend import database
+
+    with database.Session() as db_session:
+        diffs = database.diffs_by_status(
+            db_session,
+            [database.Status.UNSUBMITTED, database.Status.CREATED],
+        )
+        if not diffs:
+            return None
+        age = datetime.timedelta(seconds=max(min_age(), 0))
+        due = min(
+            max(
+                diff.rev_timestamp + age,
+                diff.retry_timestamp or diff.rev_timestamp,
+            )
+            for diff in diffs
+        )
+    return (due - pywikibot.Timestamp.utcnow()).total_seconds()
 
 
-def _generate_reports() -> None:
-    api = TurnitinCoreAPI()
+def _wait_for_changes(
+    last_diff_id: int,
+    timeout: float,
+    poll_interval: float,
+    /,
+) -> None:
+    """Wait until a diff after last_diff_id is stored or timeout seconds."""
+    from copypatrol_backend import database
+
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        time.sleep(min(poll_interval, remaining))
+        with database.Session() as db_session:
+            if database.last_diff_id(db_session) > last_diff_id:
+                return
+
+
+def _generate_reports(
+    api: TurnitinCoreAPI,
+    /,
+    *,
+    deadline: float | None = None,
+) -> None:
+    from copypatrol_backend import database
+
     with database.Session.begin() as db_session:
-        for diff in database.diffs_by_status(
+        for batch in _batches(
             db_session,
-            [database.Status.UPLOADED],
+            "generate-reports",
+            database.diffs_by_status(db_session, [database.Status.UPLOADED]),
+            deadline=deadline,
         ):
-            assert isinstance(diff.submission_id, UUID)
-            info = api.submission_info(diff.submission_id)
-            if info["status"] == "COMPLETE":
+            _generate_reports_batch(db_session, api, batch)
+
+
+def _generate_reports_batch(
+    session: _Session,
+    api: TurnitinCoreAPI,
+    diffs: list[database.Diff],
+    /,
+) -> None:
+    from copypatrol_backend import database
+
+    infos = _map_concurrently(api.submission_info, _submission_ids(diffs))
+    for diff in diffs:
+        assert isinstance(diff.submission_id, UUID)
+        if diff.submission_id not in infos:
+            continue
+        info = infos[diff.submission_id]
+        if info["status"] == "COMPLETE":
+            try:
+                api.generate_report(diff.submission_id)
+            except Exception:  # pragma: no cover
+                pywikibot.exception()
+            else:
+                diff.status = database.Status.PENDING.value
+                _count_diff(diff, "generate-reports", "requested")
+        elif info["status"] == "ERROR":
+            pywikibot.log(info)
+            error_code = info["error_code"]
+            pywikibot.error(f"submission {error_code=}")
+            _count_diff(diff, "generate-reports", "error")
+            if error_code == "PROCESSING_ERROR":
+                # retry as a new submission
+                diff.submission_id = None
+                diff.status = database.Status.UNSUBMITTED.value
+            else:
+                session.delete(diff)
+        elif info["status"] != "PROCESSING":
+            pywikibot.log(info)
+            pywikibot.error(f"unhandled status={info['status']}")
+
+
+def _submission_ids(diffs: Iterable[database.Diff], /) -> list[UUID]:
+    sids = []
+    for diff in diffs:
+        assert isinstance(diff.submission_id, UUID)
+        sids.append(diff.submission_id)
+    return sids
+
+
+class _PageTriageQueue:
+    """Copyvio tags to add to PageTriage once the reports are committed."""
+
+    def __init__(self) -> None:
+        self._available: dict[APISite, bool] = {}
+        self._queue: defaultdict[
+            APISite, list[tuple[pywikibot.Page, int]]
+        ] = defaultdict(list)
+
+    def add(self, page: pywikibot.Page, rev_id: int, /) -> None:
+        """Queue a revision to be tagged."""
+        self._queue[page.site].append((page, rev_id))
+
+    def available(self, site: APISite, /) -> bool:
+        """Return whether the bot can tag copyvios on the site."""
+        if site not in self._available:
+            self._available[site] = _pagetriage_available(site)
+        return self._available[site]
+
+    def submit(self) -> None:
+        """Submit all queued revisions to PageTriage."""
+        while self._queue:
+            site, items = self._queue.popitem()
+            if not self.available(site):
+                continue
+            # load the page IDs in batches
+            for _ in site.preloadpages(
+                [page for page, _ in items],
+                content=False,
+            ):
+                pass
+            for page, rev_id in items:
+                page_id = page.pageid
+                if not page_id:
+                    pywikibot.log(f"{page!r} no longer exists")
+                    continue
                 try:
-                    api.generate_report(diff.submission_id)
+                    _submit_pagetriage(site, page_id, rev_id)
                 except Exception:  # pragma: no cover
                     pywikibot.exception()
-                else:
-                    diff.status = database.Status.PENDING.value
-            elif info["status"] == "ERROR":
-                pywikibot.log(info)
-                error_code = info["error_code"]
-                pywikibot.error(f"submission {error_code=}")
-                if error_code == "PROCESSING_ERROR":
-                    # retry as a new submission
-                    diff.submission_id = None
-                    diff.status = database.Status.UNSUBMITTED.value
-                else:
-                    db_session.delete(diff)
-            elif info["status"] != "PROCESSING":
-                pywikibot.log(info)
-                pywikibot.error(f"unhandled status={info['status']}")
 
 
-def _submit_pagetriage(site: APISite, page_id: int, rev_id: int, /) -> None:
+def _pagetriage_available(site: APISite, /) -> bool:
     if not site.has_extension("PageTriage"):
-        raise pywikibot.exceptions.UnknownExtension(  # pragma: no cover
-            f"PageTriage is not enabled on {site!r}"
-        )
+        pywikibot.error(f"PageTriage is not enabled on {site!r}")
+        return False
     if not site.has_right("pagetriage-copyvio"):
-        raise pywikibot.exceptions.UserRightsError(  # pragma: no cover
+        pywikibot.error(
             f"{site.username()} does not have the required pagetriage-copyvio"
             " user right"
         )
+        return False
+    return True
+
+
+def _submit_pagetriage(site: APISite, page_id: int, rev_id: int, /) -> None:
     data = site.simple_request(
         action="pagetriagelist",
         page_id=page_id,
@@ -142,43 +724,254 @@ def _submit_pagetriage(site: APISite, page_id: int, rev_id: int, /) -> None:
         pywikibot.log(f"{rev_id=} added to PageTriage")
 
 
-def _check_reports(site: APISite, /) -> None:
-    api = TurnitinCoreAPI()
-    ignore_regexes = _parse_ignore_list(site)
+def _check_reports(
+    site: APISite,
+    api: TurnitinCoreAPI,
+    /,
+    *,
+    deadline: float | None = None,
+) -> None:
+    from copypatrol_backend import database
+
+    ignore_list = _ignore_list(site)
+    pagetriage = _PageTriageQueue()
     with database.Session.begin() as db_session:
-        for diff in database.diffs_by_status(
+        for batch in _batches(
             db_session,
-            [database.Status.PENDING],
+            "check-reports",
+            database.diffs_by_status(db_session, [database.Status.PENDING]),
+            deadline=deadline,
         ):
-            assert isinstance(diff.submission_id, UUID)
-            try:
-                sources = api.report_sources(diff.submission_id)
-            except Exception:  # pragma: no cover
-                pywikibot.exception()
-                continue
-            if sources is None:
-                continue
-            sources = [
-                source
+            _check_reports_batch(
+                db_session,
+                api,
+                batch,
+                ignore_list=ignore_list,
+                pagetriage=pagetriage,
+            )
+    pagetriage.submit()
+
+
+def _check_reports_batch(
+    session: _Session,
+    api: TurnitinCoreAPI,
+    diffs: list[database.Diff],
+    /,
+    *,
+    ignore_list: _IgnoreList,
+    pagetriage: _PageTriageQueue,
+) -> None:
+    # fetch all reports first, then write the results
+    from copypatrol_backend import database
+
+    reports = _map_concurrently(api.report_sources, _submission_ids(diffs))
+    found: dict[UUID, list[Source]] = {}
+    for diff in diffs:
+        assert isinstance(diff.submission_id, UUID)
+        if diff.submission_id not in reports:
+            continue
+        sources = reports[diff.submission_id]
+        if sources is None:
+            continue
+        found[diff.submission_id] = [
+            source
+            for source in sources
+            if source.percent > 50
+            if source.url is None or not ignore_list.matches(source.url)
+        ]
+    entry_ids = database.source_entry_ids(
+        session,
+        [
+            (source.description, source.url)
+            for sources in found.values()
+            for source in sources
+        ],
+    )
+    for diff in diffs:
+        assert isinstance(diff.submission_id, UUID)
+        if diff.submission_id not in found:
+            continue
+        if sources := found[diff.submission_id]:
+            diff.sources = [
+                database.Source(
+                    submission_id=diff.submission_id,
+                    entry_id=entry_ids[source.description, source.url],
+                    percent=source.percent,
+                )
                 for source in sources
-                if source.percent > 50
-                if source.url is None
-                or not any(i.search(source.url) for i in ignore_regexes)
             ]
-            if sources:
-                diff.sources = sources
-                diff.status = database.Status.READY.value
-                rev_site = pywikibot.Site(diff.lang, diff.project)
-                config = site_config(rev_site.hostname())
-                if diff.page_namespace in config.pagetriage_namespaces:
-                    page = pywikibot.Page(
-                        rev_site,
-                        diff.page_title,
-                        diff.page_namespace,
+            diff.status = database.Status.READY.value
+            _count_diff(diff, "check-reports", "ready")
+            rev_site = pywikibot.Site(diff.lang, diff.project)
+            config = site_config(rev_site.hostname())
+            if diff.page_namespace in config.pagetriage_namespaces:
+                page = pywikibot.Page(
+                    rev_site,
+                    diff.page_title,
+                    diff.page_namespace,
+                )
+                pagetriage.add(page, diff.rev_id)
+        else:
+            session.delete(diff)
+            _count_diff(diff, "check-reports", "no_sources")
+
+
+def _reports(
+    site: APISite,
+    api: TurnitinCoreAPI,
+    /,
+    *,
+    time_budget: float | None = None,
+) -> None:
+    from copypatrol_backend import database
+
+    with database.advisory_lock("reports") as acquired:
+        if not acquired:
+            pywikibot.warning("reports is already running")
+            return
+        deadline = None
+        if time_budget is not None:
+            deadline = time.monotonic() + time_budget
+        _check_reports(site, api, deadline=deadline)
+        _generate_reports(api, deadline=deadline)
+
+
+def _reports_daemon(
+    site: APISite,
+    api: TurnitinCoreAPI,
+    /,
+    *,
+    interval: float,
+    time_budget: float | None = None,
+) -> None:
+    """Run the reports job every interval seconds until interrupted.
+
+    The latest EULA is accepted before each run, in case a new version was
+    published since the daemon started.
+    """
+    while True:
+        _reload_config()
+        start = time.monotonic()
+        try:
+            api.accept_eula()
+            _reports(site, api, time_budget=time_budget)
+        except Exception:
+            pywikibot.exception()
+        time.sleep(max(0.0, start + interval - time.monotonic()))
+
+
+def _archive(*, batch_size: int) -> None:
+    """Move diffs resolved archive_after() days ago to the archive tables.
+
+    Diff events older than that are removed.
+    """
+    from copypatrol_backend import database
+
+    days = archive_after()
+    if days <= 0:
+        pywikibot.warning("archive-after is not configured")
+        return
+    cutoff = pywikibot.Timestamp.utcnow() - datetime.timedelta(days=days)
+    with database.Session.begin() as db_session:
+        database.remove_diff_events(db_session, cutoff)
+    while True:
+        with database.Session.begin() as db_session:
+            diff_ids = database.archivable_diff_ids(
+                db_session,
+                cutoff,
+                limit=batch_size,
+            )
+            if not diff_ids:
+                return
+            database.archive_diffs(db_session, diff_ids)
+        pywikibot.log(f"archived {len(diff_ids)} diffs")
+
+
+def _percentile(values: Sequence[float], percent: float, /) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def _stage_durations(
+    events: Iterable[database.DiffEvent],
+    /,
+    *,
+    since: pywikibot.Timestamp,
+) -> dict[tuple[str, str], list[float]]:
+    """Return the seconds taken by the stages ending since the timestamp.
+
+    Stages are named after the statuses they go from and to, and by wiki.
+    The "stored->READY" stage is the time from being stored to a report.
+    Events must be ordered by diff, then in the order they were added.
+    """
+    from copypatrol_backend import database
+
+    result: defaultdict[tuple[str, str], list[float]] = defaultdict(list)
+    for _, diff_events in itertools.groupby(
+        events,
+        key=lambda event: (event.project, event.lang, event.rev_id),
+    ):
+        previous = stored = None
+        for event in diff_events:
+            if previous is not None and event.status == previous.status:
+                continue
+            status = database.Status(event.status)
+            wiki = f"{event.lang}.{event.project}"
+            if previous is not None and event.timestamp >= since:
+                stage = (
+                    f"{database.Status(previous.status).name}->{status.name}"
+                )
+                result[wiki, stage].append(
+                    (event.timestamp - previous.timestamp).total_seconds()
+                )
+                if status is database.Status.READY and stored is not None:
+                    result[wiki, "stored->READY"].append(
+                        (event.timestamp - stored.timestamp).total_seconds()
                     )
-                    _submit_pagetriage(rev_site, page.pageid, diff.rev_id)
-            else:
-                db_session.delete(diff)
+            if stored is None and status is database.Status.UNSUBMITTED:
+                stored = event
+            previous = event
+    return result
+
+
+def _stats(*, days: float) -> None:
+    """Print the percentiles of the stage durations by wiki."""
+    from copypatrol_backend import database
+
+    since = pywikibot.Timestamp.utcnow() - datetime.timedelta(days=days)
+    with database.Session() as db_session:
+        durations = _stage_durations(
+            database.diff_events(db_session, since),
+            since=since,
+        )
+    for (_, stage), seconds in list(durations.items()):
+        durations.setdefault(("all", stage), []).extend(seconds)
+    header = "".join(f"{f'p{p}':>10}" for p in _PERCENTILES)
+    pywikibot.stdout(f"{'wiki':<24}{'stage':<24}{'count':>8}{header}")
+    for (wiki, stage), seconds in sorted(durations.items()):
+        seconds.sort()
+        percentiles = "".join(
+            f"{_percentile(seconds, p):>10.1f}" for p in _PERCENTILES
+        )
+        pywikibot.stdout(
+            f"{wiki:<24}{stage:<24}{len(seconds):>8}{percentiles}"
+        )
+
+
+def _ignore_list(site: APISite) -> _IgnoreList:
+    if not ignore_list_title():
+        return _IgnoreList.from_patterns(0, [])
+    page = pywikibot.Page(site, ignore_list_title())
+    try:
+        revid = page.latest_revision_id
+    except pywikibot.exceptions.NoPageError:
+        revid = 0
+    cached = _IGNORE_LISTS.get(site)
+    if cached is not None and cached.revid == revid:
+        return cached
+    ignore_list = _IgnoreList.from_patterns(revid, _parse_ignore_list(site))
+    _IGNORE_LISTS[site] = ignore_list
+    return ignore_list
 
 
 def _parse_ignore_list(site: APISite) -> list[re.Pattern[str]]:
@@ -204,6 +997,38 @@ def _parse_script_args(*args: str) -> argparse.Namespace:
         description="copypatrol backend",
         allow_abbrev=False,
     )
+    parser.add_argument(
+        "--metrics-file",
+        help="write metrics in the OpenMetrics text format to the file",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=60,
+        help="seconds between writes of the metrics file",
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve metrics in the OpenMetrics text format on the local port",
+        metavar="PORT",
+    )
+    parser.add_argument(
+        "--profile",
+        help="write CPU and memory hot spots of the run to the file",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--profile-diffs",
+        type=float,
+        help=(
+            "profile each checked diff with this probability instead of "
+            "the whole run"
+        ),
+        metavar="RATE",
+    )
     subparsers = parser.add_subparsers(dest="action", required=True)
     description = "store recent changes to be checked"
     store_subparser = subparsers.add_parser(
@@ -225,20 +1050,135 @@ def _parse_script_args(*args: str) -> argparse.Namespace:
         help="maximum number to store",
         metavar="N",
     )
+    store_subparser.add_argument(
+        "--stream-url",
+        help="read the events from the URL instead of EventStreams",
+        metavar="URL",
+    )
+    description = "record the unfiltered revision events to a file"
+    record_subparser = subparsers.add_parser(
+        "record-changes",
+        description=description,
+        help=description,
+        allow_abbrev=False,
+    )
+    record_subparser.add_argument(
+        "output",
+        help="gzipped JSON lines file to append the events to",
+        metavar="FILE",
+    )
+    record_subparser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        help="since the timestamp",
+        metavar="YYYY-MM-DD HH:MM:SS",
+    )
+    record_subparser.add_argument(
+        "--total",
+        "-n",
+        type=int,
+        help="maximum number to record",
+        metavar="N",
+    )
+    description = "remove stored changes that were reverted or deleted"
+    prune_subparser = subparsers.add_parser(
+        "prune-changes",
+        description=description,
+        help=description,
+        allow_abbrev=False,
+    )
+    prune_subparser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        help="since the timestamp",
+        metavar="YYYY-MM-DD HH:MM:SS",
+    )
+    prune_subparser.add_argument(
+        "--total",
+        "-n",
+        type=int,
+        help="maximum number of events to process",
+        metavar="N",
+    )
     description = "check stored changes"
-    subparsers.add_parser(
+    check_subparser = subparsers.add_parser(
         "check-changes",
         description=description,
         help=description,
         allow_abbrev=False,
     )
+    check_subparser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running, checking changes as they are stored",
+    )
+    check_subparser.add_argument(
+        "--interval",
+        type=float,
+        default=30,
+        help="seconds between polls for new changes in daemon mode",
+        metavar="SECONDS",
+    )
+    check_subparser.add_argument(
+        "--max-interval",
+        type=float,
+        default=600,
+        help="longest wait between runs when idle in daemon mode",
+        metavar="SECONDS",
+    )
     description = "check and generate reports"
-    subparsers.add_parser(
+    reports_subparser = subparsers.add_parser(
         "reports",
         description=description,
         help=description,
         allow_abbrev=False,
     )
+    reports_subparser.add_argument(
+        "--time-budget",
+        type=float,
+        help="stop after about this many seconds and resume on the next run",
+        metavar="SECONDS",
+    )
+    reports_subparser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running, checking reports every interval",
+    )
+    reports_subparser.add_argument(
+        "--interval",
+        type=float,
+        default=300,
+        help="seconds between the start of each run in daemon mode",
+        metavar="SECONDS",
+    )
+    description = "archive resolved diffs"
+    archive_subparser = subparsers.add_parser(
+        "archive",
+        description=description,
+        help=description,
+        allow_abbrev=False,
+    )
+    archive_subparser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of diffs to archive per transaction",
+        metavar="N",
+    )
+    description = "report percentiles of the time taken by each stage"
+    stats_subparser = subparsers.add_parser(
+        "stats",
+        description=description,
+        help=description,
+        allow_abbrev=False,
+    )
+    stats_subparser.add_argument(
+        "--days",
+        type=float,
+        default=7,
+        help="include stages ended in the last number of days",
+        metavar="N",
+    )
     db_subparser = subparsers.add_parser("db", allow_abbrev=False)
     db_group = db_subparser.add_mutually_exclusive_group(required=True)
     db_group.add_argument(
@@ -246,6 +1186,11 @@ def _parse_script_args(*args: str) -> argparse.Namespace:
         action="store_true",
         help="create the database tables",
     )
+    db_group.add_argument(
+        "--migrate-schema",
+        action="store_true",
+        help="migrate the database tables to the current schema",
+    )
     db_group.add_argument(
         "--remove-revision",
         type=int,
@@ -263,21 +1208,92 @@ def _parse_script_args(*args: str) -> argparse.Namespace:
 
 def cli(*args: str) -> int:
     """CLI for the package."""
+    from copypatrol_backend import metrics, profiling
+
     local_args = pywikibot.handle_args(args, do_help=False)
     parsed_args = _parse_script_args(*local_args)
+    daemon = getattr(parsed_args, "daemon", False)
+    if daemon or parsed_args.action in _STREAM_ACTIONS:
+        # the long-running jobs reload the configuration instead of exiting
+        reload_on_sighup()
+    if parsed_args.metrics_file or parsed_args.metrics_port is not None:
+        metrics.set_gauge("copypatrol_queue_depth", _queue_depth)
+    if parsed_args.metrics_port is not None:
+        metrics.start_server(parsed_args.metrics_port)
+    with ExitStack() as stack:
+        if parsed_args.metrics_file:
+            stop = metrics.start_writer(
+                parsed_args.metrics_file,
+                interval=parsed_args.metrics_interval,
+            )
+            stack.callback(metrics.write, parsed_args.metrics_file)
+            stack.callback(stop.set)
+        if parsed_args.profile:
+            stack.enter_context(
+                profiling.Profiler(
+                    parsed_args.profile,
+                    title=parsed_args.action,
+                    diff_rate=parsed_args.profile_diffs,
+                )
+            )
+        status = _run(parsed_args)
+    return status
+
+
+def _run(parsed_args: argparse.Namespace, /) -> int:
+    from copypatrol_backend import database
+    from copypatrol_backend.tca import TurnitinCoreAPI
+
     site = pywikibot.Site()
-    site.login()
+    if parsed_args.action not in _DATABASE_ACTIONS:
+        site.login()
     if parsed_args.action == "store-changes":
-        _store_changes(site, since=parsed_args.since, total=parsed_args.total)
+        _store_changes(
+            site,
+            since=parsed_args.since,
+            total=parsed_args.total,
+            stream_url=parsed_args.stream_url,
+        )
+    elif parsed_args.action == "record-changes":
+        _record_changes(
+            site,
+            parsed_args.output,
+            since=parsed_args.since,
+            total=parsed_args.total,
+        )
+    elif parsed_args.action == "prune-changes":
+        _prune_changes(site, since=parsed_args.since, total=parsed_args.total)
     if parsed_args.action == "check-changes":
-        _check_changes()
+        api = TurnitinCoreAPI()
+        if parsed_args.daemon:
+            _check_changes_daemon(
+                api,
+                interval=parsed_args.interval,
+                max_interval=parsed_args.max_interval,
+            )
+        else:
+            _check_changes(api)
     elif parsed_args.action == "reports":
-        _check_reports(site)
-        _generate_reports()
+        api = TurnitinCoreAPI()
+        if parsed_args.daemon:
+            _reports_daemon(
+                site,
+                api,
+                interval=parsed_args.interval,
+                time_budget=parsed_args.time_budget,
+            )
+        else:
+            _reports(site, api, time_budget=parsed_args.time_budget)
+    elif parsed_args.action == "archive":
+        _archive(batch_size=parsed_args.batch_size)
+    elif parsed_args.action == "stats":
+        _stats(days=parsed_args.days)
     elif parsed_args.action == "db":
         with database.Session.begin() as db_session:
             if parsed_args.create_tables:
                 database.create_tables()
+            elif parsed_args.migrate_schema:
+                database.migrate_schema()
             elif parsed_args.remove_revision:
                 database.remove_revision(
                     db_session,
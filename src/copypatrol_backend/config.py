@@ -1,10 +1,19 @@
-"""Configuration."""
+"""Configuration.
+
+The files are parsed once into an immutable snapshot, which
+reload_snapshot() replaces when the files changed or SIGHUP was received.
+"""
 from __future__ import annotations
 
 import configparser
 import os.path
-from functools import cache
-from typing import NamedTuple, TypedDict
+import signal
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, NamedTuple, TypedDict
+
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
 
 
 PKG_CONFIGS = [os.path.expanduser("~/.copypatrol.ini"), ".copypatrol.ini"]
@@ -30,8 +39,9 @@ class SiteConfig(NamedTuple):
 
     domain: str
     enabled: bool
-    namespaces: list[int]
-    pagetriage_namespaces: list[int]
+    namespaces: tuple[int, ...]
+    pagetriage_namespaces: tuple[int, ...]
+    compare_diffs: bool = False
 
 
 class TCAConfig(NamedTuple):
@@ -39,6 +49,38 @@ class TCAConfig(NamedTuple):
 
     domain: str
     key: str
+    max_workers: int = 4
+    scheme: str = "https"
+
+
+class Settings(NamedTuple):
+    """Settings of the [copypatrol] section."""
+
+    archive_after: int = 0
+    coalesce_window: int = 0
+    ignore_list_title: str = ""
+    max_attempts: int = 5
+    min_age: int = 0
+    min_size_delta: int = 0
+    retry_delay: int = 300
+
+
+class Snapshot(NamedTuple):
+    """Configuration parsed from the files at one time."""
+
+    settings: Settings
+    # by domain
+    sites: Mapping[str, SiteConfig]
+    # enabled domains
+    domains: tuple[str, ...]
+    database: DatabaseConfig | None
+    tca: TCAConfig | None
+    # modification times of DB_CONFIGS when they were parsed
+    mtimes: tuple[int | None, ...]
+
+
+_SNAPSHOT: Snapshot | None = None
+_RELOAD_REQUESTED = False
 
 
 def _config_parser() -> configparser.ConfigParser:
@@ -51,11 +93,22 @@ def _config_parser() -> configparser.ConfigParser:
     )
 
 
-@cache
-def database_config() -> DatabaseConfig:
-    """Return the database configuration."""
-    parser = _config_parser()
-    parser.read(DB_CONFIGS)
+def _mtimes() -> tuple[int | None, ...]:
+    result: list[int | None] = []
+    for path in DB_CONFIGS:
+        try:
+            result.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            result.append(None)
+    return tuple(result)
+
+
+def _database_config(
+    parser: configparser.ConfigParser,
+    /,
+) -> DatabaseConfig | None:
+    if not parser.has_section("client"):
+        return None
     client = parser["client"]
     return DatabaseConfig(
         drivername=client["drivername"],
@@ -67,49 +120,158 @@ def database_config() -> DatabaseConfig:
     )
 
 
-@cache
-def domains() -> list[str]:
-    """Return enabled domains."""
+def _site_config(
+    parser: configparser.ConfigParser,
+    domain: str,
+    /,
+) -> SiteConfig:
+    section = parser[f"copypatrol:{domain}"]
+    return SiteConfig(
+        domain=domain,
+        enabled=section.getboolean("enabled", fallback=False),
+        namespaces=tuple(section.getlistint("namespaces", fallback=[])),
+        pagetriage_namespaces=tuple(
+            section.getlistint("pagetriage-namespaces", fallback=[])
+        ),
+        compare_diffs=section.getboolean("compare-diffs", fallback=False),
+    )
+
+
+def _tca_config(parser: configparser.ConfigParser, /) -> TCAConfig | None:
+    if not parser.has_section("tca"):
+        return None
+    section = parser["tca"]
+    return TCAConfig(
+        domain=section["domain"],
+        key=section["key"],
+        max_workers=section.getint("max-workers", fallback=4),
+        scheme=section.get("scheme", fallback="https"),
+    )
+
+
+def _load() -> Snapshot:
+    """Parse the files into a snapshot."""
+    mtimes = _mtimes()
+    db_parser = _config_parser()
+    db_parser.read(DB_CONFIGS)
     parser = _config_parser()
     parser.read(PKG_CONFIGS)
-    domains = [
-        section.removeprefix("copypatrol:")
-        for section in parser.sections()
-        if section.startswith("copypatrol:")
-        if parser.getboolean(section, "enabled", fallback=False)
-    ]
+    section = parser["copypatrol"]
+    values: dict[str, Any] = {}
+    for name, default in Settings._field_defaults.items():
+        option = name.replace("_", "-")
+        if isinstance(default, int):
+            values[name] = section.getint(option, fallback=default)
+        else:
+            values[name] = section.get(option, fallback=default)
+    sites = {}
+    for name in parser.sections():
+        if name.startswith("copypatrol:"):
+            domain = name.removeprefix("copypatrol:")
+            sites[domain] = _site_config(parser, domain)
+    return Snapshot(
+        settings=Settings(**values),
+        sites=MappingProxyType(sites),
+        domains=tuple(
+            domain for domain, site in sites.items() if site.enabled
+        ),
+        database=_database_config(db_parser),
+        tca=_tca_config(parser),
+        mtimes=mtimes,
+    )
+
+
+def snapshot() -> Snapshot:
+    """Return the current configuration, parsing the files on first use."""
+    global _SNAPSHOT
+    if _SNAPSHOT is None:
+        _SNAPSHOT = _load()
+    return _SNAPSHOT
+
+
+def reload_snapshot() -> bool:
+    """Replace the snapshot if the files changed or a reload was requested.
+
+    Returns whether the snapshot was replaced. If the files cannot be
+    parsed, the exception is raised and the current snapshot is kept.
+    """
+    global _RELOAD_REQUESTED, _SNAPSHOT
+    current = snapshot()
+    if not _RELOAD_REQUESTED and _mtimes() == current.mtimes:
+        return False
+    _RELOAD_REQUESTED = False
+    _SNAPSHOT = _load()
+    return True
+
+
+def _request_reload(*args: Any) -> None:
+    global _RELOAD_REQUESTED
+    _RELOAD_REQUESTED = True
+
+
+def reload_on_sighup() -> None:
+    """Make the next reload_snapshot() read the files after SIGHUP."""
+    signal.signal(signal.SIGHUP, _request_reload)
+
+
+def database_config() -> DatabaseConfig:
+    """Return the database configuration."""
+    config = snapshot().database
+    if config is None:
+        raise KeyError("client")
+    return config.copy()
+
+
+def domains() -> list[str]:
+    """Return enabled domains."""
+    domains = list(snapshot().domains)
     assert domains
     return domains
 
 
-@cache
+def archive_after() -> int:
+    """Return the days after which resolved diffs are archived."""
+    return snapshot().settings.archive_after
+
+
+def coalesce_window() -> int:
+    """Return the window in seconds for coalescing successive edits."""
+    return snapshot().settings.coalesce_window
+
+
 def ignore_list_title() -> str:
     """Return title of the ignore list."""
-    parser = _config_parser()
-    parser.read(PKG_CONFIGS)
-    return parser.get("copypatrol", "ignore-list-title", fallback="")
+    return snapshot().settings.ignore_list_title
+
+
+def max_attempts() -> int:
+    """Return the number of attempts to check a diff before giving up."""
+    return snapshot().settings.max_attempts
+
+
+def min_age() -> int:
+    """Return the minimum age in seconds of a diff to be checked."""
+    return snapshot().settings.min_age
+
+
+def min_size_delta() -> int:
+    """Return the minimum size increase in bytes of a stored revision."""
+    return snapshot().settings.min_size_delta
+
+
+def retry_delay() -> int:
+    """Return the delay in seconds before first retrying a failed diff."""
+    return snapshot().settings.retry_delay
 
 
-@cache
 def site_config(domain: str) -> SiteConfig:
     """Return the site configuration."""
-    parser = _config_parser()
-    parser.read(PKG_CONFIGS)
-    section = parser[f"copypatrol:{domain}"]
-    return SiteConfig(
-        domain=domain,
-        enabled=section.getboolean("enabled", fallback=False),
-        namespaces=section.getlistint("namespaces", fallback=[]),
-        pagetriage_namespaces=section.getlistint(
-            "pagetriage-namespaces",
-            fallback=[],
-        ),
-    )
+    return snapshot().sites[domain]
 
 
-@cache
 def tca_config() -> TCAConfig:
     """Return the TCA configuration."""
-    parser = _config_parser()
-    parser.read(PKG_CONFIGS)
-    return TCAConfig(domain=parser["tca"]["domain"], key=parser["tca"]["key"])
+    config = snapshot().tca
+    if config is None:
+        raise KeyError("tca")
+    return config
@@ -1,27 +1,44 @@
 """Database interaction."""
 from __future__ import annotations
 
+import hashlib
+import json
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
 from enum import IntEnum
-from typing import TYPE_CHECKING, Any, Optional, Union
-from uuid import UUID
+from functools import cache
+from typing import TYPE_CHECKING, Any, Callable, Optional
+from uuid import UUID, uuid5
 
 import sqlalchemy.dialects.mysql
+import sqlalchemy.orm
 from pywikibot.time import Timestamp
 from sqlalchemy import (
     BINARY,
     URL,
     VARBINARY,
+    Column,
+    DateTime,
     Dialect,
     Float,
     ForeignKey,
     Index,
     Integer,
     LargeBinary,
+    Table,
     TypeDecorator,
     and_,
     create_engine,
     delete,
+    event,
+    func,
+    insert,
+    inspect,
+    or_,
     select,
+    text,
+    update,
 )
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -30,16 +47,20 @@ from sqlalchemy.orm import (
     relationship,
     sessionmaker,
 )
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.schema import CreateColumn
 
 from copypatrol_backend.config import database_config
 
 
 if TYPE_CHECKING:
-    from collections.abc import Sequence
+    from collections.abc import Generator, Iterable, Sequence
 
     from pywikibot.page import Page
     from pywikibot.site import APISite
+    from sqlalchemy import Connection, Engine, Insert, Inspector
     from sqlalchemy.orm import Session as _Session
+    from sqlalchemy.sql.expression import TableClause
 
     class MappedAsDataclass:
         """sqlalchemy#9467 / mypy#13856 workaround."""
@@ -57,10 +78,35 @@ _CREATE_TABLE_ARGS = {
     "mysql_charset": "utf8mb4",
     "mariadb_charset": "utf8mb4",
 }
-_ENGINE = create_engine(URL.create(**database_config()))
 
 
-Session = sessionmaker(bind=_ENGINE)
+@cache
+def _engine() -> Engine:
+    """Return the engine, created on first use instead of on import."""
+    return create_engine(URL.create(**database_config()))
+
+
+class _AppSession(sqlalchemy.orm.Session):
+    """Session of the package, which its event listeners are attached to."""
+
+
+@cache
+def _sessionmaker() -> sessionmaker[_AppSession]:
+    return sessionmaker(bind=_engine(), class_=_AppSession)
+
+
+if TYPE_CHECKING:
+    Session: sessionmaker[_AppSession]
+else:
+
+    def __getattr__(name: str) -> Any:
+        if name == "Session":
+            return _sessionmaker()
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_SOURCE_ENTRY_IDS: dict[bytes, int] = {}
+_SOURCE_ENTRY_IDS_MAXSIZE = 100_000
 TinyInt = Integer().with_variant(
     sqlalchemy.dialects.mysql.TINYINT(),
     "mysql",
@@ -81,6 +127,8 @@ UnsignedInteger = Integer().with_variant(
 class Status(IntEnum):
     """Status Enum."""
 
+    FAILED = -6
+    MERGED = -5
     UNSUBMITTED = -4
     CREATED = -3
     UPLOADED = -2
@@ -114,61 +162,74 @@ class _LargeBinary(_BinaryBase):
     impl = LargeBinary
 
 
-class _Timestamp(TypeDecorator[Timestamp]):
+class _Compressed(TypeDecorator[str]):
     cache_ok = True
-    impl = BINARY
+    impl = LargeBinary
 
     def process_bind_param(
         self,
-        value: Timestamp | None,
+        value: str | None,
         dialect: Dialect,
     ) -> bytes | None:
         if value is None:
             return None
-        return value.totimestampformat().encode()
+        return zlib.compress(value.encode())
 
     def process_result_value(
         self,
         value: bytes | None,
         dialect: Dialect,
-    ) -> Timestamp | None:
+    ) -> str | None:
         if value is None:
             return None
-        return Timestamp.set_timestamp(value.decode())
+        return zlib.decompress(value).decode()
 
 
-_UuidType = Union[str, UUID]
+class _Timestamp(TypeDecorator[Timestamp]):
+    cache_ok = True
+    impl = DateTime
+
+    def process_bind_param(
+        self,
+        value: Timestamp | None,
+        dialect: Dialect,
+    ) -> datetime | None:
+        if value is None:
+            return None
+        # drivers may not adapt datetime subclasses
+        return datetime.combine(value.date(), value.time())
 
+    def process_result_value(
+        self,
+        value: datetime | None,
+        dialect: Dialect,
+    ) -> Timestamp | None:
+        if value is None:
+            return None
+        return Timestamp.set_timestamp(value)
 
-class _Uuid(TypeDecorator[_UuidType]):
-    """Compatibility layer for old data."""
 
+class _Uuid(TypeDecorator[UUID]):
     cache_ok = True
-    impl = VARBINARY
+    impl = BINARY(16)
 
     def process_bind_param(
         self,
-        value: _UuidType | None,
+        value: UUID | None,
         dialect: Dialect,
     ) -> bytes | None:
         if value is None:
             return None
-        if isinstance(value, UUID):
-            value = str(value)
-        return value.encode()
+        return value.bytes
 
     def process_result_value(
         self,
         value: bytes | None,
         dialect: Dialect,
-    ) -> _UuidType | None:
+    ) -> UUID | None:
         if value is None:
             return None
-        value_s = value.decode()
-        try:
-            return UUID(value_s)
-        except (TypeError, ValueError):
-            return value_s
+        return UUID(bytes=value)
 
 
 class _VarBinary(_BinaryBase):
@@ -208,23 +269,32 @@ class Diff(_TableBase):
     page_title: Mapped[str] = mapped_column(_VarBinary(255))
     rev_id: Mapped[int] = mapped_column(UnsignedInteger)
     rev_parent_id: Mapped[int] = mapped_column(UnsignedInteger)
-    rev_timestamp: Mapped[Timestamp] = mapped_column(_Timestamp(14))
+    rev_timestamp: Mapped[Timestamp] = mapped_column(_Timestamp)
     rev_user_text: Mapped[str] = mapped_column(_VarBinary(255))
-    submission_id: Mapped[Optional[_UuidType]] = mapped_column(
-        _Uuid(36),
+    submission_id: Mapped[Optional[UUID]] = mapped_column(
+        _Uuid,
         init=False,
         index=True,
         unique=True,
     )
     status: Mapped[int] = mapped_column(TinyInt, index=True)
     status_timestamp: Mapped[Optional[Timestamp]] = mapped_column(
-        _Timestamp(14),
+        _Timestamp,
         init=False,
     )
     status_user_text: Mapped[Optional[str]] = mapped_column(
         _VarBinary(255),
         init=False,
     )
+    attempts: Mapped[int] = mapped_column(
+        TinyInt,
+        default=0,
+        server_default=text("0"),
+    )
+    retry_timestamp: Mapped[Optional[Timestamp]] = mapped_column(
+        _Timestamp,
+        init=False,
+    )
 
     sources: Mapped[list[Source]] = relationship(
         lazy="joined",
@@ -244,16 +314,134 @@ class Source(_TableBase):
         init=False,
         primary_key=True,
     )
-    submission_id: Mapped[_Uuid] = mapped_column(
+    submission_id: Mapped[UUID] = mapped_column(
+        _Uuid,
         ForeignKey(
             "diffs.submission_id",
             ondelete="CASCADE",
             onupdate="CASCADE",
-        )
+            name="fk_report_sources_submission_id",
+        ),
+    )
+    entry_id: Mapped[int] = mapped_column(
+        UnsignedInteger,
+        ForeignKey(
+            "source_entries.entry_id",
+            name="fk_report_sources_entry_id",
+        ),
     )
+    percent: Mapped[float] = mapped_column(UnsignedFloat)
+
+    entry: Mapped[SourceEntry] = relationship(lazy="joined", init=False)
+
+
+class SourceEntry(_TableBase):
+    """Source entries table interface.
+
+    Each distinct source description and URL is stored once.
+    """
+
+    __tablename__ = "source_entries"
+    __table_args__ = _CREATE_TABLE_ARGS
+
+    entry_id: Mapped[int] = mapped_column(
+        UnsignedInteger,
+        init=False,
+        primary_key=True,
+    )
+    entry_hash: Mapped[bytes] = mapped_column(BINARY(20), unique=True)
     description: Mapped[str] = mapped_column(_LargeBinary)
     url: Mapped[Optional[str]] = mapped_column(_LargeBinary)
-    percent: Mapped[float] = mapped_column(UnsignedFloat)
+
+
+class DiffText(_TableBase):
+    """Diff texts table interface.
+
+    The text is stored for the parent revision it was computed from, so it
+    is not used after the diff is coalesced with earlier edits.
+    """
+
+    __tablename__ = "diff_texts"
+    __table_args__ = _CREATE_TABLE_ARGS
+
+    diff_id: Mapped[int] = mapped_column(
+        UnsignedInteger,
+        ForeignKey(
+            "diffs.diff_id",
+            ondelete="CASCADE",
+            name="fk_diff_texts_diff_id",
+        ),
+        primary_key=True,
+    )
+    rev_parent_id: Mapped[int] = mapped_column(UnsignedInteger)
+    text: Mapped[str] = mapped_column(_Compressed(2**24 - 1))
+
+
+class DiffEvent(_TableBase):
+    """Diff events table interface.
+
+    A row is added when a diff is stored and each time its status changes,
+    to time each stage. Rows are kept after the diff is removed.
+    """
+
+    __tablename__ = "diff_events"
+    __table_args__ = (
+        Index("ix_diff_events_rev", "project", "lang", "rev_id"),
+        Index("ix_diff_events_timestamp", "timestamp"),
+        _CREATE_TABLE_ARGS,
+    )
+
+    event_id: Mapped[int] = mapped_column(
+        UnsignedInteger,
+        init=False,
+        primary_key=True,
+    )
+    project: Mapped[str] = mapped_column(_VarBinary(20))
+    lang: Mapped[str] = mapped_column(_VarBinary(20))
+    rev_id: Mapped[int] = mapped_column(UnsignedInteger)
+    status: Mapped[int] = mapped_column(TinyInt)
+    timestamp: Mapped[Timestamp] = mapped_column(_Timestamp)
+
+
+class Checkpoint(_TableBase):
+    """Job checkpoints table interface."""
+
+    __tablename__ = "checkpoints"
+    __table_args__ = _CREATE_TABLE_ARGS
+
+    job: Mapped[str] = mapped_column(_VarBinary(255), primary_key=True)
+    diff_id: Mapped[int] = mapped_column(UnsignedInteger)
+
+
+def _archive_table(table: Table, /, *indexes: Index) -> Table:
+    """Return a table to archive rows of table in."""
+    archive = Table(
+        f"{table.name}_archive",
+        _TableBase.metadata,
+        *(
+            Column(
+                column.name,
+                column.type,
+                primary_key=column.primary_key,
+                nullable=column.nullable,
+                autoincrement=False,
+            )
+            for column in table.columns
+        ),
+        *indexes,
+    )
+    archive.dialect_kwargs.update(_CREATE_TABLE_ARGS)
+    return archive
+
+
+_DIFFS_ARCHIVE = _archive_table(
+    _TableBase.metadata.tables[Diff.__tablename__],
+    Index("ix_diffs_archive_rev", "project", "lang", "rev_id"),
+)
+_SOURCES_ARCHIVE = _archive_table(
+    _TableBase.metadata.tables[Source.__tablename__],
+    Index("ix_report_sources_archive_submission", "submission_id"),
+)
 
 
 def add_revision(
@@ -265,8 +453,11 @@ def add_revision(
     rev_timestamp: Timestamp,
     rev_user_text: str,
 ) -> None:
-    """Add new revision to the database."""
-    diff = Diff(
+    """Add new revision to the database.
+
+    Nothing is done if the revision is already in the database.
+    """
+    values = dict(
         project=page.site.family.name,
         lang=page.site.code,
         page_namespace=page.namespace().id,
@@ -277,12 +468,488 @@ def add_revision(
         rev_user_text=rev_user_text,
         status=Status.UNSUBMITTED.value,
     )
-    session.add(diff)
+    result = session.connection().execute(
+        _insert_ignore(Diff, session.get_bind().dialect, "rev_id"), values
+    )
+    # MySQL also counts an existing row; the stats skip the repeated event
+    if result.rowcount == 1:
+        session.add(
+            DiffEvent(
+                project=values["project"],
+                lang=values["lang"],
+                rev_id=rev_id,
+                status=Status.UNSUBMITTED.value,
+                timestamp=Timestamp.utcnow(),
+            )
+        )
+
+
+def _insert_ignore(
+    table: type[_TableBase],
+    dialect: Dialect,
+    column: str,
+    /,
+) -> Insert:
+    """Return an INSERT statement skipping rows with a duplicate key.
+
+    column is set to its current value on MySQL, which has no DO NOTHING.
+    """
+    # the other dialects are only imported when used
+    if dialect.name in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        mysql_stmt = mysql_insert(table)
+        return mysql_stmt.on_duplicate_key_update(
+            {column: mysql_stmt.table.c[column]}
+        )
+    if dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(table).on_conflict_do_nothing()
+    return insert(table)  # pragma: no cover
+
+
+def _source_hash(description: str, url: str | None, /) -> bytes:
+    return hashlib.sha1(
+        json.dumps([description, url]).encode(),
+        usedforsecurity=False,
+    ).digest()
+
+
+def source_entry_ids(
+    session: _Session,
+    sources: Iterable[tuple[str, str | None]],
+    /,
+) -> dict[tuple[str, str | None], int]:
+    """Return the entry IDs for source descriptions and URLs.
+
+    Entries are added as needed, and IDs are cached for the process.
+    """
+    hashes = {_source_hash(*source): source for source in sources}
+    missing = [key for key in hashes if key not in _SOURCE_ENTRY_IDS]
+    if missing:
+        session.execute(
+            _insert_ignore(
+                SourceEntry,
+                session.get_bind().dialect,
+                "entry_hash",
+            ),
+            [
+                {
+                    "entry_hash": key,
+                    "description": hashes[key][0],
+                    "url": hashes[key][1],
+                }
+                for key in missing
+            ],
+        )
+        if len(_SOURCE_ENTRY_IDS) + len(missing) > _SOURCE_ENTRY_IDS_MAXSIZE:
+            _SOURCE_ENTRY_IDS.clear()
+        stmt = select(SourceEntry.entry_hash, SourceEntry.entry_id).where(
+            SourceEntry.entry_hash.in_(missing)
+        )
+        _SOURCE_ENTRY_IDS.update(session.execute(stmt).tuples().all())
+    return {source: _SOURCE_ENTRY_IDS[key] for key, source in hashes.items()}
+
+
+@event.listens_for(_AppSession, "after_rollback")
+def _clear_source_entry_ids(session: _Session) -> None:
+    # cached IDs may be for entries that were rolled back
+    _SOURCE_ENTRY_IDS.clear()
+
+
+@event.listens_for(_AppSession, "before_flush")
+def _add_status_events(session: _Session, *args: Any) -> None:
+    """Add an event for each diff whose status is set."""
+    timestamp = Timestamp.utcnow()
+    for diff in [*session.new, *session.dirty]:
+        if not isinstance(diff, Diff):
+            continue
+        if not get_history(diff, "status").added:
+            continue
+        session.add(
+            DiffEvent(
+                project=diff.project,
+                lang=diff.lang,
+                rev_id=diff.rev_id,
+                status=diff.status,
+                timestamp=timestamp,
+            )
+        )
+
+
+@contextmanager
+def advisory_lock(name: str, /) -> Generator[bool, None, None]:
+    """Hold a named lock on the database server, if it supports them.
+
+    Yields whether the lock was acquired. The lock is not waited for.
+    """
+    engine = _engine()
+    if engine.dialect.name not in ("mysql", "mariadb"):
+        yield True
+        return
+    name = f"{engine.url.database}.{name}"
+    with engine.connect() as connection:
+        acquired = connection.scalar(
+            text("SELECT GET_LOCK(:name, 0)"),
+            {"name": name},
+        )
+        try:
+            yield acquired == 1
+        finally:
+            if acquired == 1:
+                connection.execute(
+                    text("SELECT RELEASE_LOCK(:name)"),
+                    {"name": name},
+                )
+
+
+def checkpoint(session: _Session, job: str, /) -> int:
+    """Return the last diff ID processed by a job, or 0."""
+    row = session.get(Checkpoint, job)
+    return 0 if row is None else row.diff_id
+
+
+def set_checkpoint(session: _Session, job: str, diff_id: int, /) -> None:
+    """Set the last diff ID processed by a job."""
+    session.merge(Checkpoint(job=job, diff_id=diff_id))
+    session.flush()
+
+
+def _add_missing_columns(connection: Connection, /) -> None:
+    """Add columns missing from tables created by an older version."""
+    inspector = inspect(connection)
+    for table in _TableBase.metadata.sorted_tables:
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+            )
+
+
+def _legacy_timestamp(value: bytes | str | None, /) -> Timestamp | None:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    return Timestamp.set_timestamp(value)
+
+
+def _legacy_uuid(value: bytes | str | None, /) -> UUID | None:
+    """Convert a submission ID stored as a string.
+
+    Submission IDs from before TCA are not UUIDs, so they are mapped to
+    name-based UUIDs.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return UUID(value)
+    except ValueError:
+        return uuid5(_LEGACY_UUID_NAMESPACE, value)
+
+
+_LEGACY_CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    "submission_id": _legacy_uuid,
+    "rev_timestamp": _legacy_timestamp,
+    "status_timestamp": _legacy_timestamp,
+    "retry_timestamp": _legacy_timestamp,
+}
+_LEGACY_TABLES = ("diff_texts", "report_sources", "diffs")
+_LEGACY_UUID_NAMESPACE = UUID("5c0b7d1e-3f4a-4b8e-9a61-0d2c7e9f4b13")
+
+
+def _legacy_tables(inspector: Inspector, /) -> list[str]:
+    """Return the tables to migrate from an older schema."""
+    names = inspector.get_table_names()
+    if "diffs" not in names:
+        return []
+    columns = {
+        col["name"]: col["type"] for col in inspector.get_columns("diffs")
+    }
+    if not isinstance(columns["rev_timestamp"], DateTime):
+        return [name for name in _LEGACY_TABLES if name in names]
+    if "report_sources" in names and "description" in {
+        col["name"] for col in inspector.get_columns("report_sources")
+    }:
+        return ["report_sources"]
+    return []
+
+
+def _legacy_text(value: bytes | str | None, /) -> str | None:
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def _untyped_table(name: str, columns: list[str], /) -> TableClause:
+    """Return a table construct binding and reading values as they are."""
+    return sqlalchemy.table(name, *(sqlalchemy.column(c) for c in columns))
+
+
+def _copy_legacy_rows(
+    connection: Connection,
+    table: Table,
+    /,
+    *,
+    batch_size: int,
+) -> int:
+    """Copy the next batch of rows from a table's legacy copy.
+
+    Return the number of rows copied.
+    """
+    legacy_name = f"{table.name}_legacy"
+    legacy = _untyped_table(
+        legacy_name,
+        [
+            column["name"]
+            for column in inspect(connection).get_columns(legacy_name)
+        ],
+    )
+    key_column = next(iter(table.primary_key.columns))
+    legacy_key = legacy.c[key_column.name]
+    last = connection.scalar(select(func.max(key_column)))
+    rows = (
+        connection.execute(
+            select(legacy)
+            .where(legacy_key > (last or 0))
+            .order_by(legacy_key)
+            .limit(batch_size)
+        )
+        .mappings()
+        .all()
+    )
+    if not rows:
+        return 0
+    columns = [column for column in table.columns if column.name in rows[0]]
+    processors = {
+        column.name: column.type.dialect_impl(
+            connection.dialect
+        ).bind_processor(connection.dialect)
+        for column in columns
+        if column.name in _LEGACY_CONVERTERS
+    }
+    values = []
+    for row in rows:
+        value = {}
+        for column in columns:
+            value[column.name] = row[column.name]
+            if column.name in _LEGACY_CONVERTERS:
+                value[column.name] = _LEGACY_CONVERTERS[column.name](
+                    value[column.name]
+                )
+                processor = processors[column.name]
+                if processor is not None:
+                    value[column.name] = processor(value[column.name])
+        values.append(value)
+    if table.name == Source.__tablename__ and "description" in rows[0]:
+        sources = [
+            (str(_legacy_text(row["description"])), _legacy_text(row["url"]))
+            for row in rows
+        ]
+        with _AppSession(bind=connection) as session:
+            entry_ids = source_entry_ids(session, sources)
+        for value, source in zip(values, sources):
+            value["entry_id"] = entry_ids[source]
+    connection.execute(
+        insert(_untyped_table(table.name, list(values[0]))),
+        values,
+    )
+    return len(rows)
+
+
+def migrate_schema(*, batch_size: int = 1000) -> None:
+    """Migrate tables from an older schema.
+
+    The tables are renamed with a _legacy suffix and created again, then
+    their rows are copied in batches. Running it again after it was
+    interrupted resumes the migration.
+    """
+    engine = _engine()
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for name in _legacy_tables(inspector):
+            if connection.dialect.name == "sqlite":
+                # index names are not scoped to the table
+                for index in inspector.get_indexes(name):
+                    connection.execute(text(f"DROP INDEX {index['name']}"))
+            connection.execute(
+                text(f"ALTER TABLE {name} RENAME TO {name}_legacy")
+            )
+        names = inspect(connection).get_table_names()
+    if not any(f"{name}_legacy" in names for name in _LEGACY_TABLES):
+        return
+    _create_tables(engine)
+    for table in _TableBase.metadata.sorted_tables:
+        if f"{table.name}_legacy" not in names:
+            continue
+        copied = batch_size
+        while copied == batch_size:
+            with engine.begin() as connection:
+                copied = _copy_legacy_rows(
+                    connection,
+                    table,
+                    batch_size=batch_size,
+                )
+    with engine.begin() as connection:
+        for name in _LEGACY_TABLES:
+            if f"{name}_legacy" in names:
+                connection.execute(text(f"DROP TABLE {name}_legacy"))
+
+
+def archivable_diff_ids(
+    session: _Session,
+    cutoff: Timestamp,
+    /,
+    *,
+    limit: int,
+) -> Sequence[int]:
+    """Return IDs of diffs resolved before cutoff.
+
+    Diffs are resolved once reviewed, merged into another diff, or failed.
+    """
+    stmt = (
+        select(Diff.diff_id)
+        .where(
+            or_(
+                and_(
+                    Diff.status > Status.READY.value,
+                    Diff.status_timestamp < cutoff,
+                ),
+                and_(
+                    Diff.status.in_(
+                        [Status.MERGED.value, Status.FAILED.value]
+                    ),
+                    Diff.rev_timestamp < cutoff,
+                ),
+            )
+        )
+        .order_by(Diff.diff_id)
+        .limit(limit)
+    )
+    return session.scalars(stmt).all()
+
+
+def archive_diffs(session: _Session, diff_ids: Sequence[int], /) -> None:
+    """Move diffs and their report sources to the archive tables."""
+    diffs = _TableBase.metadata.tables[Diff.__tablename__]
+    sources = _TableBase.metadata.tables[Source.__tablename__]
+    submission_ids = select(Diff.submission_id).where(
+        Diff.diff_id.in_(diff_ids)
+    )
+    session.execute(
+        insert(_SOURCES_ARCHIVE).from_select(
+            [column.name for column in sources.columns],
+            select(sources).where(sources.c.submission_id.in_(submission_ids)),
+        )
+    )
+    session.execute(
+        insert(_DIFFS_ARCHIVE).from_select(
+            [column.name for column in diffs.columns],
+            select(diffs).where(diffs.c.diff_id.in_(diff_ids)),
+        )
+    )
+    session.execute(
+        delete(sources).where(sources.c.submission_id.in_(submission_ids))
+    )
+    session.execute(delete(DiffText).where(DiffText.diff_id.in_(diff_ids)))
+    session.execute(delete(diffs).where(diffs.c.diff_id.in_(diff_ids)))
+
+
+def diff_events(
+    session: _Session,
+    since: Timestamp,
+    /,
+) -> Sequence[DiffEvent]:
+    """Return the events of the diffs with an event since the timestamp.
+
+    Events are ordered by diff, then in the order they were added.
+    """
+    recent = (
+        select(DiffEvent.project, DiffEvent.lang, DiffEvent.rev_id)
+        .where(DiffEvent.timestamp >= since)
+        .distinct()
+        .subquery()
+    )
+    stmt = (
+        select(DiffEvent)
+        .join(
+            recent,
+            and_(
+                DiffEvent.project == recent.c.project,
+                DiffEvent.lang == recent.c.lang,
+                DiffEvent.rev_id == recent.c.rev_id,
+            ),
+        )
+        .order_by(
+            DiffEvent.project,
+            DiffEvent.lang,
+            DiffEvent.rev_id,
+            DiffEvent.event_id,
+        )
+    )
+    return session.scalars(stmt).all()
+
+
+def remove_diff_events(session: _Session, cutoff: Timestamp, /) -> None:
+    """Remove the events added before cutoff."""
+    session.execute(delete(DiffEvent).where(DiffEvent.timestamp < cutoff))
+
+
+def _create_tables(engine: Engine, /) -> None:
+    _TableBase.metadata.create_all(engine, checkfirst=True)
+    with engine.begin() as connection:
+        _add_missing_columns(connection)
 
 
 def create_tables() -> None:
-    """Create database tables."""
-    _TableBase.metadata.create_all(_ENGINE, checkfirst=True)
+    """Create database tables and add any missing columns.
+
+    Tables from an older schema are not altered, they have to be migrated
+    with migrate_schema() first.
+    """
+    engine = _engine()
+    with engine.connect() as connection:
+        legacy = _legacy_tables(inspect(connection))
+    if legacy:
+        raise RuntimeError(
+            f"tables {', '.join(legacy)} use an older schema,"
+            " migrate them first"
+        )
+    _create_tables(engine)
+
+
+def diff_texts(session: _Session, diffs: Iterable[Diff], /) -> dict[int, str]:
+    """Return the stored texts of diffs by diff ID."""
+    parents = {diff.diff_id: diff.rev_parent_id for diff in diffs}
+    if not parents:
+        return {}
+    stmt = select(DiffText).where(DiffText.diff_id.in_(parents))
+    return {
+        row.diff_id: row.text
+        for row in session.scalars(stmt)
+        if row.rev_parent_id == parents[row.diff_id]
+    }
+
+
+def set_diff_text(session: _Session, diff: Diff, text: str, /) -> None:
+    """Store the text of a diff."""
+    session.merge(
+        DiffText(
+            diff_id=diff.diff_id,
+            rev_parent_id=diff.rev_parent_id,
+            text=text,
+        )
+    )
 
 
 def diffs_by_status(
@@ -291,11 +958,57 @@ def diffs_by_status(
     /,
 ) -> Sequence[Diff]:
     """Get records with a specified status."""
-    stmt = select(Diff).where(Diff.status.in_([s.value for s in status]))
+    stmt = (
+        select(Diff)
+        .where(Diff.status.in_([s.value for s in status]))
+        .order_by(Diff.diff_id)
+    )
     return session.scalars(stmt).unique().all()
 
 
-def remove_revision(session: _Session, site: APISite, rev_id: int, /) -> None:
+def status_counts(session: _Session, /) -> dict[Status, int]:
+    """Return the number of stored diffs with each status."""
+    stmt = select(Diff.status, func.count()).group_by(Diff.status)
+    counts = dict.fromkeys(Status, 0)
+    for status, count in session.execute(stmt):
+        counts[Status(status)] = count
+    return counts
+
+
+def last_diff_id(session: _Session, /) -> int:
+    """Return the ID of the last stored diff, or 0."""
+    return session.scalar(select(func.max(Diff.diff_id))) or 0
+
+
+def remove_page(
+    session: _Session,
+    page: Page,
+    /,
+    *,
+    status: list[Status] | None = None,
+) -> None:
+    """Remove a page's revisions from the database."""
+    stmt = delete(Diff).where(
+        and_(
+            Diff.project == page.site.family.name,
+            Diff.lang == page.site.code,
+            Diff.page_namespace == page.namespace().id,
+            Diff.page_title == page.title(underscore=True, with_ns=False),
+        )
+    )
+    if status is not None:
+        stmt = stmt.where(Diff.status.in_([s.value for s in status]))
+    session.execute(stmt)
+
+
+def remove_revision(
+    session: _Session,
+    site: APISite,
+    rev_id: int,
+    /,
+    *,
+    status: list[Status] | None = None,
+) -> None:
     """Remove revision from the database."""
     stmt = delete(Diff).where(
         and_(
@@ -304,10 +1017,64 @@ def remove_revision(session: _Session, site: APISite, rev_id: int, /) -> None:
             Diff.rev_id == rev_id,
         )
     )
+    if status is not None:
+        stmt = stmt.where(Diff.status.in_([s.value for s in status]))
     session.execute(stmt)
 
 
 def remove_submission(session: _Session, submission_id: UUID, /) -> None:
     """Remove submission from the database."""
-    stmt = delete(Diff).where(Diff.submission_id == str(submission_id))
+    stmt = delete(Diff).where(Diff.submission_id == submission_id)
     session.execute(stmt)
+
+
+def restore_merged(session: _Session, site: APISite, rev_id: int, /) -> None:
+    """Restore the diffs merged into a revision to be checked on their own.
+
+    Merged diffs keep their own parent, so they are the merged diffs to
+    the page by the same user between the revision and its parent.
+    """
+    diff = session.scalars(
+        select(Diff).where(
+            and_(
+                Diff.project == site.family.name,
+                Diff.lang == site.code,
+                Diff.rev_id == rev_id,
+                Diff.status.in_(
+                    [Status.UNSUBMITTED.value, Status.CREATED.value]
+                ),
+            )
+        )
+    ).first()
+    if diff is None:
+        return
+    merged = and_(
+        Diff.project == diff.project,
+        Diff.lang == diff.lang,
+        Diff.page_namespace == diff.page_namespace,
+        Diff.page_title == diff.page_title,
+        Diff.rev_user_text == diff.rev_user_text,
+        Diff.rev_id > diff.rev_parent_id,
+        Diff.rev_id < diff.rev_id,
+        Diff.status == Status.MERGED.value,
+    )
+    rev_ids = session.scalars(select(Diff.rev_id).where(merged)).all()
+    if not rev_ids:
+        return
+    session.execute(
+        update(Diff)
+        .where(Diff.rev_id.in_(rev_ids), merged)
+        .values(status=Status.UNSUBMITTED.value),
+        execution_options={"synchronize_session": False},
+    )
+    timestamp = Timestamp.utcnow()
+    session.add_all(
+        DiffEvent(
+            project=diff.project,
+            lang=diff.lang,
+            rev_id=restored,
+            status=Status.UNSUBMITTED.value,
+            timestamp=timestamp,
+        )
+        for restored in rev_ids
+    )
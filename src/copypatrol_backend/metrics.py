@@ -0,0 +1,270 @@
+"""Metrics of the jobs in the OpenMetrics text format."""
+from __future__ import annotations
+
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple
+
+import pywikibot
+
+
+if TYPE_CHECKING:
+    from collections.abc import Generator, Mapping
+
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# upper bounds of the histogram buckets, in seconds
+_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    math.inf,
+)
+_Labels = tuple[tuple[str, str], ...]
+
+
+class _Family(NamedTuple):
+    type: str
+    help: str
+
+
+FAMILIES = {
+    "copypatrol_stage_seconds": _Family(
+        "histogram",
+        "Seconds taken by a stage of checking a diff (stages may nest).",
+    ),
+    "copypatrol_tca_request_seconds": _Family(
+        "histogram",
+        "Seconds taken by a Turnitin Core API request.",
+    ),
+    "copypatrol_tca_responses": _Family(
+        "counter",
+        "Turnitin Core API responses by status code.",
+    ),
+    "copypatrol_stream_events": _Family(
+        "counter",
+        "Revision events received from the stream.",
+    ),
+    "copypatrol_diffs": _Family(
+        "counter",
+        "Diffs leaving a stage, by outcome.",
+    ),
+    "copypatrol_queue_depth": _Family(
+        "gauge",
+        "Stored diffs by status.",
+    ),
+}
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.buckets = [0] * len(_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float, /) -> None:
+        self.buckets[bisect.bisect_left(_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+_LOCK = threading.Lock()
+_COUNTERS: dict[tuple[str, _Labels], float] = {}
+_HISTOGRAMS: dict[tuple[str, _Labels], _Histogram] = {}
+_GAUGES: dict[str, Callable[[], Mapping[_Labels, float]]] = {}
+
+
+def _labels(labels: Mapping[str, object], /) -> _Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name: str, /, amount: float = 1, **labels: object) -> None:
+    """Add amount to a counter."""
+    key = (name, _labels(labels))
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + amount
+
+
+def observe(name: str, value: float, /, **labels: object) -> None:
+    """Record a value in a histogram."""
+    key = (name, _labels(labels))
+    with _LOCK:
+        histogram = _HISTOGRAMS.get(key)
+        if histogram is None:
+            histogram = _HISTOGRAMS[key] = _Histogram()
+        histogram.observe(value)
+
+
+@contextmanager
+def timed(stage: str, /, *, site: str) -> Generator[None, None, None]:
+    """Record the seconds taken by a stage for a site."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(
+            "copypatrol_stage_seconds",
+            time.perf_counter() - start,
+            stage=stage,
+            site=site,
+        )
+
+
+def set_gauge(
+    name: str,
+    func: Callable[[], Mapping[_Labels, float]],
+    /,
+) -> None:
+    """Set the function returning the values of a gauge when exported."""
+    with _LOCK:
+        _GAUGES[name] = func
+
+
+def clear() -> None:
+    """Remove all metrics."""
+    with _LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+        _GAUGES.clear()
+
+
+def _escape(value: str, /) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(labels: _Labels, /) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float, /) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """Return the metrics in the OpenMetrics text format."""
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        histograms = {
+            key: (list(h.buckets), h.count, h.sum)
+            for key, h in _HISTOGRAMS.items()
+        }
+        gauges = dict(_GAUGES)
+    gauge_values: dict[tuple[str, _Labels], float] = {}
+    for name, func in gauges.items():
+        try:
+            values = func()
+        except Exception:  # pragma: no cover
+            # a gauge that cannot be read is left out of this export
+            pywikibot.exception()
+            continue
+        gauge_values.update(
+            ((name, labels), value) for labels, value in values.items()
+        )
+    lines = []
+    for name, family in FAMILIES.items():
+        lines.append(f"# TYPE {name} {family.type}")
+        lines.append(f"# HELP {name} {family.help}")
+        if family.type == "counter":
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(
+                        f"{name}_total{_format_labels(labels)} "
+                        f"{_format_value(value)}"
+                    )
+        elif family.type == "gauge":
+            for (key_name, labels), value in sorted(gauge_values.items()):
+                if key_name == name:
+                    lines.append(
+                        f"{name}{_format_labels(labels)} "
+                        f"{_format_value(value)}"
+                    )
+        else:
+            for (key_name, labels), (buckets, count, total) in sorted(
+                histograms.items()
+            ):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(_BUCKETS, buckets):
+                    cumulative += bucket
+                    bucket_labels = (*labels, ("le", _format_value(bound)))
+                    lines.append(
+                        f"{name}_bucket{_format_labels(bucket_labels)} "
+                        f"{cumulative}"
+                    )
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                lines.append(
+                    f"{name}_sum{_format_labels(labels)} "
+                    f"{_format_value(total)}"
+                )
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write(path: str, /) -> None:
+    """Write the metrics to a file, replacing it atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def start_writer(path: str, /, *, interval: float) -> threading.Event:
+    """Write the metrics to a file every interval seconds.
+
+    Writing stops once the returned event is set.
+    """
+    stop = threading.Event()
+
+    def _run() -> None:
+        while not stop.wait(interval):
+            write(path)
+
+    threading.Thread(target=_run, daemon=True).start()
+    return stop
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802
+        content = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start_server(
+    port: int,
+    /,
+    *,
+    host: str = "127.0.0.1",
+) -> ThreadingHTTPServer:
+    """Serve the metrics over HTTP from a background thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
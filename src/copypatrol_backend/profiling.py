@@ -0,0 +1,175 @@
+"""Profile the CPU time and memory of a run or of sampled diffs."""
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, NamedTuple, TextIO
+
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+    from types import TracebackType
+
+
+# substrings of the profiled functions' file and name, by category
+CATEGORIES = {
+    "regex": ("re.Pattern", "/re/", "/re.py", "sre_"),
+    "mwparserfromhell": ("mwparserfromhell",),
+    "difflib": ("difflib",),
+    "http": ("_socket.socket", "ssl", "/http/client.py"),
+    "database": ("sqlalchemy", "pymysql", "sqlite3"),
+}
+_HOT_SPOTS = 30
+_DIFF_HOT_SPOTS = 10
+_ALLOCATION_SITES = 20
+_ACTIVE: Profiler | None = None
+
+
+class _DiffProfile(NamedTuple):
+    label: str
+    seconds: float
+    peak_memory: int
+    profile: cProfile.Profile
+
+
+def _categories(*profiles: cProfile.Profile) -> dict[str, float]:
+    """Return the own time of the functions in each category."""
+    result = dict.fromkeys(CATEGORIES, 0.0)
+    for profile in profiles:
+        profile.create_stats()
+        for (filename, _, name), row in profile.stats.items():
+            for category, needles in CATEGORIES.items():
+                if any(n in filename or n in name for n in needles):
+                    # the function's own time
+                    result[category] += row[2]
+                    break
+    return result
+
+
+def _write_stats(
+    f: TextIO,
+    *profiles: cProfile.Profile,
+    limit: int,
+) -> None:
+    stream = io.StringIO()
+    stats = pstats.Stats(*profiles, stream=stream)
+    f.write("time by category (own time):\n")
+    for category, seconds in _categories(*profiles).items():
+        f.write(f"  {category:<20}{seconds:10.3f}s\n")
+    stats.sort_stats("tottime").print_stats(limit)
+    f.write(stream.getvalue())
+
+
+class Profiler:
+    """Profile a run, or a random fraction of the diffs checked.
+
+    The report is written to path on exit.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        /,
+        *,
+        title: str,
+        diff_rate: float | None = None,
+    ) -> None:
+        self.path = path
+        self.title = title
+        self.diff_rate = diff_rate
+        self.diffs: list[_DiffProfile] = []
+        self._profile: cProfile.Profile | None = None
+        self._start = 0.0
+
+    def __enter__(self) -> Profiler:
+        global _ACTIVE
+        _ACTIVE = self
+        tracemalloc.start()
+        self._start = time.perf_counter()
+        if self.diff_rate is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        global _ACTIVE
+        if self._profile is not None:
+            self._profile.disable()
+        seconds = time.perf_counter() - self._start
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        _ACTIVE = None
+        with open(self.path, "w", encoding="utf-8") as f:
+            self._write(f, seconds, peak, snapshot)
+
+    @contextmanager
+    def diff(self, label: str, /) -> Generator[None, None, None]:
+        """Profile a diff if it is sampled."""
+        rate = self.diff_rate
+        # sampling, not security
+        if rate is None or random.random() >= rate:  # nosec B311
+            yield
+            return
+        profile = cProfile.Profile()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            self.diffs.append(_DiffProfile(label, seconds, peak, profile))
+
+    def _write(
+        self,
+        f: TextIO,
+        seconds: float,
+        peak: int,
+        snapshot: tracemalloc.Snapshot,
+        /,
+    ) -> None:
+        f.write(f"profile of {self.title}\n")
+        f.write(f"elapsed: {seconds:.3f}s, peak memory: {peak:,} bytes\n\n")
+        if self._profile is not None:
+            _write_stats(f, self._profile, limit=_HOT_SPOTS)
+        else:
+            f.write(f"{len(self.diffs)} sampled diffs\n\n")
+            for diff in sorted(self.diffs, key=lambda d: -d.seconds):
+                f.write(
+                    f"== {diff.label}: {diff.seconds:.3f}s, "
+                    f"peak memory: {diff.peak_memory:,} bytes ==\n"
+                )
+                _write_stats(f, diff.profile, limit=_DIFF_HOT_SPOTS)
+            if self.diffs:
+                f.write("== all sampled diffs ==\n")
+                _write_stats(
+                    f,
+                    *(diff.profile for diff in self.diffs),
+                    limit=_HOT_SPOTS,
+                )
+        f.write(f"allocations still held (top {_ALLOCATION_SITES} lines):\n")
+        for stat in snapshot.statistics("lineno")[:_ALLOCATION_SITES]:
+            f.write(f"  {stat}\n")
+
+
+@contextmanager
+def diff(label: str, /) -> Generator[None, None, None]:
+    """Profile a diff if profiling is active and the diff is sampled."""
+    if _ACTIVE is None:
+        yield
+        return
+    with _ACTIVE.diff(label):
+        yield
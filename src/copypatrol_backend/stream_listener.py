@@ -1,11 +1,12 @@
 """Listen to EventStreams."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable
 
 from pywikibot.comms.eventstreams import EventStreams
 
-from copypatrol_backend.config import domains, site_config
+from copypatrol_backend.config import min_size_delta, snapshot
 
 
 if TYPE_CHECKING:
@@ -15,24 +16,130 @@ if TYPE_CHECKING:
     from pywikibot.site import APISite
 
 
+class _PageLengths:
+    """Least recently used cache of the latest revision of pages."""
+
+    def __init__(self, maxsize: int = 100_000) -> None:
+        self._maxsize = maxsize
+        self._data: OrderedDict[
+            tuple[str, int], tuple[int, int]
+        ] = OrderedDict()
+
+    def parent_length(self, data: dict[str, Any], /) -> int | None:
+        """Return the length of the event's parent revision, if known."""
+        if not data.get("rev_parent_id"):
+            return 0
+        key = (data["meta"]["domain"], data["page_id"])
+        cached = self._data.get(key)
+        if cached is None or cached[0] != data["rev_parent_id"]:
+            return None
+        return cached[1]
+
+    def add(self, data: dict[str, Any], /) -> None:
+        """Store the event's revision as the latest of its page."""
+        key = (data["meta"]["domain"], data["page_id"])
+        self._data[key] = (data["rev_id"], data["rev_len"])
+        self._data.move_to_end(key)
+        if len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+
+def _size_delta_filter(
+    min_delta: Callable[[], int],
+    /,
+    *,
+    lengths: _PageLengths | None = None,
+) -> Callable[[dict[str, Any]], bool]:
+    """Return a filter for revisions that grew the page by min_delta().
+
+    Revisions are kept when the size of their parent is not known, and
+    pages are not tracked while min_delta() is not positive. Only the net
+    size change is known from the stream, so edits replacing text with
+    about as much new text are dropped.
+    """
+    cache = _PageLengths() if lengths is None else lengths
+
+    def _filter(data: dict[str, Any], /) -> bool:
+        delta = min_delta()
+        if delta <= 0:
+            return True
+        parent_length = cache.parent_length(data)
+        cache.add(data)
+        if parent_length is None:
+            return True
+        return data["rev_len"] - parent_length >= delta
+
+    return _filter
+
+
 def _site_filter(data: dict[str, Any], /) -> bool:
-    domain = data["meta"]["domain"]
-    if domain not in domains():
+    # read the snapshot for each event to follow reloads
+    config = snapshot().sites.get(data["meta"]["domain"])
+    if config is None or not config.enabled:
         return False
-    if data["page_namespace"] not in site_config(domain).namespaces:
+    if data["page_namespace"] not in config.namespaces:
         return False
     return True
 
 
-def revision_stream(
+def _revert_filter(data: dict[str, Any], /) -> bool:
+    if data["meta"]["stream"] == "mediawiki.page-delete":
+        return True
+    return "mw-reverted" in data["tags"]
+
+
+def revert_stream(
     site: APISite,
     *,
     since: datetime.datetime | None = None,
     total: int | None = None,
 ) -> Generator[dict[str, Any], None, None]:
-    """Yield from the filtered revision stream."""
+    """Yield reverted revisions and deleted pages."""
+    stream = EventStreams(
+        streams=["page-delete", "revision-tags-change"],
+        site=site,
+        since=since,
+    )
+    stream.register_filter(_site_filter)
+    stream.register_filter(_revert_filter)
+    stream.set_maximum_items(total)
+    yield from stream
+
+
+def raw_revision_stream(
+    site: APISite,
+    *,
+    since: datetime.datetime | None = None,
+    total: int | None = None,
+) -> Generator[dict[str, Any], None, None]:
+    """Yield every revision from the stream, without filtering."""
     stream = EventStreams(streams="revision-create", site=site, since=since)
+    stream.set_maximum_items(total)
+    yield from stream
+
+
+def revision_stream(
+    site: APISite,
+    *,
+    since: datetime.datetime | None = None,
+    total: int | None = None,
+    url: str | None = None,
+) -> Generator[dict[str, Any], None, None]:
+    """Yield from the filtered revision stream.
+
+    Events are read from url instead of EventStreams when it is given,
+    e.g. to replay recorded events.
+    """
+    kwargs = {} if url is None else {"url": url}
+    stream = EventStreams(
+        streams="revision-create",
+        site=site,
+        since=since,
+        **kwargs,
+    )
     stream.register_filter(_site_filter)
+    # before the other filters to see every revision of the pages
+    stream.register_filter(_size_delta_filter(min_size_delta))
     stream.register_filter(rev_content_changed=True)
     stream.register_filter(lambda data: not data["performer"]["user_is_bot"])
     stream.register_filter(lambda data: data["rev_len"] > 500)
@@ -1,7 +1,9 @@
 """Turnitin Core API."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Union
+import re
+from typing import TYPE_CHECKING, Any, NamedTuple, Union
+from urllib.parse import urlsplit
 from uuid import UUID
 
 import pywikibot
@@ -11,18 +13,16 @@ from requests.adapters import HTTPAdapter
 from requests.utils import default_user_agent
 from urllib3.util import Retry
 
+from copypatrol_backend import metrics
 from copypatrol_backend.config import tca_config
-from copypatrol_backend.database import Source
 
 
 if TYPE_CHECKING:
     from pywikibot.site import APISite
 
 
-CONFIG = tca_config()
 _VERSION = "0.0.0"
 HEADERS = {
-    "Authorization": f"Bearer {CONFIG.key}",
     "From": "copypatrol.backend@toolforge.org",
     "User-Agent": (
         f"copypatrol-backend-bot/{_VERSION} ({default_user_agent()})"
@@ -31,16 +31,58 @@ HEADERS = {
     "X-Turnitin-Integration-Version": _VERSION,
 }
 
+_ID_REGEX = re.compile(r"/[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}")
 _JSON = Union[bool, float, str, None, dict[str, "_JSON"], list["_JSON"]]
 JSON = dict[str, _JSON]
 
 
+class Source(NamedTuple):
+    """Source found in a report."""
+
+    submission_id: UUID
+    description: str
+    url: str | None
+    percent: float
+
+
+class _HTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout."""
+
+    def send(  # type: ignore[override]
+        self,
+        request: requests.PreparedRequest,
+        **kwargs: Any,
+    ) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = pywikibot.config.socket_timeout
+        return super().send(request, **kwargs)
+
+
+def _record_response(
+    response: requests.Response, /, *args: Any, **kwargs: Any
+) -> None:
+    """Record the time taken and status code of a response."""
+    path = urlsplit(response.url).path.partition("/api/v1")[2]
+    endpoint = f"{response.request.method} {_ID_REGEX.sub('/{id}', path)}"
+    metrics.observe(
+        "copypatrol_tca_request_seconds",
+        response.elapsed.total_seconds(),
+        endpoint=endpoint,
+    )
+    metrics.increment(
+        "copypatrol_tca_responses",
+        endpoint=endpoint,
+        code=response.status_code,
+    )
+
+
 class TurnitinCoreAPI:
     """Turnitin Core API."""
 
     def __init__(self) -> None:
         super().__init__()
-        self._base_url = f"https://{CONFIG.domain}/api/v1"
+        config = tca_config()
+        self._base_url = f"{config.scheme}://{config.domain}/api/v1"
         retry = Retry(
             total=pywikibot.config.max_retries,
             status_forcelist=(429, 500),
@@ -49,8 +91,21 @@ class TurnitinCoreAPI:
         )
         self._session = requests.Session()
         self._session.headers.update(HEADERS)
-        self._session.mount(self._base_url, HTTPAdapter(max_retries=retry))
-        self._accept_eula(self._latest_eula_version())
+        self._session.headers["Authorization"] = f"Bearer {config.key}"
+        self._session.hooks["response"].append(_record_response)
+        self._session.mount(
+            self._base_url,
+            _HTTPAdapter(max_retries=retry, pool_maxsize=config.max_workers),
+        )
+        self._eula_version: str | None = None
+        self.accept_eula()
+
+    def accept_eula(self) -> None:
+        """Accept the latest EULA version if it was not accepted yet."""
+        version = self._latest_eula_version()
+        if version != self._eula_version:
+            self._accept_eula(version)
+            self._eula_version = version
 
     def _latest_eula_version(self) -> str:
         data = self._session.get(
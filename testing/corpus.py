@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import random
+from functools import cache
+from typing import NamedTuple
+
+from testing.resources import resource
+
+
+_WORDS = {
+    "en": (
+        "the of and to in a is was for on as with by that from at his her "
+        "it an were which are this be also has or had first one their its "
+        "after new who they two been have more but not other when some "
+        "shepherds carol song melody hymn church village winter choir "
+        "published composer collection version verse stanza tradition"
+    ).split(),
+    "de": (
+        "der die und in den von zu das mit sich des auf für ist im dem "
+        "nicht ein eine als auch es an werden aus er hat daß sie nach "
+        "Hirten Lied Weihnachten Kirche Strophe Melodie Sammlung"
+    ).split(),
+    "ru": (
+        "и в не на я что тот быть с он а весь это как она по но они к у "
+        "пастухи песня рождество церковь мелодия сборник куплет"
+    ).split(),
+    "ar": (
+        "في من على إلى أن عن مع هذا التي الذي كان بين كل بعد قبل "
+        "الرعاة أغنية الميلاد كنيسة لحن مجموعة"
+    ).split(),
+    "zh": "的 一 是 在 不 了 有 和 人 这 中 大 为 上 个 国 我 以 要 他 牧羊人 歌曲 圣诞 教堂 旋律".split(),
+}
+
+
+class Case(NamedTuple):
+    """Old and new revision text of a benchmark case."""
+
+    old: str
+    new: str
+
+
+def _sentence(rng: random.Random, lang: str, /) -> str:
+    words = rng.choices(_WORDS[lang], k=rng.randint(8, 30))
+    separator = "" if lang == "zh" else " "
+    return separator.join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, /, *, langs: tuple[str, ...]) -> str:
+    sentences = []
+    for _ in range(rng.randint(3, 8)):
+        sentence = _sentence(rng, rng.choice(langs))
+        roll = rng.random()
+        if roll < 0.1:
+            sentence = f"'''{sentence}'''"
+        elif roll < 0.2:
+            sentence = f"[[{sentence.split()[0]}]] {sentence}"
+        elif roll < 0.25:
+            sentence += f" [https://example.org/{rng.randrange(10**6)} link]"
+        sentences.append(sentence)
+    return " ".join(sentences)
+
+
+def _quote(rng: random.Random, /, *, langs: tuple[str, ...]) -> str:
+    return f'"{_sentence(rng, rng.choice(langs))}"'
+
+
+def _template(rng: random.Random, /) -> str:
+    n = rng.randrange(10**6)
+    return (
+        f"{{{{cite web |url=https://example.org/{n} |title=Source {n} "
+        f"|date=2023-01-{rng.randint(1, 28):02} |access-date=2023-02-01}}}}"
+    )
+
+
+def _infobox(rng: random.Random, /) -> str:
+    fields = "\n".join(
+        f"| field{i} = {_sentence(rng, 'en')}" for i in range(20)
+    )
+    return f"{{{{Infobox song\n{fields}\n}}}}"
+
+
+def _article(
+    rng: random.Random,
+    size: int,
+    /,
+    *,
+    langs: tuple[str, ...] = ("en",),
+    quotes: float = 0.0,
+    templates: float = 0.0,
+) -> list[str]:
+    blocks = [_infobox(rng)] if templates else []
+    length = 0
+    while length < size:
+        block = _paragraph(rng, langs=langs)
+        if rng.random() < quotes:
+            block = f"{block} {_quote(rng, langs=langs)}"
+        if rng.random() < templates:
+            block = f"{block}<ref>{_template(rng)}</ref>"
+        if rng.random() < 0.05:
+            block = f"== {_sentence(rng, langs[0])} ==\n{block}"
+        blocks.append(block)
+        length += len(block)
+    return blocks
+
+
+def _edit(
+    rng: random.Random,
+    blocks: list[str],
+    /,
+    *,
+    langs: tuple[str, ...],
+) -> Case:
+    """Insert and replace about a tenth of the paragraphs."""
+    new_blocks = list(blocks)
+    for _ in range(max(1, len(blocks) // 10)):
+        index = rng.randrange(len(new_blocks))
+        added = "\n\n".join(
+            _paragraph(rng, langs=langs) for _ in range(rng.randint(1, 3))
+        )
+        if rng.random() < 0.5:
+            new_blocks.insert(index, added)
+        else:
+            new_blocks[index] = added
+    return Case("\n\n".join(blocks), "\n\n".join(new_blocks))
+
+
+def _generated(
+    seed: int,
+    size: int,
+    /,
+    *,
+    langs: tuple[str, ...] = ("en",),
+    quotes: float = 0.0,
+    templates: float = 0.0,
+) -> Case:
+    rng = random.Random(seed)
+    blocks = _article(
+        rng,
+        size,
+        langs=langs,
+        quotes=quotes,
+        templates=templates,
+    )
+    return _edit(rng, blocks, langs=langs)
+
+
+@cache
+def corpus() -> dict[str, Case]:
+    """Return the benchmark cases by name.
+
+    Cases are generated deterministically, except for the curated ones
+    taken from the fixtures.
+    """
+    return {
+        "curated": Case(
+            resource("Kommet,_ihr_Hirten-1125722395.txt"),
+            resource("Kommet,_ihr_Hirten-1126962296.txt"),
+        ),
+        "small": _generated(1, 5_000),
+        "medium": _generated(2, 20_000),
+        "large": _generated(3, 300_000),
+        "quotes": _generated(4, 20_000, quotes=0.8),
+        "templates": _generated(5, 20_000, templates=0.8),
+        "multilingual": _generated(6, 20_000, langs=tuple(_WORDS)),
+    }
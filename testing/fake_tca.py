@@ -0,0 +1,300 @@
+"""Local stand-in for the Turnitin Core API.
+
+Run it with ``python -m testing.fake_tca`` and point the ``[tca]`` section
+at it (``scheme = http``, ``domain = 127.0.0.1:<port>``).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, NamedTuple
+from uuid import uuid4
+
+
+_SUBMISSION = r"/api/v1/submissions/(?P<sid>[0-9a-f-]{36})"
+_ROUTES = [
+    ("GET", re.compile(r"/api/v1/eula/latest"), "eula"),
+    ("POST", re.compile(r"/api/v1/eula/[^/]+/accept"), "accept_eula"),
+    ("POST", re.compile(r"/api/v1/submissions"), "create_submission"),
+    ("PUT", re.compile(rf"{_SUBMISSION}/original"), "upload_submission"),
+    ("GET", re.compile(_SUBMISSION), "submission_info"),
+    ("PUT", re.compile(rf"{_SUBMISSION}/similarity"), "generate_report"),
+    ("GET", re.compile(rf"{_SUBMISSION}/similarity"), "report_info"),
+    (
+        "GET",
+        re.compile(rf"{_SUBMISSION}/similarity/view/sources"),
+        "report_sources",
+    ),
+]
+
+
+class Behavior(NamedTuple):
+    """How the fake API behaves."""
+
+    latency: float = 0.0
+    """Seconds taken to answer each request."""
+    processing_time: float = 0.0
+    """Seconds after an upload until the submission is complete."""
+    report_time: float = 0.0
+    """Seconds after a report is requested until it is complete."""
+    error_rate: float = 0.0
+    """Fraction of requests answered with a 500 error."""
+    rate_limit: float = 0.0
+    """Requests per second answered before a 429 error (0 for no limit)."""
+    match_rate: float = 1.0
+    """Fraction of reports with a matching source."""
+    seed: int | None = None
+
+
+class _Submission:
+    def __init__(self, *, matched: bool) -> None:
+        self.matched = matched
+        self.uploaded: float | None = None
+        self.report_requested: float | None = None
+
+
+class FakeTCA:
+    """Answer requests like the Turnitin Core API.
+
+    stats counts the requests answered by endpoint, and the 429 and 500
+    errors.
+    """
+
+    def __init__(self, behavior: Behavior | None = None, /) -> None:
+        if behavior is None:
+            behavior = Behavior()
+        self.behavior = behavior
+        self.stats: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(behavior.seed)
+        self._submissions: dict[str, _Submission] = {}
+        self._window = 0
+        self._window_requests = 0
+
+    def respond(
+        self,
+        method: str,
+        path: str,
+        body: bytes,
+        /,
+    ) -> tuple[int, dict[str, Any]]:
+        """Return the status and JSON body answering a request."""
+        time.sleep(self.behavior.latency)
+        with self._lock:
+            if self._rate_limited():
+                self.stats["429"] += 1
+                return 429, {"message": "Too Many Requests"}
+            if self._random.random() < self.behavior.error_rate:
+                self.stats["500"] += 1
+                return 500, {"message": "Internal Server Error"}
+            for route_method, regex, name in _ROUTES:
+                if method == route_method and (match := regex.fullmatch(path)):
+                    self.stats[name] += 1
+                    handler = getattr(self, f"_{name}")
+                    return handler(body, **match.groupdict())
+            return 404, {"message": "Not Found"}
+
+    def _rate_limited(self) -> bool:
+        if not self.behavior.rate_limit:
+            return False
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._window_requests = 0
+        self._window_requests += 1
+        return self._window_requests > self.behavior.rate_limit
+
+    def _eula(self, body: bytes, /) -> tuple[int, dict[str, Any]]:
+        return 200, {"version": "v1beta"}
+
+    def _accept_eula(self, body: bytes, /) -> tuple[int, dict[str, Any]]:
+        return 200, json.loads(body)
+
+    def _create_submission(
+        self,
+        body: bytes,
+        /,
+    ) -> tuple[int, dict[str, Any]]:
+        sid = str(uuid4())
+        matched = self._random.random() < self.behavior.match_rate
+        self._submissions[sid] = _Submission(matched=matched)
+        return 201, {"id": sid, "status": "CREATED", **json.loads(body)}
+
+    def _upload_submission(
+        self,
+        body: bytes,
+        /,
+        *,
+        sid: str,
+    ) -> tuple[int, dict[str, Any]]:
+        if sid not in self._submissions:
+            return 404, {"message": "Not Found"}
+        self._submissions[sid].uploaded = time.monotonic()
+        return 202, {"message": "Successfully uploaded file"}
+
+    def _submission_info(
+        self,
+        body: bytes,
+        /,
+        *,
+        sid: str,
+    ) -> tuple[int, dict[str, Any]]:
+        if sid not in self._submissions:
+            return 404, {"message": "Not Found"}
+        uploaded = self._submissions[sid].uploaded
+        if uploaded is None:
+            status = "CREATED"
+        elif time.monotonic() < uploaded + self.behavior.processing_time:
+            status = "PROCESSING"
+        else:
+            status = "COMPLETE"
+        return 200, {"id": sid, "status": status}
+
+    def _generate_report(
+        self,
+        body: bytes,
+        /,
+        *,
+        sid: str,
+    ) -> tuple[int, dict[str, Any]]:
+        if sid not in self._submissions:
+            return 404, {"message": "Not Found"}
+        self._submissions[sid].report_requested = time.monotonic()
+        return 202, {"message": "Successfully scheduled similarity report"}
+
+    def _report_info(
+        self,
+        body: bytes,
+        /,
+        *,
+        sid: str,
+    ) -> tuple[int, dict[str, Any]]:
+        submission = self._submissions.get(sid)
+        if submission is None or submission.report_requested is None:
+            return 404, {"message": "Not Found"}
+        if (
+            time.monotonic()
+            < submission.report_requested + self.behavior.report_time
+        ):
+            return 200, {"submission_id": sid, "status": "PROCESSING"}
+        return 200, {
+            "submission_id": sid,
+            "status": "COMPLETE",
+            "top_source_largest_matched_word_count": (
+                100 if submission.matched else 0
+            ),
+        }
+
+    def _report_sources(
+        self,
+        body: bytes,
+        /,
+        *,
+        sid: str,
+    ) -> tuple[int, dict[str, Any]]:
+        if sid not in self._submissions:
+            return 404, {"message": "Not Found"}
+        url = f"https://example.org/{sid}"
+        source = {"description": url, "link": url, "percent": 89.28571}
+        return 200, {
+            "submission_id": sid,
+            "match_aggregates": [
+                {
+                    "is_excluded": False,
+                    "match_sources": [{**source, "is_excluded": False}],
+                }
+            ],
+        }
+
+
+class FakeTCAServer(ThreadingHTTPServer):
+    """HTTP server answering with a FakeTCA."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], api: FakeTCA, /) -> None:
+        super().__init__(address, _Handler)
+        self.api = api
+
+    @property
+    def domain(self) -> str:
+        """Return the host and port to configure as the TCA domain."""
+        host, port = self.server_address[:2]
+        return f"{host!s}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeTCAServer
+
+    def _respond(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = self.path.partition("?")[0]
+        status, data = self.server.api.respond(self.command, path, body)
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._respond()
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._respond()
+
+    def do_PUT(self) -> None:  # noqa: N802
+        self._respond()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def add_behavior_arguments(parser: argparse.ArgumentParser, /) -> None:
+    """Add an option for each field of Behavior."""
+    for field, default in Behavior._field_defaults.items():
+        parser.add_argument(
+            f"--{field.replace('_', '-')}",
+            type=int if field == "seed" else float,
+            default=default,
+        )
+
+
+def behavior_from_args(args: argparse.Namespace, /) -> Behavior:
+    """Return the Behavior from the parsed options."""
+    return Behavior(
+        **{field: getattr(args, field) for field in Behavior._fields}
+    )
+
+
+def main(*args: str) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_behavior_arguments(parser)
+    parsed_args = parser.parse_args(args or None)
+    api = FakeTCA(behavior_from_args(parsed_args))
+    server = FakeTCAServer((parsed_args.host, parsed_args.port), api)
+    print(f"serving on http://{server.domain}/api/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(api.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
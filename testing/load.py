@@ -0,0 +1,182 @@
+"""Load test the TCA jobs against the local stand-in API.
+
+The ``[tca]`` section must point at a free local address over http, and
+the ``[client]`` section at a scratch database::
+
+    python -m testing.load 1000 --latency 0.05 --report-time 5
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Callable
+
+import pywikibot
+from sqlalchemy import select
+
+from copypatrol_backend import cli, database
+from copypatrol_backend.config import tca_config
+from copypatrol_backend.tca import TurnitinCoreAPI
+from testing.corpus import corpus
+from testing.fake_tca import (
+    FakeTCA,
+    FakeTCAServer,
+    add_behavior_arguments,
+    behavior_from_args,
+)
+
+
+if TYPE_CHECKING:
+    from pywikibot.site import APISite
+    from sqlalchemy.orm import Session as _Session
+
+
+FIRST_REV_ID = 4_200_000_000
+_IN_PROGRESS = [
+    database.Status.UNSUBMITTED,
+    database.Status.CREATED,
+    database.Status.UPLOADED,
+    database.Status.PENDING,
+]
+
+
+def _add_diffs(site: APISite, total: int, /) -> None:
+    """Store total diffs with their text, ready to be checked."""
+    text = corpus()["small"].new
+    timestamp = pywikibot.Timestamp.utcnow() - datetime.timedelta(days=1)
+    with database.Session.begin() as db_session:
+        for i in range(total):
+            database.add_revision(
+                session=db_session,
+                page=pywikibot.Page(site, f"Load test {i}"),
+                rev_id=FIRST_REV_ID + i,
+                rev_parent_id=FIRST_REV_ID + i - 1,
+                rev_timestamp=timestamp,
+                rev_user_text="Example",
+            )
+        for diff in _diffs(db_session, total):
+            database.set_diff_text(db_session, diff, text)
+
+
+def _diffs(session: _Session, total: int, /) -> list[database.Diff]:
+    stmt = select(database.Diff).where(
+        database.Diff.rev_id.between(FIRST_REV_ID, FIRST_REV_ID + total - 1)
+    )
+    return list(session.scalars(stmt).unique())
+
+
+def _statuses(total: int, /) -> Counter[str]:
+    with database.Session() as db_session:
+        return Counter(
+            database.Status(diff.status).name
+            for diff in _diffs(db_session, total)
+        )
+
+
+def _remove_diffs(site: APISite, total: int, /) -> None:
+    with database.Session.begin() as db_session:
+        for i in range(total):
+            database.remove_revision(db_session, site, FIRST_REV_ID + i)
+
+
+def _check_reports(api: TurnitinCoreAPI, /) -> None:
+    """Check the reports like cli._check_reports, without the wiki."""
+    ignore_list = cli._IgnoreList.from_patterns(0, [])
+    with database.Session.begin() as db_session:
+        for batch in cli._batches(
+            db_session,
+            "check-reports",
+            database.diffs_by_status(db_session, [database.Status.PENDING]),
+        ):
+            cli._check_reports_batch(
+                db_session,
+                api,
+                batch,
+                ignore_list=ignore_list,
+                pagetriage=cli._PageTriageQueue(),
+            )
+
+
+def _timed(
+    timings: defaultdict[str, float],
+    name: str,
+    func: Callable[..., object],
+    /,
+    *args: object,
+) -> None:
+    start = time.perf_counter()
+    func(*args)
+    timings[name] += time.perf_counter() - start
+
+
+def run(
+    site: APISite,
+    fake_api: FakeTCA,
+    total: int,
+    /,
+    *,
+    timeout: float,
+    poll_interval: float,
+) -> None:
+    """Push total diffs through the TCA jobs and print the throughput."""
+    _add_diffs(site, total)
+    timings: defaultdict[str, float] = defaultdict(float)
+    start = time.perf_counter()
+    try:
+        api = TurnitinCoreAPI()
+        while time.perf_counter() - start < timeout:
+            _timed(timings, "check-changes", cli._check_changes, api)
+            _timed(timings, "check-reports", _check_reports, api)
+            _timed(timings, "generate-reports", cli._generate_reports, api)
+            statuses = _statuses(total)
+            if not any(statuses[status.name] for status in _IN_PROGRESS):
+                break
+            time.sleep(poll_interval)
+        elapsed = time.perf_counter() - start
+        statuses = _statuses(total)
+    finally:
+        _remove_diffs(site, total)
+    done = statuses["READY"] + (total - sum(statuses.values()))
+    print(f"diffs: {total}, max-workers: {tca_config().max_workers}")
+    print(f"elapsed: {elapsed:.1f}s, done: {done} ({done / elapsed:.2f}/s)")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.1f}s")
+    print(f"statuses: {dict(statuses)}")
+    print(f"requests: {dict(fake_api.stats)}")
+
+
+def main(*args: str) -> int:
+    local_args = pywikibot.handle_args(args)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("diffs", type=int)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--poll-interval", type=float, default=1)
+    add_behavior_arguments(parser)
+    parsed_args = parser.parse_args(local_args)
+    config = tca_config()
+    if config.scheme != "http":
+        parser.error("the [tca] scheme must be http")
+    host, _, port = config.domain.partition(":")
+    fake_api = FakeTCA(behavior_from_args(parsed_args))
+    server = FakeTCAServer((host, int(port or 80)), fake_api)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        run(
+            pywikibot.Site(),
+            fake_api,
+            parsed_args.diffs,
+            timeout=parsed_args.timeout,
+            poll_interval=parsed_args.poll_interval,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,178 @@
+"""Replay recorded revision events like EventStreams.
+
+Record events with ``copypatrol-backend record-changes FILE``, serve them
+with ``python -m testing.replay_stream FILE --speed 10`` and point
+``copypatrol-backend store-changes --stream-url`` at the printed URL.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import gzip
+import json
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, NamedTuple
+
+
+class Event(NamedTuple):
+    """Recorded event."""
+
+    offset: float
+    """Seconds after the first recorded event."""
+    data: str
+    """Event as a JSON string."""
+
+
+def _timestamp(data: dict[str, Any], /) -> float:
+    # fromisoformat does not accept a Z suffix before Python 3.11
+    dt = data["meta"]["dt"].replace("Z", "+00:00")
+    return datetime.datetime.fromisoformat(dt).timestamp()
+
+
+def load_events(path: str, /) -> list[Event]:
+    """Return the events recorded in a gzipped JSON lines file."""
+    events = []
+    start = None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            timestamp = _timestamp(json.loads(line))
+            if start is None:
+                start = timestamp
+            events.append(Event(max(timestamp - start, 0.0), line.strip()))
+    return events
+
+
+def replay(
+    events: list[Event],
+    write: Callable[[bytes], object],
+    /,
+    *,
+    speed: float,
+    first: int = 0,
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], object] = time.sleep,
+) -> int:
+    """Write the events from first as server-sent events.
+
+    Events are paced by their recorded offsets divided by speed, or
+    written as fast as possible when speed is 0. The number of events
+    written is returned.
+    """
+    start = clock()
+    base = events[first].offset if first < len(events) else 0.0
+    written = 0
+    for index in range(first, len(events)):
+        event = events[index]
+        if speed:
+            delay = (event.offset - base) / speed - (clock() - start)
+            if delay > 0:
+                sleep(delay)
+        # the index is the event ID, to resume after reconnecting
+        write(f"event: message\nid: {index}\ndata: {event.data}\n\n".encode())
+        written += 1
+    return written
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """HTTP server replaying the events to each client.
+
+    stats counts the events written and the connections.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        events: list[Event],
+        /,
+        *,
+        speed: float,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.events = events
+        self.speed = speed
+        self.stats: Counter[str] = Counter()
+
+    @property
+    def url(self) -> str:
+        """Return the URL to read the events from."""
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}/v2/stream/revision-create"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: ReplayServer
+
+    def do_GET(self) -> None:  # noqa: N802
+        last_id = self.headers.get("Last-Event-ID")
+        first = int(last_id) + 1 if last_id and last_id.isdigit() else 0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.server.stats["connections"] += 1
+        start = time.perf_counter()
+        written = 0
+
+        def _write(message: bytes, /) -> None:
+            nonlocal written
+            self.wfile.write(message)
+            written += 1
+
+        try:
+            replay(
+                self.server.events,
+                _write,
+                speed=self.server.speed,
+                first=first,
+            )
+            self.wfile.flush()
+            # hold the connection open like EventStreams when idle
+            while True:
+                time.sleep(1)
+                self.wfile.write(b":\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.stats["events"] += written
+            elapsed = time.perf_counter() - start
+            self.log_message("%d events in %.1fs", written, elapsed)
+
+
+def main(*args: str) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="gzipped JSON lines file of events")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="multiple of the recorded rate, e.g. 10 (0 for no pacing)",
+    )
+    parsed_args = parser.parse_args(args or None)
+    events = load_events(parsed_args.file)
+    server = ReplayServer(
+        (parsed_args.host, parsed_args.port),
+        events,
+        speed=parsed_args.speed,
+    )
+    print(f"replaying {len(events)} events on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(server.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
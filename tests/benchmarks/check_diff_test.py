@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import difflib
+import tracemalloc
+from typing import TYPE_CHECKING
+
+import pytest
+import pywikibot
+from pywikibot.page import Revision
+
+from copypatrol_backend import check_diff
+from testing.corpus import Case, corpus
+
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
+
+SITE = pywikibot.Site("en", "wikipedia")
+# diffing is quadratic in the text size, so the large case is only cleaned
+# or compared by its changed regions
+CLEAN_CASES = list(corpus())
+DIFF_CASES = [name for name in corpus() if name != "large"]
+# peak traced memory allowed per byte of the new revision's text
+MEMORY_PER_BYTE = 64
+
+
+def _run(benchmark, func, /, *args, size, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_memory"] = peak
+    assert peak <= MEMORY_PER_BYTE * size + 2**20
+    return benchmark(func, *args, **kwargs)
+
+
+@pytest.mark.parametrize("name", CLEAN_CASES)
+def test_clean_wikitext(benchmark, name):
+    text = corpus()[name].new
+    benchmark.group = "clean_wikitext"
+    _run(
+        benchmark,
+        check_diff._clean_wikitext,
+        text,
+        site=SITE,
+        size=len(text.encode()),
+    )
+
+
+@pytest.mark.parametrize("name", DIFF_CASES)
+def test_added_revision_text(benchmark, name):
+    case = corpus()[name]
+    benchmark.group = "added_revision_text"
+    _run(
+        benchmark,
+        check_diff._added_revision_text,
+        case.old,
+        case.new,
+        site=SITE,
+        size=len(case.new.encode()),
+    )
+
+
+def _regions(case: Case, /) -> tuple[str, str]:
+    """Return the changed paragraphs, like the compare API's regions."""
+    old = case.old.split("\n\n")
+    new = case.new.split("\n\n")
+    old_regions, new_regions = [], []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            old_regions += old[i1:i2]
+            new_regions += new[j1:j2]
+    return "\n\n".join(old_regions), "\n\n".join(new_regions)
+
+
+def _mock_revisions(mocker: MockerFixture, case: Case, /) -> None:
+    revs = {
+        revid: Revision(
+            revid=revid,
+            comment="",
+            size=len(text.encode()),
+            slots={"main": {"*": text}},
+            tags=[],
+            user="Example",
+        )
+        for revid, text in ((1, case.old), (2, case.new))
+    }
+    mocker.patch(
+        "copypatrol_backend.check_diff._load_revisions",
+        side_effect=lambda site, revids, **kwargs: {
+            revid: revs[revid] for revid in revids
+        },
+    )
+
+
+@pytest.mark.parametrize("name", DIFF_CASES)
+def test_check_diff(benchmark, mocker, name):
+    case = corpus()[name]
+    _mock_revisions(mocker, case)
+    page = pywikibot.Page(SITE, "Benchmark")
+    benchmark.group = "check_diff"
+    _run(
+        benchmark,
+        check_diff.check_diff,
+        page,
+        1,
+        2,
+        size=len(case.new.encode()),
+    )
+
+
+@pytest.mark.parametrize("name", CLEAN_CASES)
+def test_check_diff_compare(benchmark, mocker, name):
+    case = corpus()[name]
+    _mock_revisions(mocker, case)
+    mocker.patch(
+        "copypatrol_backend.check_diff._compare_revisions",
+        return_value=_regions(case),
+    )
+    page = pywikibot.Page(SITE, "Benchmark")
+    benchmark.group = "check_diff_compare"
+    _run(
+        benchmark,
+        check_diff.check_diff,
+        page,
+        1,
+        2,
+        compare=True,
+        size=len(case.new.encode()),
+    )
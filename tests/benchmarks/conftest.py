@@ -0,0 +1,41 @@
+"""Configure pytest for the benchmarks."""
+from __future__ import annotations
+
+import os.path
+import re
+from unittest import mock
+
+import pytest
+from pytest_socket import disable_socket  # type: ignore[import]
+
+
+HERE = os.path.dirname(__file__)
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("benchmark_only"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks run with --benchmark-only")
+    for item in items:
+        if str(item.path).startswith(HERE):
+            item.add_marker(skip)
+
+
+def pytest_runtest_setup():
+    disable_socket()
+
+
+@pytest.fixture(autouse=True, scope="session")
+def mock_site():
+    from pywikibot.site import Namespace, NamespacesDict
+
+    regex = re.compile(r"(File|Image)\s*:.+?\.(png|gif|jpg|jpeg)", flags=re.I)
+    with mock.patch(
+        "pywikibot.site.APISite.namespaces",
+        new_callable=mock.PropertyMock,
+        return_value=NamespacesDict(Namespace.builtin_namespaces()),
+    ), mock.patch(
+        "copypatrol_backend.check_diff._file_name_regex",
+        return_value=regex,
+    ):
+        yield
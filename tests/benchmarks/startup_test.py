@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+
+# mean seconds allowed to start a new interpreter and import the CLI,
+# measured at about 0.7s, mostly importing pywikibot; the database,
+# TCA client and profiling modules are imported by the subcommands
+STARTUP_BUDGET = 0.85
+
+
+def test_import_cli(benchmark):
+    benchmark.group = "startup"
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-c", "import copypatrol_backend.cli"],),
+        kwargs={"check": True, "capture_output": True},
+        rounds=5,
+    )
+    assert benchmark.stats.stats.mean <= STARTUP_BUDGET
@@ -26,7 +26,12 @@ def db_session(engine, setup_database):
     connection = engine.connect()
     transaction = connection.begin()
     session = scoped_session(
-        sessionmaker(autocommit=False, autoflush=False, bind=connection)
+        sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=connection,
+            class_=database._AppSession,
+        )
     )
     yield session
     session.close()
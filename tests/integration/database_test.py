@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import uuid
+from datetime import datetime
 
 import pytest
 import pywikibot
+from sqlalchemy import DateTime, bindparam, create_engine, inspect, select
+from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import text
 
 from copypatrol_backend import database
@@ -47,14 +50,18 @@ def test_add_revision(db_session):
         "page_title": b"Add_revision",
         "rev_id": 1001,
         "rev_parent_id": 1000,
-        "rev_timestamp": b"20220101010101",
+        "rev_timestamp": datetime(2022, 1, 1, 1, 1, 1),
         "rev_user_text": "Examplé".encode(),
         "submission_id": None,
         "status": database.Status.UNSUBMITTED.value,
         "status_timestamp": None,
         "status_user_text": None,
+        "attempts": 0,
+        "retry_timestamp": None,
     }
-    stmt = text("SELECT * FROM `diffs` WHERE `page_title` = :title")
+    stmt = text("SELECT * FROM `diffs` WHERE `page_title` = :title").columns(
+        rev_timestamp=DateTime()
+    )
     result = db_session.execute(stmt, {"title": b"Add_revision"}).all()
     assert len(result) == 1
     res = result[0]._asdict()
@@ -63,6 +70,207 @@ def test_add_revision(db_session):
     assert res == expected
 
 
+def test_add_missing_columns(engine, setup_database):
+    with engine.begin() as connection:
+        connection.execute(
+            text("ALTER TABLE `diffs` DROP COLUMN `retry_timestamp`")
+        )
+        database._add_missing_columns(connection)
+    columns = {col["name"] for col in inspect(engine).get_columns("diffs")}
+    assert "retry_timestamp" in columns
+
+
+def test_last_diff_id(db_session):
+    before = database.last_diff_id(db_session)
+    database.add_revision(
+        session=db_session,
+        page=pywikibot.Page(pywikibot.Site("en", "wikipedia"), "Last diff"),
+        rev_id=4001,
+        rev_parent_id=4000,
+        rev_timestamp=pywikibot.Timestamp.set_timestamp(
+            "2022-01-01T01:01:01Z"
+        ),
+        rev_user_text="Example",
+    )
+    assert database.last_diff_id(db_session) > before
+
+
+def test_diff_texts(db_session):
+    site = pywikibot.Site("en", "wikipedia")
+    for rev_id in (5001, 5002):
+        database.add_revision(
+            session=db_session,
+            page=pywikibot.Page(site, "Diff texts"),
+            rev_id=rev_id,
+            rev_parent_id=rev_id - 1,
+            rev_timestamp=pywikibot.Timestamp.set_timestamp(
+                "2022-01-01T01:01:01Z"
+            ),
+            rev_user_text="Example",
+        )
+    diffs = sorted(
+        (
+            diff
+            for diff in database.diffs_by_status(
+                db_session,
+                [database.Status.UNSUBMITTED],
+            )
+            if diff.page_title == "Diff_texts"
+        ),
+        key=lambda diff: diff.rev_id,
+    )
+    assert database.diff_texts(db_session, diffs) == {}
+    database.set_diff_text(db_session, diffs[0], "first é")
+    database.set_diff_text(db_session, diffs[1], "second")
+    db_session.flush()
+    stmt = text("SELECT `text` FROM `diff_texts` WHERE `diff_id` = :id")
+    stored = db_session.scalar(stmt, {"id": diffs[0].diff_id})
+    assert stored != "first é".encode()
+    diffs[1].rev_parent_id = 5000  # coalesced
+    assert database.diff_texts(db_session, diffs) == {
+        diffs[0].diff_id: "first é",
+    }
+
+
+def test_source_entry_ids(db_session):
+    sources = [
+        ("Example", "https://example.org/"),
+        ("Example", None),
+        ("Example", "https://example.org/"),
+    ]
+    entry_ids = database.source_entry_ids(db_session, sources)
+    assert len(entry_ids) == 2
+    assert entry_ids[sources[0]] != entry_ids[sources[1]]
+    database._SOURCE_ENTRY_IDS.clear()
+    assert database.source_entry_ids(db_session, sources[:1]) == {
+        sources[0]: entry_ids[sources[0]],
+    }
+    stmt = text("SELECT COUNT(*) FROM `source_entries`")
+    assert db_session.scalar(stmt) == 2
+    entry = db_session.get(database.SourceEntry, entry_ids[sources[1]])
+    assert (entry.description, entry.url) == sources[1]
+    database._SOURCE_ENTRY_IDS.clear()
+
+
+def test_add_revision_twice(db_session):
+    site = pywikibot.Site("en", "wikipedia")
+    page = pywikibot.Page(site, "Add revision twice")
+    for _ in range(2):
+        database.add_revision(
+            session=db_session,
+            page=page,
+            rev_id=2001,
+            rev_parent_id=2000,
+            rev_timestamp=pywikibot.Timestamp.set_timestamp(
+                "2022-01-01T01:01:01Z"
+            ),
+            rev_user_text="Example",
+        )
+    db_session.commit()
+    stmt = text("SELECT * FROM `diffs` WHERE `page_title` = :title")
+    result = db_session.execute(stmt, {"title": b"Add_revision_twice"}).all()
+    assert len(result) == 1
+    assert _event_statuses(db_session, 2001) == [
+        database.Status.UNSUBMITTED.value
+    ]
+
+
+def _event_statuses(session, rev_id):
+    stmt = (
+        select(database.DiffEvent.status)
+        .where(database.DiffEvent.rev_id == rev_id)
+        .order_by(database.DiffEvent.event_id)
+    )
+    return session.scalars(stmt).all()
+
+
+def test_status_events(db_session):
+    diff = database.Diff(
+        project="wikipedia",
+        lang="en",
+        page_namespace=0,
+        page_title="Status_events",
+        rev_id=2101,
+        rev_parent_id=2100,
+        rev_timestamp=pywikibot.Timestamp(2023, 1, 1),
+        rev_user_text="Example",
+        status=database.Status.UNSUBMITTED.value,
+    )
+    db_session.add(diff)
+    db_session.flush()
+    diff.status = database.Status.UPLOADED.value
+    db_session.flush()
+    diff.attempts += 1
+    db_session.flush()
+    diff.status = database.Status.PENDING.value
+    db_session.flush()
+    assert _event_statuses(db_session, 2101) == [
+        database.Status.UNSUBMITTED.value,
+        database.Status.UPLOADED.value,
+        database.Status.PENDING.value,
+    ]
+
+
+def test_status_events_other_session(engine, setup_database):
+    # the listeners are only attached to the package's sessions
+    with Session(engine) as session:
+        session.add(
+            database.Diff(
+                project="wikipedia",
+                lang="en",
+                page_namespace=0,
+                page_title="Other_session",
+                rev_id=2151,
+                rev_parent_id=2150,
+                rev_timestamp=pywikibot.Timestamp(2023, 1, 1),
+                rev_user_text="Example",
+                status=database.Status.UNSUBMITTED.value,
+            )
+        )
+        session.flush()
+        assert _event_statuses(session, 2151) == []
+        session.rollback()
+
+
+def test_diff_events(db_session):
+    old = pywikibot.Timestamp(2023, 1, 1)
+    new = pywikibot.Timestamp(2023, 2, 1)
+    for rev_id, status, timestamp in (
+        (2203, database.Status.UPLOADED, new),
+        (2201, database.Status.UNSUBMITTED, old),
+        (2202, database.Status.UNSUBMITTED, old),
+        (2203, database.Status.UNSUBMITTED, old),
+        (2201, database.Status.UPLOADED, new),
+    ):
+        db_session.add(
+            database.DiffEvent(
+                project="wikipedia",
+                lang="en",
+                rev_id=rev_id,
+                status=status.value,
+                timestamp=timestamp,
+            )
+        )
+    db_session.flush()
+    since = pywikibot.Timestamp(2023, 1, 15)
+    events = [
+        (event.rev_id, event.status)
+        for event in database.diff_events(db_session, since)
+        if event.rev_id in range(2201, 2204)
+    ]
+    assert events == [
+        (2201, database.Status.UNSUBMITTED.value),
+        (2201, database.Status.UPLOADED.value),
+        (2203, database.Status.UPLOADED.value),
+        (2203, database.Status.UNSUBMITTED.value),
+    ]
+    database.remove_diff_events(db_session, since)
+    assert _event_statuses(db_session, 2201) == [
+        database.Status.UPLOADED.value
+    ]
+    assert _event_statuses(db_session, 2202) == []
+
+
 @pytest.mark.parametrize(
     "diffs_data,status",
     [
@@ -74,10 +282,10 @@ def test_add_revision(db_session):
                 "page_title": "Records_by_status",
                 "rev_id": 3000 + status,
                 "rev_parent_id": 3000,
-                "rev_timestamp": "20220101010101",
+                "rev_timestamp": datetime(2022, 1, 1, 1, 1, 1),
                 "rev_user_text": "Example",
                 "status": status,
-                "status_timestamp": "20220101020202",
+                "status_timestamp": datetime(2022, 1, 1, 2, 2, 2),
             },
             status,
         )
@@ -101,10 +309,10 @@ def test_diffs_by_status(db_session, diffs_data, status):
             "page_title": "Remove_revision",
             "rev_id": 4001,
             "rev_parent_id": 4000,
-            "rev_timestamp": "20220101010101",
+            "rev_timestamp": datetime(2022, 1, 1, 1, 1, 1),
             "rev_user_text": "Example",
             "status": database.Status.PENDING.value,
-            "status_timestamp": "20220101020202",
+            "status_timestamp": datetime(2022, 1, 1, 2, 2, 2),
         },
     ],
     indirect=True,
@@ -127,11 +335,11 @@ def test_remove_revision(db_session, diffs_data):
             "page_title": "Remove_submission",
             "rev_id": 5001,
             "rev_parent_id": 5000,
-            "rev_timestamp": "20220101010101",
+            "rev_timestamp": datetime(2022, 1, 1, 1, 1, 1),
             "rev_user_text": "Example",
-            "submission_id": str(UUID),
+            "submission_id": UUID.bytes,
             "status": database.Status.PENDING.value,
-            "status_timestamp": "20220101020202",
+            "status_timestamp": datetime(2022, 1, 1, 2, 2, 2),
         },
     ],
     indirect=True,
@@ -141,3 +349,346 @@ def test_remove_submission(db_session, diffs_data):
     stmt = text("SELECT * FROM `diffs` WHERE `page_title` = :title")
     result = db_session.execute(stmt, {"title": b"Remove_submission"}).all()
     assert len(result) == 0
+
+
+@pytest.mark.parametrize(
+    "diffs_data",
+    [
+        {
+            "project": "wikipedia",
+            "lang": "en",
+            "page_namespace": 0,
+            "page_title": "Remove_revision_status",
+            "rev_id": 4101,
+            "rev_parent_id": 4100,
+            "rev_timestamp": datetime(2022, 1, 1, 1, 1, 1),
+            "rev_user_text": "Example",
+            "status": database.Status.PENDING.value,
+            "status_timestamp": datetime(2022, 1, 1, 2, 2, 2),
+        },
+    ],
+    indirect=True,
+)
+def test_remove_revision_status(db_session, diffs_data):
+    site = pywikibot.Site("en", "wikipedia")
+    database.remove_revision(
+        db_session,
+        site,
+        4101,
+        status=[database.Status.UNSUBMITTED],
+    )
+    stmt = text("SELECT * FROM `diffs` WHERE `page_title` = :title")
+    params = {"title": b"Remove_revision_status"}
+    assert len(db_session.execute(stmt, params).all()) == 1
+    database.remove_revision(
+        db_session,
+        site,
+        4101,
+        status=[database.Status.PENDING],
+    )
+    assert len(db_session.execute(stmt, params).all()) == 0
+
+
+@pytest.mark.parametrize(
+    "diffs_data",
+    [
+        {
+            "project": "wikipedia",
+            "lang": "en",
+            "page_namespace": 2,
+            "page_title": "Remove_page",
+            "rev_id": 4201,
+            "rev_parent_id": 4200,
+            "rev_timestamp": datetime(2022, 1, 1, 1, 1, 1),
+            "rev_user_text": "Example",
+            "status": database.Status.UNSUBMITTED.value,
+            "status_timestamp": datetime(2022, 1, 1, 2, 2, 2),
+        },
+    ],
+    indirect=True,
+)
+def test_remove_page(db_session, diffs_data):
+    page = pywikibot.Page(
+        pywikibot.Site("en", "wikipedia"), "User:Remove page"
+    )
+    database.remove_page(
+        db_session, page, status=[database.Status.UNSUBMITTED]
+    )
+    stmt = text("SELECT * FROM `diffs` WHERE `page_title` = :title")
+    result = db_session.execute(stmt, {"title": b"Remove_page"}).all()
+    assert len(result) == 0
+
+
+def test_restore_merged(db_session):
+    site = pywikibot.Site("en", "wikipedia")
+    merged = database.Status.MERGED.value
+    rows = (
+        # rev_id, rev_parent_id, user, status
+        (4301, 4300, "Example", merged),  # merged in an earlier run
+        (4303, 4302, "Example", merged),
+        (4304, 4303, "Example", merged),
+        (4305, 4304, "Other", merged),  # another user
+        (4306, 4302, "Example", database.Status.UNSUBMITTED.value),
+    )
+    for rev_id, rev_parent_id, user, status in rows:
+        db_session.add(
+            database.Diff(
+                project="wikipedia",
+                lang="en",
+                page_namespace=0,
+                page_title="Restore_merged",
+                rev_id=rev_id,
+                rev_parent_id=rev_parent_id,
+                rev_timestamp=pywikibot.Timestamp(2023, 1, 1),
+                rev_user_text=user,
+                status=status,
+            )
+        )
+    db_session.flush()
+    database.restore_merged(db_session, site, 4306)
+    stmt = select(database.Diff.rev_id, database.Diff.status).where(
+        database.Diff.page_title == "Restore_merged"
+    )
+    assert dict(db_session.execute(stmt).tuples().all()) == {
+        4301: merged,
+        4303: database.Status.UNSUBMITTED.value,
+        4304: database.Status.UNSUBMITTED.value,
+        4305: merged,
+        4306: database.Status.UNSUBMITTED.value,
+    }
+    db_session.flush()
+    assert _event_statuses(db_session, 4303) == [
+        merged,
+        database.Status.UNSUBMITTED.value,
+    ]
+    assert _event_statuses(db_session, 4305) == [merged]
+
+
+def test_archive_diffs(db_session):
+    site = pywikibot.Site("en", "wikipedia")
+    old = pywikibot.Timestamp(2022, 1, 1)
+    statuses = (
+        (7001, 1, old),  # reviewed
+        (7002, 1, pywikibot.Timestamp(2022, 3, 1)),  # reviewed recently
+        (7003, database.Status.READY.value, old),
+        (7004, database.Status.MERGED.value, None),
+    )
+    for rev_id, status, status_timestamp in statuses:
+        database.add_revision(
+            session=db_session,
+            page=pywikibot.Page(site, "Archive"),
+            rev_id=rev_id,
+            rev_parent_id=rev_id - 1,
+            rev_timestamp=old,
+            rev_user_text="Example",
+        )
+        stmt = text(
+            "UPDATE `diffs` SET `status` = :status,"
+            " `status_timestamp` = :ts, `submission_id` = :sid"
+            " WHERE `rev_id` = :rev_id"
+        ).bindparams(
+            bindparam("ts", type_=database._Timestamp()),
+            bindparam("sid", type_=database._Uuid()),
+        )
+        db_session.execute(
+            stmt,
+            {
+                "status": status,
+                "ts": status_timestamp,
+                "sid": uuid.uuid4(),
+                "rev_id": rev_id,
+            },
+        )
+    diffs = {
+        diff.rev_id: diff
+        for diff in db_session.scalars(
+            select(database.Diff).where(database.Diff.page_title == "Archive")
+        ).unique()
+    }
+    (entry_id,) = database.source_entry_ids(
+        db_session,
+        [("Example", None)],
+    ).values()
+    db_session.add(
+        database.Source(
+            submission_id=diffs[7001].submission_id,
+            entry_id=entry_id,
+            percent=90,
+        )
+    )
+    db_session.flush()
+    cutoff = pywikibot.Timestamp(2022, 2, 1)
+    diff_ids = database.archivable_diff_ids(db_session, cutoff, limit=10)
+    assert diff_ids == [diffs[7001].diff_id, diffs[7004].diff_id]
+    assert database.archivable_diff_ids(db_session, cutoff, limit=1) == [
+        diffs[7001].diff_id
+    ]
+    database.archive_diffs(db_session, diff_ids)
+    db_session.expunge_all()
+    remaining = db_session.scalars(
+        select(database.Diff.rev_id).where(
+            database.Diff.page_title == "Archive"
+        )
+    ).all()
+    assert sorted(remaining) == [7002, 7003]
+    archived = db_session.execute(
+        text("SELECT `rev_id` FROM `diffs_archive` ORDER BY `rev_id`")
+    ).all()
+    assert [row.rev_id for row in archived] == [7001, 7004]
+    stmt = text("SELECT COUNT(*) FROM `report_sources_archive`")
+    assert db_session.scalar(stmt) == 1
+    stmt = text("SELECT COUNT(*) FROM `report_sources`")
+    assert db_session.scalar(stmt) == 0
+    database._SOURCE_ENTRY_IDS.clear()
+
+
+def test_checkpoint(db_session):
+    assert database.checkpoint(db_session, "test-job") == 0
+    database.set_checkpoint(db_session, "test-job", 10)
+    assert database.checkpoint(db_session, "test-job") == 10
+    database.set_checkpoint(db_session, "test-job", 20)
+    assert database.checkpoint(db_session, "test-job") == 20
+
+
+def test_status_counts(db_session):
+    before = database.status_counts(db_session)
+    for rev_id, status in (
+        (4401, database.Status.UNSUBMITTED),
+        (4402, database.Status.UNSUBMITTED),
+        (4403, database.Status.READY),
+    ):
+        db_session.add(
+            database.Diff(
+                project="wikipedia",
+                lang="en",
+                page_namespace=0,
+                page_title="Status_counts",
+                rev_id=rev_id,
+                rev_parent_id=rev_id - 1,
+                rev_timestamp=pywikibot.Timestamp(2023, 1, 1),
+                rev_user_text="Example",
+                status=status.value,
+            )
+        )
+    db_session.flush()
+    after = database.status_counts(db_session)
+    assert set(after) == set(database.Status)
+    assert {
+        status: after[status] - before[status] for status in database.Status
+    } == {
+        **dict.fromkeys(database.Status, 0),
+        database.Status.UNSUBMITTED: 2,
+        database.Status.READY: 1,
+    }
+
+
+def test_advisory_lock():
+    with database.advisory_lock("test-lock") as acquired:
+        assert acquired is True
+
+
+LEGACY_SCHEMA = (
+    """CREATE TABLE diffs (
+    diff_id INTEGER PRIMARY KEY,
+    project VARBINARY(20) NOT NULL,
+    lang VARBINARY(20) NOT NULL,
+    page_namespace INTEGER NOT NULL,
+    page_title VARBINARY(255) NOT NULL,
+    rev_id INTEGER NOT NULL,
+    rev_parent_id INTEGER NOT NULL,
+    rev_timestamp BINARY(14) NOT NULL,
+    rev_user_text VARBINARY(255) NOT NULL,
+    submission_id VARBINARY(36) UNIQUE,
+    status TINYINT NOT NULL,
+    status_timestamp BINARY(14),
+    status_user_text VARBINARY(255)
+)""",
+    "CREATE UNIQUE INDEX ix_diffs_rev ON diffs (project, lang, rev_id)",
+    """CREATE TABLE report_sources (
+    source_id INTEGER PRIMARY KEY,
+    submission_id VARBINARY(36) NOT NULL
+        REFERENCES diffs (submission_id) ON DELETE CASCADE,
+    description BLOB NOT NULL,
+    url BLOB,
+    percent FLOAT NOT NULL
+)""",
+)
+
+
+def test_migrate_schema(mocker, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    mocker.patch.object(database, "_engine", return_value=engine)
+    mocker.patch.object(database, "_SOURCE_ENTRY_IDS", {})
+    with engine.begin() as connection:
+        for stmt in LEGACY_SCHEMA:
+            connection.execute(text(stmt))
+        for diff_id, sid in enumerate((str(UUID), "123456789", None), 1):
+            connection.execute(
+                text(
+                    "INSERT INTO diffs VALUES (:diff_id, :project, :lang, 0,"
+                    " :title, :rev_id, :rev_parent_id, :ts, :user, :sid,"
+                    " -1, :ts, NULL)"
+                ),
+                {
+                    "diff_id": diff_id,
+                    "project": b"wikipedia",
+                    "lang": b"en",
+                    "title": b"Migrate",
+                    "rev_id": 6000 + diff_id,
+                    "rev_parent_id": 6000,
+                    "ts": b"20220101010101",
+                    "user": b"Example",
+                    "sid": None if sid is None else sid.encode(),
+                },
+            )
+        for sid in (str(UUID), "123456789"):
+            connection.execute(
+                text(
+                    "INSERT INTO report_sources"
+                    " (submission_id, description, percent)"
+                    " VALUES (:sid, :description, 50)"
+                ),
+                {"sid": sid.encode(), "description": b"Example"},
+            )
+    database.migrate_schema(batch_size=2)
+    tables = inspect(engine).get_table_names()
+    assert not [name for name in tables if name.endswith("_legacy")]
+    with Session(engine) as session:
+        diffs = (
+            session.scalars(
+                select(database.Diff).order_by(database.Diff.diff_id)
+            )
+            .unique()
+            .all()
+        )
+        assert [diff.diff_id for diff in diffs] == [1, 2, 3]
+        assert diffs[0].submission_id == UUID
+        assert isinstance(diffs[1].submission_id, uuid.UUID)
+        assert diffs[2].submission_id is None
+        assert diffs[0].rev_timestamp == pywikibot.Timestamp(
+            2022, 1, 1, 1, 1, 1
+        )
+        assert diffs[0].status_timestamp == diffs[0].rev_timestamp
+        assert diffs[0].attempts == 0
+        assert [len(diff.sources) for diff in diffs] == [1, 1, 0]
+        assert diffs[0].sources[0].entry is diffs[1].sources[0].entry
+        assert diffs[0].sources[0].entry.description == "Example"
+        assert diffs[0].sources[0].entry.url is None
+    # nothing left to migrate
+    database.migrate_schema()
+
+
+def test_create_tables_legacy(mocker, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    mocker.patch.object(database, "_engine", return_value=engine)
+    with engine.begin() as connection:
+        for stmt in LEGACY_SCHEMA:
+            connection.execute(text(stmt))
+    with pytest.raises(RuntimeError, match="migrate them first"):
+        database.create_tables()
+    columns = {
+        col["name"] for col in inspect(engine).get_columns("report_sources")
+    }
+    assert "entry_id" not in columns
+    database.migrate_schema()
+    database.create_tables()
@@ -59,6 +59,38 @@ def test_added_revision_text(mock_filename_regex):
     assert check_diff._added_revision_text(old, new, site=SITE) == expected
 
 
+def test_load_revisions_batches(mocker):
+    request = mocker.patch("pywikibot.site.APISite.simple_request")
+    request.return_value.submit.side_effect = [
+        {
+            "query": {
+                "pages": {
+                    str(i): {"revisions": [{"revid": i, "size": i}]}
+                    for i in revids
+                }
+            }
+        }
+        for revids in (range(50), range(50, 60))
+    ]
+    mocker.patch(
+        "pywikibot.site.APISite._rvprops",
+        return_value=["ids", "size"],
+    )
+    result = check_diff.revision_metadata(SITE, list(range(60)))
+    assert sorted(result) == list(range(60))
+    assert request.call_count == 2
+    assert "rvslots" not in request.call_args.kwargs
+    assert list(request.call_args.kwargs["revids"]) == list(range(50, 60))
+
+
+def test_check_diff_metadata(mocker):
+    page = pywikibot.Page(SITE, "Barack Obama")
+    load = mocker.patch("copypatrol_backend.check_diff._load_revisions")
+    metadata = {2: Revision(revid=2, size=1000, tags=["mw-rollback"])}
+    assert check_diff.check_diff(page, 1, 2, metadata=metadata) is None
+    load.assert_not_called()
+
+
 def test_load_revisions(mock_responses):
     revids = [1125722395, 1126962296]
     if SITE.is_oauth_token_available():  # pragma: no cover
@@ -203,6 +235,7 @@ def test_check_diff(
     new_rev = Revision(
         revid=1089519971,
         comment=new_comment,
+        size=len(new_text.encode()),
         slots={"main": {"*": new_text}},
         tags=new_tags,
         user="B",
@@ -264,6 +297,7 @@ def test_check_diff_new_links(
     new_rev = Revision(
         revid=1126962296,
         comment="some text copied from [[example]]",
+        size=len(resource("Kommet,_ihr_Hirten-1126962296.txt").encode()),
         slots={
             "main": {
                 "*": resource("Kommet,_ihr_Hirten-1126962296.txt"),
@@ -279,3 +313,149 @@ def test_check_diff_new_links(
         },
     )
     assert check_diff.check_diff(page, 0, new_rev.revid) == added_text
+
+
+TABLE_DIFF = """\
+<tr><td colspan="2" class="diff-lineno">Line 1:</td>
+<td colspan="2" class="diff-lineno">Line 1:</td></tr>
+<tr><td class="diff-marker"></td>
+<td class="diff-context diff-side-deleted"><div>''Intro'' text.</div></td>
+<td class="diff-marker"></td>
+<td class="diff-context diff-side-added"><div>''Intro'' text.</div></td>
+</tr>
+<tr><td class="diff-marker" data-marker="−"></td>
+<td class="diff-deletedline diff-side-deleted"><div>Old \
+<del class="diffchange diffchange-inline">line</del>.</div></td>
+<td class="diff-marker" data-marker="+"></td>
+<td class="diff-addedline diff-side-added"><div>Old \
+<ins class="diffchange diffchange-inline">paragraph &amp; more</ins>.\
+</div></td>
+</tr>
+<tr><td colspan="2" class="diff-empty diff-side-deleted"></td>
+<td class="diff-marker" data-marker="+"></td>
+<td class="diff-addedline diff-side-added"><div>New line.</div></td>
+</tr>
+<tr><td colspan="2" class="diff-lineno">Line 40:</td>
+<td colspan="2" class="diff-lineno">Line 41:</td></tr>
+<tr><td class="diff-marker"></td>
+<td class="diff-context"><div>Context</div></td>
+<td class="diff-marker"></td>
+<td class="diff-context"><div>Context</div></td>
+</tr>
+"""
+
+
+def test_table_diff_parser():
+    parser = check_diff._TableDiffParser()
+    parser.feed(TABLE_DIFF)
+    parser.close()
+    assert parser.old == ["''Intro'' text.", "Old line.", "", "Context"]
+    assert parser.new == [
+        "''Intro'' text.",
+        "Old paragraph & more.",
+        "New line.",
+        "",
+        "Context",
+    ]
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        pytest.param(
+            TABLE_DIFF,
+            (
+                "''Intro'' text.\nOld line.\n\nContext",
+                "''Intro'' text.\nOld paragraph & more.\nNew line.\n\nContext",
+            ),
+            id="diff",
+        ),
+        pytest.param(
+            TABLE_DIFF.replace("New line.", "{{Infobox"),
+            None,
+            id="unbalanced",
+        ),
+        pytest.param(None, None, id="no body"),
+    ],
+)
+def test_compare_revisions(mocker, body, expected):
+    request = mocker.patch("pywikibot.site.APISite.simple_request")
+    request.return_value.submit.return_value = {
+        "compare": {} if body is None else {"body": body}
+    }
+    assert check_diff._compare_revisions(SITE, 1, 2) == expected
+
+
+def test_compare_revisions_error(mocker):
+    request = mocker.patch("pywikibot.site.APISite.simple_request")
+    request.return_value.submit.side_effect = pywikibot.exceptions.APIError(
+        "nosuchrevid", "There is no revision with ID 1."
+    )
+    assert check_diff._compare_revisions(SITE, 1, 2) is None
+
+
+@pytest.mark.parametrize(
+    "regions, size, tags, expected, loaded",
+    [
+        pytest.param(
+            ("foo bar " * 10, f"{'foo bar ' * 10}\n{'baz ' * 200}"),
+            1000,
+            [],
+            ("baz " * 200).strip(),
+            [[1]],
+            id="compared",
+        ),
+        pytest.param(
+            ("foo bar " * 10, f"{'foo bar ' * 10}\n{'baz ' * 20}"),
+            1000,
+            [],
+            None,
+            [],
+            id="compared small",
+        ),
+        pytest.param(
+            ("foo bar " * 10, f"{'foo bar ' * 10}\n{'qux ' * 200}"),
+            1000,
+            [],
+            None,
+            [[1]],
+            id="copied within page",
+        ),
+        pytest.param(None, 1000, [], "baz" * 500, [[1, 2]], id="fallback"),
+        pytest.param(None, 100, [], None, [], id="small"),
+        pytest.param(None, 1000, ["mw-reverted"], None, [], id="reverted"),
+    ],
+)
+def test_check_diff_compare(
+    mocker,
+    mock_filename_regex,
+    regions,
+    size,
+    tags,
+    expected,
+    loaded,
+):
+    page = pywikibot.Page(SITE, "Barack Obama")
+    old_rev = Revision(
+        revid=1,
+        slots={"main": {"*": f"{'foo bar' * 100}\n\n{'qux ' * 200}"}},
+        tags=[],
+    )
+    new_rev = Revision(
+        revid=2,
+        slots={"main": {"*": "baz" * 500}},
+        size=size,
+        tags=tags,
+    )
+    load = mocker.patch(
+        "copypatrol_backend.check_diff._load_revisions",
+        return_value={1: old_rev, 2: new_rev},
+    )
+    mocker.patch(
+        "copypatrol_backend.check_diff._compare_revisions",
+        return_value=regions,
+    )
+    assert check_diff.check_diff(page, 1, 2, compare=True) == expected
+    assert [
+        c.args[1] for c in load.call_args_list if c.kwargs.get("content", True)
+    ] == loaded
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 import datetime
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
 from argparse import Namespace
-from uuid import UUID
+from uuid import UUID, uuid4
 
 import pytest
 import pywikibot
 
-from copypatrol_backend import cli
+from copypatrol_backend import cli, database
 
 
 SITE = pywikibot.Site("meta")
@@ -39,12 +45,541 @@ def test_parse_ignore_list_none(mocker):
     assert cli._parse_ignore_list(SITE) == []
 
 
+@pytest.mark.parametrize(
+    "start, deadline, expected, saved",
+    [
+        pytest.param(0, None, [[1, 2, 3, 4, 5]], 0, id="no deadline"),
+        pytest.param(3, None, [[4, 5, 1, 2, 3]], 0, id="resume"),
+        pytest.param(
+            0,
+            float("inf"),
+            [[1, 2, 3, 4], [5]],
+            0,
+            id="deadline not reached",
+        ),
+        pytest.param(0, 0, [[1, 2, 3, 4]], 4, id="deadline passed"),
+        pytest.param(3, 0, [[4, 5, 1, 2]], 2, id="resume deadline passed"),
+    ],
+)
+def test_batches(mocker, start, deadline, expected, saved):
+    mocker.patch(
+        "copypatrol_backend.cli.tca_config",
+        return_value=mocker.Mock(max_workers=1),
+    )
+    mocker.patch(
+        "copypatrol_backend.database.checkpoint",
+        return_value=start,
+    )
+    set_checkpoint = mocker.patch("copypatrol_backend.database.set_checkpoint")
+    diffs = [mocker.Mock(diff_id=i) for i in (5, 1, 4, 2, 3)]
+    result = [
+        [diff.diff_id for diff in batch]
+        for batch in cli._batches(
+            mocker.sentinel.session,
+            "job",
+            diffs,
+            deadline=deadline,
+        )
+    ]
+    assert result == expected
+    set_checkpoint.assert_called_once_with(
+        mocker.sentinel.session,
+        "job",
+        saved,
+    )
+
+
+def test_reports_daemon(mocker):
+    reports = mocker.patch(
+        "copypatrol_backend.cli._reports",
+        side_effect=[None, ValueError, KeyboardInterrupt],
+    )
+    sleep = mocker.patch("time.sleep")
+    api = mocker.Mock()
+    with pytest.raises(KeyboardInterrupt):
+        cli._reports_daemon(SITE, api, interval=300, time_budget=240)
+    assert reports.call_count == 3
+    reports.assert_called_with(SITE, api, time_budget=240)
+    assert api.accept_eula.call_count == 3
+    assert sleep.call_count == 2
+    assert 0 < sleep.call_args.args[0] <= 300
+
+
+def test_check_changes_daemon(mocker):
+    check_changes = mocker.patch(
+        "copypatrol_backend.cli._check_changes",
+        side_effect=[0, 0, 0, ValueError, 2, KeyboardInterrupt],
+    )
+    mocker.patch("copypatrol_backend.database.Session")
+    mocker.patch("copypatrol_backend.database.last_diff_id", return_value=1)
+    mocker.patch(
+        "copypatrol_backend.cli._seconds_until_due", return_value=None
+    )
+    wait = mocker.patch("copypatrol_backend.cli._wait_for_changes")
+    with pytest.raises(KeyboardInterrupt):
+        cli._check_changes_daemon(mocker.Mock(), interval=10, max_interval=30)
+    assert check_changes.call_count == 6
+    assert [c.args[1] for c in wait.call_args_list] == [10, 20, 30, 30, 10]
+
+
+def test_check_changes_daemon_waiting(mocker):
+    mocker.patch(
+        "copypatrol_backend.cli._check_changes",
+        side_effect=[0, 0, 0, KeyboardInterrupt],
+    )
+    mocker.patch("copypatrol_backend.database.Session")
+    mocker.patch("copypatrol_backend.database.last_diff_id", return_value=1)
+    mocker.patch(
+        "copypatrol_backend.cli._seconds_until_due",
+        side_effect=[45, 15, -5],
+    )
+    wait = mocker.patch("copypatrol_backend.cli._wait_for_changes")
+    with pytest.raises(KeyboardInterrupt):
+        cli._check_changes_daemon(mocker.Mock(), interval=10, max_interval=60)
+    # never past a change waiting to be due, nor less than the interval
+    assert [c.args[1] for c in wait.call_args_list] == [10, 15, 10]
+
+
+def test_seconds_until_due(mocker):
+    now = pywikibot.Timestamp(2023, 1, 1, 1)
+    mocker.patch("pywikibot.Timestamp.utcnow", return_value=now)
+    mocker.patch("copypatrol_backend.cli.min_age", return_value=900)
+    mocker.patch("copypatrol_backend.database.Session")
+    retrying = _diff(11, 10, 0)
+    retrying.retry_timestamp = now + datetime.timedelta(seconds=600)
+    young = _diff(21, 20, 0, title="Other")
+    young.rev_timestamp = now - datetime.timedelta(seconds=600)
+    diffs = mocker.patch("copypatrol_backend.database.diffs_by_status")
+    diffs.return_value = [retrying, young]
+    assert cli._seconds_until_due() == 300
+    diffs.return_value = []
+    assert cli._seconds_until_due() is None
+
+
+def test_wait_for_changes(mocker):
+    mocker.patch("copypatrol_backend.database.Session")
+    mocker.patch(
+        "copypatrol_backend.database.last_diff_id",
+        side_effect=[1, 1, 2],
+    )
+    sleep = mocker.patch("time.sleep")
+    cli._wait_for_changes(1, 300, 10)
+    assert sleep.call_count == 3
+    assert sleep.call_args.args[0] == 10
+
+
+def test_archive(mocker):
+    mocker.patch("copypatrol_backend.cli.archive_after", return_value=30)
+    mocker.patch("copypatrol_backend.database.Session")
+    archivable = mocker.patch(
+        "copypatrol_backend.database.archivable_diff_ids",
+        side_effect=[[1, 2], [3], []],
+    )
+    archive_diffs = mocker.patch("copypatrol_backend.database.archive_diffs")
+    remove_events = mocker.patch(
+        "copypatrol_backend.database.remove_diff_events"
+    )
+    cli._archive(batch_size=2)
+    assert remove_events.call_args.args[1] == archivable.call_args.args[1]
+    assert archivable.call_count == 3
+    assert archivable.call_args.kwargs == {"limit": 2}
+    cutoff = archivable.call_args.args[1]
+    expected = pywikibot.Timestamp.utcnow() - datetime.timedelta(days=30)
+    assert abs((expected - cutoff).total_seconds()) < 60
+    assert [c.args[1] for c in archive_diffs.call_args_list] == [[1, 2], [3]]
+
+
+def test_archive_disabled(mocker):
+    mocker.patch("copypatrol_backend.cli.archive_after", return_value=0)
+    archivable = mocker.patch(
+        "copypatrol_backend.database.archivable_diff_ids"
+    )
+    cli._archive(batch_size=2)
+    archivable.assert_not_called()
+
+
+def _event(rev_id, status, minutes, *, lang="en"):
+    return database.DiffEvent(
+        project="wikipedia",
+        lang=lang,
+        rev_id=rev_id,
+        status=status.value,
+        timestamp=pywikibot.Timestamp(2023, 1, 1)
+        + datetime.timedelta(minutes=minutes),
+    )
+
+
+def test_stage_durations():
+    status = database.Status
+    events = [
+        _event(1, status.UNSUBMITTED, 0),
+        _event(1, status.UNSUBMITTED, 1),  # repeated
+        _event(1, status.UPLOADED, 10),
+        _event(1, status.PENDING, 12),
+        _event(1, status.READY, 20),
+        _event(2, status.UNSUBMITTED, 0, lang="es"),
+        _event(2, status.UPLOADED, 5, lang="es"),
+        _event(3, status.UNSUBMITTED, 0),
+        _event(3, status.UPLOADED, 30),
+    ]
+    since = pywikibot.Timestamp(2023, 1, 1) + datetime.timedelta(minutes=6)
+    assert cli._stage_durations(events, since=since) == {
+        ("en.wikipedia", "UNSUBMITTED->UPLOADED"): [600.0, 1800.0],
+        ("en.wikipedia", "UPLOADED->PENDING"): [120.0],
+        ("en.wikipedia", "PENDING->READY"): [480.0],
+        ("en.wikipedia", "stored->READY"): [1200.0],
+    }
+
+
+@pytest.mark.parametrize(
+    "percent, expected",
+    [(0, 1), (50, 5), (95, 10), (99, 10), (100, 10)],
+)
+def test_percentile(percent, expected):
+    assert cli._percentile(list(range(1, 11)), percent) == expected
+
+
+def test_stats(mocker):
+    mocker.patch("copypatrol_backend.database.Session")
+    status = database.Status
+    events = mocker.patch(
+        "copypatrol_backend.database.diff_events",
+        return_value=[
+            _event(1, status.UNSUBMITTED, 0),
+            _event(1, status.UPLOADED, 10),
+            _event(2, status.UNSUBMITTED, 0, lang="es"),
+            _event(2, status.UPLOADED, 20, lang="es"),
+        ],
+    )
+    mocker.patch(
+        "pywikibot.Timestamp.utcnow",
+        return_value=pywikibot.Timestamp(2023, 1, 2),
+    )
+    stdout = mocker.patch("pywikibot.stdout")
+    cli._stats(days=1)
+    assert events.call_args.args[1] == pywikibot.Timestamp(2023, 1, 1)
+    lines = [c.args[0].split() for c in stdout.call_args_list]
+    assert lines == [
+        ["wiki", "stage", "count", "p50", "p95", "p99"],
+        ["all", "UNSUBMITTED->UPLOADED", "2", "600.0", "1200.0", "1200.0"],
+        [
+            "en.wikipedia",
+            "UNSUBMITTED->UPLOADED",
+            "1",
+            "600.0",
+            "600.0",
+            "600.0",
+        ],
+        [
+            "es.wikipedia",
+            "UNSUBMITTED->UPLOADED",
+            "1",
+            "1200.0",
+            "1200.0",
+            "1200.0",
+        ],
+    ]
+
+
+def test_revision_metadata(mocker):
+    metadata = mocker.patch(
+        "copypatrol_backend.check_diff.revision_metadata",
+        return_value={},
+    )
+    diffs = [
+        mocker.Mock(lang="en", project="wikipedia", rev_id=1),
+        mocker.Mock(lang="es", project="wikipedia", rev_id=2),
+        mocker.Mock(lang="en", project="wikipedia", rev_id=3),
+    ]
+    en = pywikibot.Site("en", "wikipedia")
+    es = pywikibot.Site("es", "wikipedia")
+    assert cli._revision_metadata(diffs) == {en: {}, es: {}}
+    metadata.assert_any_call(en, [1, 3])
+    metadata.assert_any_call(es, [2])
+
+
+def _diff(rev_id, rev_parent_id, seconds, *, user="A", title="Example"):
+    return database.Diff(
+        project="wikipedia",
+        lang="en",
+        page_namespace=0,
+        page_title=title,
+        rev_id=rev_id,
+        rev_parent_id=rev_parent_id,
+        rev_timestamp=pywikibot.Timestamp(2023, 1, 1)
+        + datetime.timedelta(seconds=seconds),
+        rev_user_text=user,
+        status=database.Status.UNSUBMITTED.value,
+    )
+
+
+def test_coalesce_diffs():
+    diffs = [
+        _diff(11, 10, 0),
+        _diff(12, 11, 60),
+        _diff(13, 12, 120),
+        _diff(14, 13, 900),  # outside the window
+        _diff(15, 14, 960, user="B"),  # another user
+        _diff(16, 15, 1000),  # parent is not the previous edit
+        _diff(21, 20, 30, title="Other"),
+    ]
+    result = cli._coalesce_diffs(diffs, 300)
+    assert [(d.rev_parent_id, d.rev_id) for d in result] == [
+        (20, 21),
+        (10, 13),
+        (13, 14),
+        (14, 15),
+        (15, 16),
+    ]
+    assert [d.rev_id for d in diffs if d.status == -5] == [11, 12]
+
+
+def test_coalesce_diffs_disabled():
+    diffs = [_diff(11, 10, 0), _diff(12, 11, 60)]
+    assert cli._coalesce_diffs(diffs, 0) == diffs
+    assert diffs[1].rev_parent_id == 11
+
+
+def test_old_enough():
+    now = pywikibot.Timestamp.utcnow()
+    diffs = [_diff(i + 1, i, 0) for i in range(3)]
+    for diff, seconds in zip(diffs, (0, 100, 1000)):
+        diff.rev_timestamp = now - datetime.timedelta(seconds=seconds)
+    assert cli._old_enough(diffs, 0) == diffs
+    assert cli._old_enough(diffs, 300) == diffs[2:]
+
+
+def test_due():
+    now = pywikibot.Timestamp.utcnow()
+    diffs = [_diff(i + 1, i, 0) for i in range(3)]
+    diffs[1].retry_timestamp = now - datetime.timedelta(seconds=60)
+    diffs[2].retry_timestamp = now + datetime.timedelta(seconds=60)
+    assert cli._due(diffs) == diffs[:2]
+
+
+def test_record_failure(mocker):
+    mocker.patch("copypatrol_backend.cli.max_attempts", return_value=3)
+    mocker.patch("copypatrol_backend.cli.retry_delay", return_value=60)
+    diff = _diff(1, 0, 0)
+    assert diff.attempts == 0
+    delays = []
+    for _ in range(2):
+        before = pywikibot.Timestamp.utcnow()
+        cli._record_failure(diff)
+        delays.append((diff.retry_timestamp - before).total_seconds())
+        assert diff.status == database.Status.UNSUBMITTED
+    assert [round(delay) for delay in delays] == [60, 120]
+    cli._record_failure(diff)
+    assert diff.attempts == 3
+    assert diff.status == database.Status.FAILED
+    assert diff.retry_timestamp is None
+
+
+def test_store_changes(mocker):
+    event = {
+        "meta": {
+            "domain": "en.wikipedia.org",
+            "uri": "https://en.wikipedia.org/wiki/Example",
+        },
+        "page_title": "Example",
+        "page_namespace": 0,
+        "performer": {"user_text": "Example"},
+        "rev_id": 2,
+        "rev_parent_id": 1,
+        "rev_timestamp": "2023-01-02T03:04:05Z",
+    }
+    mocker.patch(
+        "copypatrol_backend.stream_listener.revision_stream",
+        return_value=[event, dict(event, rev_id=3), event],
+    )
+    # looking up a site by URL would load its siteinfo
+    site = mocker.patch("pywikibot.Site", return_value=SITE)
+    mocker.patch("copypatrol_backend.database.Session")
+    add_revision = mocker.patch("copypatrol_backend.database.add_revision")
+    cli._store_changes(SITE)
+    site.assert_called_with(url="https://en.wikipedia.org/wiki/Example")
+    assert [c.kwargs["rev_id"] for c in add_revision.call_args_list] == [2, 3]
+    assert add_revision.call_args.kwargs[
+        "rev_timestamp"
+    ] == pywikibot.Timestamp(2023, 1, 2, 3, 4, 5)
+
+
+def test_store_changes_stream_url(mocker):
+    revision_stream = mocker.patch(
+        "copypatrol_backend.stream_listener.revision_stream",
+        return_value=[],
+    )
+    url = "http://127.0.0.1:8090/v2/stream/revision-create"
+    cli._store_changes(SITE, stream_url=url)
+    assert revision_stream.call_args.kwargs["url"] == url
+
+
+def test_record_changes(mocker, tmp_path):
+    events = [{"rev_id": 2}, {"rev_id": 3, "page_title": "Exämple"}]
+    mocker.patch(
+        "copypatrol_backend.stream_listener.raw_revision_stream",
+        side_effect=[events[:1], events[1:]],
+    )
+    path = str(tmp_path / "events.jsonl.gz")
+    # runs append to the recording
+    cli._record_changes(SITE, path)
+    cli._record_changes(SITE, path)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == events
+
+
+def test_prune_changes_reverted(mocker):
+    event = {
+        "meta": {
+            "stream": "mediawiki.revision-tags-change",
+            "uri": "https://en.wikipedia.org/wiki/Example",
+        },
+        "rev_id": 3,
+    }
+    mocker.patch(
+        "copypatrol_backend.stream_listener.revert_stream",
+        return_value=[event],
+    )
+    # looking up a site by URL would load its siteinfo
+    site = mocker.patch("pywikibot.Site", return_value=SITE)
+    mocker.patch("copypatrol_backend.database.Session")
+    database_mock = mocker.Mock()
+    mocker.patch(
+        "copypatrol_backend.database.restore_merged",
+        database_mock.restore_merged,
+    )
+    mocker.patch(
+        "copypatrol_backend.database.remove_revision",
+        database_mock.remove_revision,
+    )
+    cli._prune_changes(SITE)
+    # merged edits are restored before the revision they were merged into
+    # is removed
+    assert [c[0] for c in database_mock.mock_calls] == [
+        "restore_merged",
+        "remove_revision",
+    ]
+    assert database_mock.restore_merged.call_args.args[2] == 3
+    site.assert_called_once_with(url="https://en.wikipedia.org/wiki/Example")
+
+
+def test_map_concurrently():
+    sids = [uuid4() for _ in range(10)]
+
+    def func(sid):
+        if sid == sids[0]:
+            raise ValueError
+        return str(sid)
+
+    result = cli._map_concurrently(func, sids)
+    assert result == {sid: str(sid) for sid in sids[1:]}
+
+
+def test_ignore_list_cached(mocker):
+    revid = mocker.patch(
+        "pywikibot.Page.latest_revision_id",
+        new_callable=mocker.PropertyMock,
+        return_value=1,
+    )
+    parse = mocker.patch(
+        "copypatrol_backend.cli._parse_ignore_list",
+        return_value=[re.compile(r"\bexample\.org\b", flags=re.I)],
+    )
+    mocker.patch.dict("copypatrol_backend.cli._IGNORE_LISTS", clear=True)
+    first = cli._ignore_list(SITE)
+    assert cli._ignore_list(SITE) is first
+    assert parse.call_count == 1
+    revid.return_value = 2
+    assert cli._ignore_list(SITE) is not first
+    assert parse.call_count == 2
+
+
+def test_ignore_list_none(mocker):
+    mocker.patch(
+        "copypatrol_backend.cli.ignore_list_title",
+        return_value="",
+    )
+    assert cli._ignore_list(SITE).matches("https://example.org") is False
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://en.wikipedia.org/wiki/Example", True),
+        ("https://www.example.com/page", True),
+        ("https://example.com", True),
+        ("https://example.org/?ref=example.com", True),
+        ("https://notexample.com/", False),
+        ("http://192.168.1.1/foo", True),
+        ("https://example.net/aab", True),
+        ("https://example.net/abb", False),
+        ("http://[invalid", False),
+    ],
+)
+def test_ignore_list_matches(url, expected):
+    patterns = [
+        re.compile(pattern, flags=re.I)
+        for pattern in (
+            r"\b.*\.wikipedia\.org\b",
+            r"\bexample\.com\b",
+            r"\b192\.168\.1\.1\b",
+            r"(a)\1b",
+        )
+    ]
+    ignore_list = cli._IgnoreList.from_patterns(1, patterns)
+    assert ignore_list.domains == {"example.com"}
+    assert len(ignore_list.patterns) == 2
+    assert ignore_list.matches(url) is expected
+
+
+def test_pagetriage_queue(mocker):
+    available = mocker.patch(
+        "copypatrol_backend.cli._pagetriage_available",
+        return_value=True,
+    )
+    submit = mocker.patch("copypatrol_backend.cli._submit_pagetriage")
+    preload = mocker.patch("pywikibot.site.APISite.preloadpages")
+    mocker.patch(
+        "pywikibot.Page.pageid",
+        new_callable=mocker.PropertyMock,
+        side_effect=[10, 0],
+    )
+    queue = cli._PageTriageQueue()
+    queue.add(pywikibot.Page(SITE, "Exists"), 1)
+    queue.add(pywikibot.Page(SITE, "Deleted"), 2)
+    submit.assert_not_called()
+    assert queue.available(SITE) is True
+    queue.submit()
+    available.assert_called_once_with(SITE)
+    preload.assert_called_once()
+    submit.assert_called_once_with(SITE, 10, 1)
+    queue.submit()
+    submit.assert_called_once()
+
+
+def test_pagetriage_queue_unavailable(mocker):
+    mocker.patch(
+        "copypatrol_backend.cli._pagetriage_available",
+        return_value=False,
+    )
+    submit = mocker.patch("copypatrol_backend.cli._submit_pagetriage")
+    queue = cli._PageTriageQueue()
+    queue.add(pywikibot.Page(SITE, "Example"), 1)
+    queue.submit()
+    submit.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "args, expected",
     [
         pytest.param(
             ("store-changes",),
-            Namespace(action="store-changes", since=None, total=None),
+            Namespace(
+                action="store-changes",
+                since=None,
+                total=None,
+                stream_url=None,
+            ),
             id="store-changes",
         ),
         pytest.param(
@@ -53,6 +588,7 @@ def test_parse_ignore_list_none(mocker):
                 action="store-changes",
                 since=datetime.datetime(2022, 1, 1, 0, 0, 0),
                 total=None,
+                stream_url=None,
             ),
             id="store-changes since",
         ),
@@ -62,34 +598,139 @@ def test_parse_ignore_list_none(mocker):
                 action="store-changes",
                 since=None,
                 total=10,
+                stream_url=None,
             ),
             id="store-changes total",
         ),
+        pytest.param(
+            ("store-changes", "--stream-url", "http://127.0.0.1:8090"),
+            Namespace(
+                action="store-changes",
+                since=None,
+                total=None,
+                stream_url="http://127.0.0.1:8090",
+            ),
+            id="store-changes stream-url",
+        ),
+        pytest.param(
+            ("record-changes", "events.jsonl.gz", "-n", "10"),
+            Namespace(
+                action="record-changes",
+                output="events.jsonl.gz",
+                since=None,
+                total=10,
+            ),
+            id="record-changes",
+        ),
+        pytest.param(
+            ("prune-changes",),
+            Namespace(action="prune-changes", since=None, total=None),
+            id="prune-changes",
+        ),
+        pytest.param(
+            ("prune-changes", "--since", "2022-01-01T00:00:00", "-n", "10"),
+            Namespace(
+                action="prune-changes",
+                since=datetime.datetime(2022, 1, 1, 0, 0, 0),
+                total=10,
+            ),
+            id="prune-changes since total",
+        ),
         pytest.param(
             ("check-changes",),
-            Namespace(action="check-changes"),
+            Namespace(
+                action="check-changes",
+                daemon=False,
+                interval=30,
+                max_interval=600,
+            ),
             id="check-changes",
         ),
+        pytest.param(
+            (
+                "check-changes",
+                "--daemon",
+                "--interval",
+                "10",
+                "--max-interval",
+                "60",
+            ),
+            Namespace(
+                action="check-changes",
+                daemon=True,
+                interval=10.0,
+                max_interval=60.0,
+            ),
+            id="check-changes daemon",
+        ),
         pytest.param(
             ("reports",),
-            Namespace(action="reports"),
+            Namespace(
+                action="reports",
+                time_budget=None,
+                daemon=False,
+                interval=300,
+            ),
             id="reports",
         ),
+        pytest.param(
+            ("reports", "--time-budget", "240"),
+            Namespace(
+                action="reports",
+                time_budget=240.0,
+                daemon=False,
+                interval=300,
+            ),
+            id="reports time-budget",
+        ),
+        pytest.param(
+            ("reports", "--daemon", "--interval", "60"),
+            Namespace(
+                action="reports",
+                time_budget=None,
+                daemon=True,
+                interval=60.0,
+            ),
+            id="reports daemon",
+        ),
+        pytest.param(
+            ("archive",),
+            Namespace(action="archive", batch_size=1000),
+            id="archive",
+        ),
+        pytest.param(
+            ("archive", "--batch-size", "10"),
+            Namespace(action="archive", batch_size=10),
+            id="archive batch-size",
+        ),
         pytest.param(
             ("db", "--create-tables"),
             Namespace(
                 action="db",
                 create_tables=True,
+                migrate_schema=False,
                 remove_revision=None,
                 remove_submission=None,
             ),
             id="db create tables",
         ),
+        pytest.param(
+            ("db", "--migrate-schema"),
+            Namespace(
+                action="db",
+                create_tables=False,
+                migrate_schema=True,
+                remove_revision=None,
+                remove_submission=None,
+            ),
+            id="db migrate-schema",
+        ),
         pytest.param(
             ("db", "--remove-revision", "123"),
             Namespace(
                 action="db",
                 create_tables=False,
+                migrate_schema=False,
                 remove_revision=123,
                 remove_submission=None,
             ),
@@ -104,17 +745,63 @@ def test_parse_ignore_list_none(mocker):
             Namespace(
                 action="db",
                 create_tables=False,
+                migrate_schema=False,
                 remove_revision=None,
                 remove_submission=UUID("7b3074cf-4d3b-4648-8c68-f56aee0f1058"),
             ),
             id="db remove-submission",
         ),
+        pytest.param(
+            ("stats",),
+            Namespace(action="stats", days=7),
+            id="stats",
+        ),
+        pytest.param(
+            ("stats", "--days", "1.5"),
+            Namespace(action="stats", days=1.5),
+            id="stats days",
+        ),
     ],
 )
 def test_parse_script_args(args, expected):
+    expected = Namespace(
+        metrics_file=None,
+        metrics_interval=60,
+        metrics_port=None,
+        profile=None,
+        profile_diffs=None,
+        **vars(expected),
+    )
     assert cli._parse_script_args(*args) == expected
 
 
+def test_parse_script_args_metrics():
+    parsed_args = cli._parse_script_args(
+        "--metrics-file",
+        "metrics.txt",
+        "--metrics-interval",
+        "15",
+        "--metrics-port",
+        "9100",
+        "archive",
+    )
+    assert parsed_args.metrics_file == "metrics.txt"
+    assert parsed_args.metrics_interval == 15.0
+    assert parsed_args.metrics_port == 9100
+
+
+def test_parse_script_args_profile():
+    parsed_args = cli._parse_script_args(
+        "--profile",
+        "profile.txt",
+        "--profile-diffs",
+        "0.1",
+        "check-changes",
+    )
+    assert parsed_args.profile == "profile.txt"
+    assert parsed_args.profile_diffs == 0.1
+
+
 @pytest.mark.parametrize(
     "args",
     [
@@ -122,14 +809,82 @@ def test_parse_script_args(args, expected):
         ("store-changes", "--foo", "bar"),
         ("store-changes", "--since", "2022-01-01T00:00:00", "-n", "ten"),
         ("store-changes", "--since", "2022-01-01T00:00:00", "--foo"),
+        ("record-changes",),
+        ("prune-changes", "--foo"),
         ("check-changes", "foo"),
+        ("check-changes", "--daemon", "--max-interval", "foo"),
         ("reports", "foo"),
+        ("reports", "--time-budget", "foo"),
+        ("reports", "--daemon", "--interval", "foo"),
+        ("archive", "--batch-size", "foo"),
         ("db", "--create-tables", "foo"),
+        ("db", "--create-tables", "--migrate-schema"),
         ("db", "--remove-revision"),
         ("db", "--remove-revision", "foo"),
         ("db", "--remove-submission"),
+        ("--metrics-port", "foo", "archive"),
+        ("--profile-diffs", "foo", "check-changes"),
+        ("stats", "--days", "foo"),
     ],
 )
 def test_parse_script_args_exits(args):
     with pytest.raises(SystemExit):
         cli._parse_script_args(*args)
+
+
+def test_import_without_config(tmp_path):
+    # the config is read and the engine created on first use
+    env = {
+        **os.environ,
+        "HOME": str(tmp_path),
+        "PYWIKIBOT_NO_USER_CONFIG": "1",
+    }
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, copypatrol_backend.cli; "
+            "print(sorted(set(sys.modules) & {"
+            "'copypatrol_backend.database', 'copypatrol_backend.tca', "
+            "'sqlalchemy', 'tracemalloc'}))",
+        ],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    # the subcommands import the modules they use
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+@pytest.mark.parametrize(
+    "action, login",
+    [("stats", False), ("archive", False), ("record-changes", True)],
+)
+def test_run_login(mocker, action, login):
+    site = mocker.patch("pywikibot.Site")
+    mocker.patch("copypatrol_backend.cli._stats")
+    mocker.patch("copypatrol_backend.cli._archive")
+    mocker.patch("copypatrol_backend.cli._record_changes")
+    parsed_args = Namespace(
+        action=action,
+        batch_size=100,
+        days=7,
+        output="events.jsonl.gz",
+        since=None,
+        total=None,
+    )
+    assert cli._run(parsed_args) == 0
+    assert site.return_value.login.called is login
+
+
+def test_reload_config(mocker):
+    mocker.patch(
+        "copypatrol_backend.cli.reload_snapshot",
+        side_effect=ValueError("invalid literal for int()"),
+    )
+    exception = mocker.patch("pywikibot.exception")
+    cli._reload_config()
+    assert exception.called
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import os
+import signal
+
 import pytest
 
 from copypatrol_backend import config
@@ -12,6 +15,8 @@ TEST_CONFIG = "testing/unit/config.ini"
 def mock_configs(mocker):
     mocker.patch("copypatrol_backend.config.DB_CONFIGS", [TEST_CONFIG]),
     mocker.patch("copypatrol_backend.config.PKG_CONFIGS", [TEST_CONFIG]),
+    mocker.patch("copypatrol_backend.config._SNAPSHOT", config._load())
+    mocker.patch("copypatrol_backend.config._RELOAD_REQUESTED", False)
     yield
 
 
@@ -24,24 +29,50 @@ def test_database_config():
         host="localhost",
         port=3306,
     )
-    assert config.database_config.__wrapped__() == expected
+    assert config.database_config() == expected
 
 
 def test_domains():
     expected = ["en.wikipedia.org", "es.wikipedia.org"]
-    assert config.domains.__wrapped__() == expected
+    assert config.domains() == expected
+
+
+def test_archive_after():
+    assert config.archive_after() == 0
+
+
+def test_coalesce_window():
+    assert config.coalesce_window() == 600
 
 
 def test_ignore_list_title():
-    assert config.ignore_list_title.__wrapped__() == "example"
+    assert config.ignore_list_title() == "example"
+
+
+def test_max_attempts():
+    assert config.max_attempts() == 5
+
+
+def test_min_age():
+    assert config.min_age() == 900
+
+
+def test_min_size_delta():
+    assert config.min_size_delta() == 0
+
+
+def test_retry_delay():
+    assert config.retry_delay() == 120
 
 
 def test_tca_config():
     expected = config.TCAConfig(
         domain="test-tca-domain.com",
         key="test-tca-key",
+        max_workers=8,
+        scheme="http",
     )
-    assert config.tca_config.__wrapped__() == expected
+    assert config.tca_config() == expected
 
 
 @pytest.mark.parametrize(
@@ -52,8 +83,9 @@ def test_tca_config():
             config.SiteConfig(
                 domain="en.wikipedia.org",
                 enabled=True,
-                namespaces=[0, 2, 118],
-                pagetriage_namespaces=[0, 118],
+                namespaces=(0, 2, 118),
+                pagetriage_namespaces=(0, 118),
+                compare_diffs=True,
             ),
         ),
         (
@@ -61,8 +93,8 @@ def test_tca_config():
             config.SiteConfig(
                 domain="es.wikipedia.org",
                 enabled=True,
-                namespaces=[0, 2],
-                pagetriage_namespaces=[],
+                namespaces=(0, 2),
+                pagetriage_namespaces=(),
             ),
         ),
         (
@@ -70,11 +102,62 @@ def test_tca_config():
             config.SiteConfig(
                 domain="fr.wikipedia.org",
                 enabled=False,
-                namespaces=[],
-                pagetriage_namespaces=[],
+                namespaces=(),
+                pagetriage_namespaces=(),
             ),
         ),
     ],
 )
 def test_site_config(domain, expected):
-    assert config.site_config.__wrapped__(domain) == expected
+    assert config.site_config(domain) == expected
+
+
+def test_site_config_unknown():
+    with pytest.raises(KeyError):
+        config.site_config("de.wikipedia.org")
+
+
+def _write_config(path, min_age, mtime):
+    path.write_text(f"[copypatrol]\nmin-age = {min_age}\n")
+    # the modification time may not change within the same tick
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_reload_snapshot(mocker, tmp_path):
+    path = tmp_path / "config.ini"
+    _write_config(path, 60, 1)
+    mocker.patch("copypatrol_backend.config.DB_CONFIGS", [str(path)])
+    mocker.patch("copypatrol_backend.config.PKG_CONFIGS", [str(path)])
+    mocker.patch("copypatrol_backend.config._SNAPSHOT", None)
+    assert config.min_age() == 60
+    assert config.reload_snapshot() is False
+    _write_config(path, 120, 2)
+    assert config.reload_snapshot() is True
+    assert config.min_age() == 120
+    assert config.reload_snapshot() is False
+
+
+def test_reload_snapshot_invalid(mocker, tmp_path):
+    path = tmp_path / "config.ini"
+    _write_config(path, 60, 1)
+    mocker.patch("copypatrol_backend.config.DB_CONFIGS", [str(path)])
+    mocker.patch("copypatrol_backend.config.PKG_CONFIGS", [str(path)])
+    mocker.patch("copypatrol_backend.config._SNAPSHOT", None)
+    snapshot = config.snapshot()
+    _write_config(path, "soon", 2)
+    with pytest.raises(ValueError):
+        config.reload_snapshot()
+    assert config.snapshot() is snapshot
+
+
+def test_reload_on_sighup(mocker):
+    handler = mocker.patch("signal.signal")
+    snapshot = config.snapshot()
+    assert config.reload_snapshot() is False
+    config.reload_on_sighup()
+    assert handler.call_args.args[0] == signal.SIGHUP
+    handler.call_args.args[1](signal.SIGHUP, None)
+    assert config.reload_snapshot() is True
+    assert config.snapshot() is not snapshot
+    assert config.snapshot() == snapshot
+    assert config.reload_snapshot() is False
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import uuid
+from datetime import datetime
 
 import pytest
 from pywikibot.time import Timestamp
@@ -36,24 +37,49 @@ def test_binarybase_process(value1, value2):
     "value1,value2",
     [
         (None, None),
-        (Timestamp(2023, 1, 2, 3, 4, 5), b"20230102030405"),
+        (Timestamp(2023, 1, 2, 3, 4, 5), datetime(2023, 1, 2, 3, 4, 5)),
     ],
 )
 def test_timestamp_process(value1, value2):
-    ts = database._Timestamp(14)
-    assert ts.process_bind_param(value1, DIALECT) == value2
-    assert ts.process_result_value(value2, DIALECT) == value1
+    ts = database._Timestamp()
+    bound = ts.process_bind_param(value1, DIALECT)
+    assert bound == value2
+    assert type(bound) is type(value2)
+    result = ts.process_result_value(value2, DIALECT)
+    assert result == value1
+    if value1 is not None:
+        assert isinstance(result, Timestamp)
 
 
 @pytest.mark.parametrize(
     "value1,value2",
     [
         (None, None),
-        (UUID, str(UUID).encode()),
-        ("123456789", b"123456789"),
+        (UUID, UUID.bytes),
     ],
 )
 def test_uuid_process(value1, value2):
-    uuid_ = database._Uuid(36)
+    uuid_ = database._Uuid()
     assert uuid_.process_bind_param(value1, DIALECT) == value2
     assert uuid_.process_result_value(value2, DIALECT) == value1
+
+
+@pytest.mark.parametrize(
+    "value1,value2",
+    [
+        (None, None),
+        (b"20230102030405", Timestamp(2023, 1, 2, 3, 4, 5)),
+        ("20230102030405", Timestamp(2023, 1, 2, 3, 4, 5)),
+    ],
+)
+def test_legacy_timestamp(value1, value2):
+    assert database._legacy_timestamp(value1) == value2
+
+
+def test_legacy_uuid():
+    assert database._legacy_uuid(None) is None
+    assert database._legacy_uuid(str(UUID).encode()) == UUID
+    legacy = database._legacy_uuid(b"123456789")
+    assert isinstance(legacy, uuid.UUID)
+    assert legacy == database._legacy_uuid("123456789")
+    assert legacy != database._legacy_uuid(b"123456780")
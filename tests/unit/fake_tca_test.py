@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import json
+
+from testing.fake_tca import Behavior, FakeTCA
+
+
+def test_submission_to_report():
+    api = FakeTCA(Behavior(seed=1))
+    status, data = api.respond(
+        "POST",
+        "/api/v1/submissions",
+        json.dumps({"title": "unit test submission"}).encode(),
+    )
+    assert status == 201
+    assert data["status"] == "CREATED"
+    path = f"/api/v1/submissions/{data['id']}"
+    assert api.respond("GET", path, b"")[1]["status"] == "CREATED"
+    assert api.respond("GET", f"{path}/similarity", b"")[0] == 404
+    assert api.respond("PUT", f"{path}/original", b"text")[0] == 202
+    assert api.respond("GET", path, b"")[1]["status"] == "COMPLETE"
+    assert api.respond("PUT", f"{path}/similarity", b"{}")[0] == 202
+    status, data = api.respond("GET", f"{path}/similarity", b"")
+    assert status == 200
+    assert data["status"] == "COMPLETE"
+    assert data["top_source_largest_matched_word_count"] == 100
+    status, data = api.respond(
+        "GET",
+        f"{path}/similarity/view/sources",
+        b"",
+    )
+    assert status == 200
+    assert data["match_aggregates"][0]["match_sources"][0]["link"]
+    assert api.stats["report_sources"] == 1
+
+
+def test_rate_limit(mocker):
+    mocker.patch("testing.fake_tca.time.monotonic", return_value=100.0)
+    api = FakeTCA(Behavior(rate_limit=1))
+    assert api.respond("GET", "/api/v1/eula/latest", b"")[0] == 200
+    assert api.respond("GET", "/api/v1/eula/latest", b"")[0] == 429
+    assert api.stats == {"eula": 1, "429": 1}
+
+
+def test_error_rate():
+    api = FakeTCA(Behavior(error_rate=1))
+    assert api.respond("GET", "/api/v1/eula/latest", b"")[0] == 500
+    assert api.stats == {"500": 1}
+
+
+def test_not_found():
+    api = FakeTCA()
+    path = "/api/v1/submissions/7b3074cf-4d3b-4648-8c68-f56aee0f1058"
+    assert api.respond("GET", path, b"")[0] == 404
+    assert api.respond("DELETE", path, b"")[0] == 404
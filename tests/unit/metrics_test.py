@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from copypatrol_backend import metrics
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def _samples(text):
+    return [line for line in text.splitlines() if not line.startswith("#")]
+
+
+def test_render_empty():
+    text = metrics.render()
+    assert text.endswith("# EOF\n")
+    assert "# TYPE copypatrol_diffs counter" in text
+    assert _samples(text) == []
+
+
+def test_counter():
+    metrics.increment("copypatrol_diffs", site="en.wikipedia.org", stage="a")
+    metrics.increment(
+        "copypatrol_diffs",
+        amount=2,
+        site="en.wikipedia.org",
+        stage="a",
+    )
+    metrics.increment("copypatrol_diffs", site='a"b\\c', stage="b")
+    assert _samples(metrics.render()) == [
+        'copypatrol_diffs_total{site="a\\"b\\\\c",stage="b"} 1',
+        'copypatrol_diffs_total{site="en.wikipedia.org",stage="a"} 3',
+    ]
+
+
+def test_histogram():
+    name = "copypatrol_tca_request_seconds"
+    metrics.observe(name, 0.2, endpoint="GET /")
+    metrics.observe(name, 100, endpoint="GET /")
+    samples = _samples(metrics.render())
+    assert f'{name}_bucket{{endpoint="GET /",le="0.1"}} 0' in samples
+    assert f'{name}_bucket{{endpoint="GET /",le="0.25"}} 1' in samples
+    assert f'{name}_bucket{{endpoint="GET /",le="60.0"}} 1' in samples
+    assert f'{name}_bucket{{endpoint="GET /",le="+Inf"}} 2' in samples
+    assert f'{name}_count{{endpoint="GET /"}} 2' in samples
+    assert f'{name}_sum{{endpoint="GET /"}} 100.2' in samples
+
+
+def test_timed(mocker):
+    mocker.patch(
+        "copypatrol_backend.metrics.time.perf_counter",
+        side_effect=[10.0, 10.5],
+    )
+    with pytest.raises(ValueError):
+        with metrics.timed("check_diff", site="en.wikipedia.org"):
+            raise ValueError
+    labels = 'site="en.wikipedia.org",stage="check_diff"'
+    assert f"copypatrol_stage_seconds_sum{{{labels}}} 0.5" in _samples(
+        metrics.render()
+    )
+
+
+def test_gauge(tmp_path):
+    metrics.set_gauge(
+        "copypatrol_queue_depth",
+        lambda: {(("status", "PENDING"),): 3},
+    )
+    path = tmp_path / "metrics.txt"
+    metrics.write(str(path))
+    assert _samples(path.read_text()) == [
+        'copypatrol_queue_depth{status="PENDING"} 3'
+    ]
+
+
+def test_start_writer(tmp_path):
+    path = tmp_path / "metrics.txt"
+    stop = metrics.start_writer(str(path), interval=0.01)
+    try:
+        for _ in range(500):
+            if path.exists():
+                break
+            time.sleep(0.01)
+    finally:
+        stop.set()
+    assert path.read_text().endswith("# EOF\n")
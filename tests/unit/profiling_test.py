@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import cProfile
+import difflib
+import re
+
+from copypatrol_backend import profiling
+
+
+def _work():
+    text = "foo bar baz " * 200
+    re.sub(r"ba(.)", r"\1", text)
+    difflib.SequenceMatcher(None, text, text[::-1]).get_opcodes()
+
+
+def test_categories():
+    profile = cProfile.Profile()
+    profile.enable()
+    _work()
+    profile.disable()
+    categories = profiling._categories(profile)
+    assert set(categories) == set(profiling.CATEGORIES)
+    assert categories["regex"] > 0
+    assert categories["difflib"] > 0
+    assert categories["mwparserfromhell"] == 0
+
+
+def test_profiler_run(tmp_path):
+    path = tmp_path / "profile.txt"
+    with profiling.Profiler(str(path), title="check-changes"):
+        _work()
+    report = path.read_text()
+    assert report.startswith("profile of check-changes\nelapsed: ")
+    assert "time by category (own time):" in report
+    assert "_work" in report
+    assert "allocations still held" in report
+    assert profiling._ACTIVE is None
+
+
+def test_profiler_diffs(tmp_path, mocker):
+    path = tmp_path / "profile.txt"
+    mocker.patch(
+        "copypatrol_backend.profiling.random.random",
+        side_effect=[0.05, 0.5],
+    )
+    with profiling.Profiler(str(path), title="test", diff_rate=0.1) as p:
+        with profiling.diff("revision 1 of en.wikipedia.org"):
+            _work()
+        with profiling.diff("revision 2 of en.wikipedia.org"):
+            _work()
+    assert [diff.label for diff in p.diffs] == [
+        "revision 1 of en.wikipedia.org"
+    ]
+    report = path.read_text()
+    assert "1 sampled diffs" in report
+    assert "== revision 1 of en.wikipedia.org: " in report
+    assert "revision 2" not in report
+    assert "== all sampled diffs ==" in report
+
+
+def test_diff_inactive():
+    with profiling.diff("revision 1 of en.wikipedia.org"):
+        pass
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import gzip
+import json
+
+from testing.replay_stream import Event, load_events, replay
+
+
+def _event(dt: str, rev_id: int) -> dict[str, object]:
+    return {"meta": {"dt": dt}, "rev_id": rev_id}
+
+
+def test_load_events(tmp_path):
+    path = str(tmp_path / "events.jsonl.gz")
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(_event("2023-05-01T00:00:00Z", 1)) + "\n\n")
+        f.write(json.dumps(_event("2023-05-01T00:00:02.5Z", 2)) + "\n")
+    events = load_events(path)
+    assert [event.offset for event in events] == [0.0, 2.5]
+    assert json.loads(events[1].data)["rev_id"] == 2
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _replay(events, *, speed, first=0):
+    clock = _Clock()
+    written = []
+    count = replay(
+        events,
+        lambda message: written.append((clock.now, message)),
+        speed=speed,
+        first=first,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+    assert count == len(written)
+    return written
+
+
+EVENTS = [Event(0.0, "{}"), Event(10.0, "{}"), Event(30.0, "{}")]
+
+
+def test_replay_speed():
+    assert [now for now, _ in _replay(EVENTS, speed=1)] == [0, 10, 30]
+    assert [now for now, _ in _replay(EVENTS, speed=10)] == [0, 1, 3]
+    assert [now for now, _ in _replay(EVENTS, speed=0)] == [0, 0, 0]
+
+
+def test_replay_resume():
+    written = _replay(EVENTS, speed=10, first=1)
+    assert [now for now, _ in written] == [0, 2]
+    assert written[0][1] == b"event: message\nid: 1\ndata: {}\n\n"
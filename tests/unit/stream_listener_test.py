@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+from typing import Any
 
 import pytest
 import pywikibot
@@ -8,7 +9,7 @@ import pywikibot
 from copypatrol_backend import stream_listener
 
 
-DATA1 = {
+DATA1: dict[str, Any] = {
     "meta": {
         "domain": "en.wikipedia.org",
         "uri": "https://en.wikipedia.org/wiki/Wikipedia",
@@ -23,7 +24,7 @@ DATA1 = {
     "rev_parent_id": 0,
     "rev_id": 1,
 }
-DATA2 = {
+DATA2: dict[str, Any] = {
     "meta": {
         "domain": "es.wikipedia.org",
         "uri": "https://es.wikipedia.org/wiki/Ayuda:Espacio de nombres",
@@ -38,7 +39,7 @@ DATA2 = {
     "rev_parent_id": 0,
     "rev_id": 1,
 }
-DATA3 = {
+DATA3: dict[str, Any] = {
     "meta": {
         "domain": "fr.wikipedia.org",
         "uri": "https://fr.wikipedia.org/wiki/Wikipédia",
@@ -67,6 +68,72 @@ def test_site_filter(data, expected):
     assert stream_listener._site_filter(data) == expected
 
 
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (
+            {"meta": {"stream": "mediawiki.page-delete"}},
+            True,
+        ),
+        (
+            {
+                "meta": {"stream": "mediawiki.revision-tags-change"},
+                "tags": ["mw-reverted", "mw-manual-revert"],
+            },
+            True,
+        ),
+        (
+            {
+                "meta": {"stream": "mediawiki.revision-tags-change"},
+                "tags": ["mw-manual-revert"],
+            },
+            False,
+        ),
+    ],
+)
+def test_revert_filter(data, expected):
+    assert stream_listener._revert_filter(data) == expected
+
+
+def _event(rev_id, rev_parent_id, rev_len, page_id=1):
+    return {
+        "meta": {"domain": "en.wikipedia.org"},
+        "page_id": page_id,
+        "rev_id": rev_id,
+        "rev_parent_id": rev_parent_id,
+        "rev_len": rev_len,
+    }
+
+
+def test_size_delta_filter():
+    func = stream_listener._size_delta_filter(lambda: 500)
+    assert func(_event(1, 0, 600)) is True  # new page
+    assert func(_event(2, 1, 700)) is False
+    assert func(_event(3, 2, 1300)) is True
+    assert func(_event(5, 4, 1400)) is True  # unknown parent
+    assert func(_event(6, 5, 1500)) is False
+    assert func(_event(11, 10, 100, page_id=2)) is True  # unknown parent
+    assert func(_event(12, 11, 200, page_id=2)) is False
+
+
+def test_size_delta_filter_reload():
+    delta = 0
+    func = stream_listener._size_delta_filter(lambda: delta)
+    assert func(_event(1, 0, 600)) is True
+    assert func(_event(2, 1, 700)) is True  # disabled
+    delta = 500
+    assert func(_event(3, 2, 800)) is True  # not tracked while disabled
+    assert func(_event(4, 3, 900)) is False
+
+
+def test_page_lengths_maxsize():
+    lengths = stream_listener._PageLengths(maxsize=2)
+    for page_id in (1, 2, 3):
+        lengths.add(_event(page_id * 10, 0, 1000, page_id=page_id))
+    assert lengths.parent_length(_event(11, 10, 1000, page_id=1)) is None
+    assert lengths.parent_length(_event(31, 30, 1000, page_id=3)) == 1000
+
+
 class _Event:
     def __init__(self, data):
         self.event = "message"
@@ -101,3 +168,68 @@ def test_revision_stream(mocker):
     )
     revisions = list(stream_listener.revision_stream(site, total=1))
     assert revisions == [DATA1]
+
+
+def test_revision_stream_url(mocker):
+    source = mocker.patch(
+        "pywikibot.comms.eventstreams.EventSource",
+        side_effect=_source,
+    )
+    url = "http://127.0.0.1:8090/v2/stream/revision-create"
+    revisions = list(
+        stream_listener.revision_stream(
+            pywikibot.Site("en", "wikipedia"),
+            total=1,
+            url=url,
+        )
+    )
+    assert revisions == [DATA1]
+    assert source.call_args.kwargs["url"] == url
+
+
+def test_raw_revision_stream(mocker):
+    mocker.patch(
+        "pywikibot.comms.eventstreams.EventSource",
+        _source,
+    )
+    events = list(
+        stream_listener.raw_revision_stream(
+            pywikibot.Site("en", "wikipedia"),
+            total=3,
+        )
+    )
+    assert events == [DATA1, DATA2, DATA3]
+
+
+def _revert_source(**kwargs):
+    delete = dict(
+        DATA1, meta=dict(DATA1["meta"], stream="mediawiki.page-delete")
+    )
+    tags = dict(
+        DATA1,
+        meta=dict(DATA1["meta"], stream="mediawiki.revision-tags-change"),
+        tags=["mw-reverted"],
+    )
+    other_tags = dict(tags, tags=["foo"])
+    return iter(
+        [_Event(other_tags), _Event(DATA3), _Event(delete), _Event(tags)]
+    )
+
+
+def test_revert_stream(mocker):
+    mocker.patch(
+        "pywikibot._code_fam_from_url",
+        wraps=_code_fam_from_url,
+    )
+    mocker.patch("pywikibot.config.family", "wikipedia")
+    mocker.patch("pywikibot.config.mylang", "en")
+    site = pywikibot.Site()
+    mocker.patch(
+        "pywikibot.comms.eventstreams.EventSource",
+        _revert_source,
+    )
+    events = list(stream_listener.revert_stream(site, total=2))
+    assert [event["meta"]["stream"] for event in events] == [
+        "mediawiki.page-delete",
+        "mediawiki.revision-tags-change",
+    ]
@@ -5,6 +5,7 @@ from uuid import UUID
 import pytest
 import pywikibot
 
+from copypatrol_backend import metrics
 from copypatrol_backend.tca import Source, TurnitinCoreAPI
 from testing.resources import resource
 
@@ -22,6 +23,16 @@ def test_latest_eula_version():
     assert TurnitinCoreAPI()._latest_eula_version() == "v1beta"
 
 
+def test_accept_eula(mocker):
+    api = TurnitinCoreAPI()
+    accept = mocker.patch.object(api, "_accept_eula")
+    api.accept_eula()
+    accept.assert_not_called()
+    mocker.patch.object(api, "_latest_eula_version", return_value="v2")
+    api.accept_eula()
+    accept.assert_called_once_with("v2")
+
+
 def test_create_submission(mock_responses):
     mock_responses._add_from_file(
         file_path="testing/unit/create-submission.yaml"
@@ -49,6 +60,22 @@ def test_upload_submission(mock_responses):
     )
 
 
+def test_upload_submission_metrics(mock_responses):
+    mock_responses._add_from_file(
+        file_path="testing/unit/upload-submission.yaml"
+    )
+    metrics.clear()
+    TurnitinCoreAPI().upload_submission(SID, "text")
+    text = metrics.render()
+    metrics.clear()
+    labels = 'code="202",endpoint="PUT /submissions/{id}/original"'
+    assert f"copypatrol_tca_responses_total{{{labels}}} 1" in text
+    assert (
+        'copypatrol_tca_request_seconds_count{endpoint="GET /eula/latest"} 1'
+        in text
+    )
+
+
 def test_submission_info_complete(mock_responses):
     mock_responses._add_from_file(
         file_path="testing/unit/submission-info-complete.yaml"